@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for CuckooDrive. Run them from the repository root as modules, e.g.::
+
+    python -m benchmarks.write_copies
+"""
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how many bytes have to be uploaded to update a file after typical edits, once with
+the fixed-size parts of the PartedFS and once with the content-defined chunks of the ChunkedFS.
+The PartedFS updates files with updatefile, so both only upload the parts that have changed.
+
+Usage:
+  dedup [--file-size=<mb>] [--part-size=<kb>]
+  dedup (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --file-size=<mb>     Size of the edited file in MB [default: 16]
+  --part-size=<kb>     Max part size of the PartedFS and max chunk size of the ChunkedFS
+                       in KB [default: 1024]
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from io import BytesIO
+from os import urandom
+
+from docopt import docopt
+from fs.memoryfs import MemoryFS
+from fs.wrapfs import WrapFS
+
+from cuckoodrive.chunkedfs import ChunkedFS
+from cuckoodrive.partedfs import PartedFS
+from cuckoodrive.utils import kb, mb
+
+
+class UploadCountingFS(WrapFS):
+    """Counts the bytes written to the files of the wrapped fs, manifests are not counted"""
+
+    def __init__(self, fs):
+        super(UploadCountingFS, self).__init__(fs)
+        self.uploaded = 0
+
+    def setcontents(self, path, data=b"", *args, **kwargs):
+        if not path.endswith(".manifest"):
+            self.uploaded += len(data)
+        return self.wrapped_fs.setcontents(path, data, *args, **kwargs)
+
+    def open(self, path, mode="r", **kwargs):
+        fh = self.wrapped_fs.open(path, mode, **kwargs)
+        if "w" in mode or "a" in mode or "+" in mode:
+            write = fh.write
+
+            def counted_write(data):
+                self.uploaded += len(data)
+                return write(data)
+            fh.write = counted_write
+        return fh
+
+
+def insert_near_start(data):
+    return data[:kb(100)] + urandom(100) + data[kb(100):]
+
+
+def append(data):
+    return data + urandom(kb(64))
+
+
+def edit_middle(data):
+    middle = len(data) // 2
+    return data[:middle] + urandom(kb(4)) + data[middle + kb(4):]
+
+
+def delete_near_start(data):
+    return data[:kb(100)] + data[kb(100) + 100:]
+
+
+EDITS = [insert_near_start, append, edit_middle, delete_near_start]
+
+
+def partedfs(part_size):
+    return PartedFS(UploadCountingFS(MemoryFS()), part_size, use_manifest=True)
+
+
+def chunkedfs(part_size):
+    return ChunkedFS(UploadCountingFS(MemoryFS()), avg_chunk_size=part_size // 4,
+                     max_chunk_size=part_size)
+
+
+def update(create_fs, part_size, data, edited):
+    """
+    Write data to a new fs and update it with the edited data.
+    :returns bytes uploaded by the update
+    """
+    fs = create_fs(part_size)
+    fs.setcontents("benchmark.bin", data)
+    fs.wrapped_fs.uploaded = 0
+    fs.updatefile("benchmark.bin", BytesIO(edited))
+    uploaded = fs.wrapped_fs.uploaded
+    fs.close()
+    return uploaded
+
+
+def duplicate(create_fs, part_size, data):
+    """
+    Write the same data to two files.
+    :returns bytes uploaded for the second file
+    """
+    fs = create_fs(part_size)
+    fs.setcontents("benchmark.bin", data)
+    fs.wrapped_fs.uploaded = 0
+    fs.setcontents("benchmark-copy.bin", data)
+    uploaded = fs.wrapped_fs.uploaded
+    fs.close()
+    return uploaded
+
+
+def main():
+    arguments = docopt(__doc__)
+    file_size = mb(int(arguments["--file-size"]))
+    part_size = kb(int(arguments["--part-size"]))
+    data = urandom(file_size)
+
+    print("{0:>20} {1:>14} {2:>14}".format("edit", "PartedFS", "ChunkedFS"))
+    for edit in EDITS:
+        edited = edit(data)
+        print("{0:>20} {1:>14} {2:>14}".format(
+            edit.__name__,
+            update(partedfs, part_size, data, edited),
+            update(chunkedfs, part_size, data, edited)))
+    print("{0:>20} {1:>14} {2:>14}".format(
+        "duplicate_file",
+        duplicate(partedfs, part_size, data),
+        duplicate(chunkedfs, part_size, data)))
+
+
+if __name__ == "__main__":
+    main()
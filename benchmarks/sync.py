@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how long a SyncedCuckooDrive takes to synchronize synthetic user trees and how many
+operations it sends to the remotes. Every tree is synchronized three times:
+
+* initial: The tree is copied to empty remotes.
+* noop: The unchanged tree is synchronized again.
+* incremental: A tenth of the files have been changed and a few files have been added.
+
+The remotes are OSFS instances in temporary directories. Every tree is synchronized in its
+own process, the reported memory is the peak resident memory of that process so far.
+
+Usage:
+  sync [--tree=<name>]... [--remotes=<n>] [--jobs=<n>] [--scale=<f>] [--output=<file>]
+  sync (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --tree=<name>        Tree to synchronize, one of small_files, huge_files, deep_nesting and
+                       mixed, can be given multiple times. By default all trees are used.
+  --remotes=<n>        Number of remotes [default: 2]
+  --jobs=<n>           Number of files that are transferred at once [default: 4]
+  --scale=<f>          Factor for the number and size of the files [default: 1.0]
+  --output=<file>      Write the results as JSON to this file
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import Counter
+from multiprocessing import Pool
+from os import urandom
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+
+from docopt import docopt
+from fs.path import dirname, join
+from fs.tempfs import TempFS
+from fs.wrapfs import WrapFS
+
+from cuckoodrive import CuckooDriveFS, SyncedCuckooDrive
+from cuckoodrive.syncstate import SyncState
+from cuckoodrive.utils import kb, mb
+
+
+COUNTED_METHODS = ["open", "setcontents", "getcontents", "exists", "isdir", "isfile",
+                   "listdir", "listdirinfo", "getinfo", "getsize", "makedir", "remove",
+                   "removedir", "rename", "copy", "move", "settimes"]
+
+
+class OperationCountingFS(WrapFS):
+    """Counts the calls of every method of the wrapped fs"""
+
+    def __init__(self, fs):
+        super(OperationCountingFS, self).__init__(fs)
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+
+def _counted(name):
+    def method(self, *args, **kwargs):
+        self.count(name)
+        return getattr(self.wrapped_fs, name)(*args, **kwargs)
+    method.__name__ = str(name)
+    return method
+
+
+for _name in COUNTED_METHODS:
+    setattr(OperationCountingFS, _name, _counted(_name))
+
+
+def small_files(scale):
+    """Many small files in a few directories"""
+    rand = random.Random(1)
+    return [("/dir{0}/file{1}.txt".format(idx % 50, idx), rand.randint(kb(1), kb(16)))
+            for idx in range(int(2000 * scale))]
+
+
+def huge_files(scale):
+    """A few huge files"""
+    return [("/video{0}.mp4".format(idx), int(mb(64) * scale)) for idx in range(3)]
+
+
+def deep_nesting(scale):
+    """Few files in every level of a deeply nested tree"""
+    files, path = [], "/"
+    for level in range(int(40 * scale) or 1):
+        path = join(path, "level{0}".format(level))
+        files.extend((join(path, "file{0}.txt".format(idx)), kb(4)) for idx in range(5))
+    return files
+
+
+def mixed(scale):
+    """Small files, huge files and a nested tree next to each other"""
+    return [(join(name, path.lstrip("/")), size)
+            for name, tree in [("small", small_files), ("huge", huge_files),
+                               ("deep", deep_nesting)]
+            for path, size in tree(scale / 4)]
+
+
+TREES = [small_files, huge_files, deep_nesting, mixed]
+
+
+def write_file(fs, path, size):
+    if not fs.isdir(dirname(path)):
+        fs.makedir(dirname(path), recursive=True)
+    fs.setcontents(path, urandom(size))
+
+
+def change_tree(fs, files):
+    """Append to every tenth file and add a file for every hundredth"""
+    for path, _ in files[::10]:
+        with fs.open(path, "ab") as fh:
+            fh.write(urandom(kb(1)))
+    for idx in range(len(files) // 100 or 1):
+        write_file(fs, "/new{0}.txt".format(idx), kb(8))
+
+
+def sync(userfs, remotefs, remotes, sync_state, jobs):
+    """
+    Synchronize the user fs with a new drive.
+    :returns dict with the seconds it took, the operations per type and the peak memory
+    """
+    for remote in remotes:
+        remote.counts.clear()
+    # The drive reports every synchronized path on stdout
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        start = time.time()
+        drive = SyncedCuckooDrive(userfs, remotefs, sync_state=sync_state, jobs=jobs)
+        drive.close()
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    operations = Counter()
+    for remote in remotes:
+        operations.update(remote.counts)
+    return {
+        "seconds": elapsed,
+        "operations": dict(operations),
+        "peak_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def benchmark(tree_name, remote_count, jobs, scale):
+    """Synchronize a tree three times, see the module documentation"""
+    files = globals()[tree_name](scale)
+    userfs = TempFS()
+    remotes = [OperationCountingFS(TempFS()) for _ in range(remote_count)]
+    remotefs = CuckooDriveFS(remotes)
+    sync_state = SyncState()
+    try:
+        for path, size in files:
+            write_file(userfs, path, size)
+        phases = [("initial", sync(userfs, remotefs, remotes, sync_state, jobs)),
+                  ("noop", sync(userfs, remotefs, remotes, sync_state, jobs))]
+        change_tree(userfs, files)
+        phases.append(("incremental", sync(userfs, remotefs, remotes, sync_state, jobs)))
+        return [dict(result, tree=tree_name, phase=phase, files=len(files),
+                     bytes=sum(size for _, size in files)) for phase, result in phases]
+    finally:
+        sync_state.close()
+        remotefs.close()
+        userfs.close()
+
+
+def main():
+    arguments = docopt(__doc__)
+    tree_names = arguments["--tree"] or [tree.__name__ for tree in TREES]
+    remote_count = int(arguments["--remotes"])
+    jobs = int(arguments["--jobs"])
+    scale = float(arguments["--scale"])
+
+    print("{0:>14} {1:>12} {2:>10} {3:>10} {4:>12}  {5}".format(
+        "tree", "phase", "seconds", "ops", "peak KB", "operations"))
+    results = []
+    for tree_name in tree_names:
+        # A fresh process for every tree, so the peak memory of one tree doesn't hide another
+        pool = Pool(1)
+        try:
+            tree_results = pool.apply(benchmark, (tree_name, remote_count, jobs, scale))
+        finally:
+            pool.close()
+            pool.join()
+        for result in tree_results:
+            operations = result["operations"]
+            print("{0:>14} {1:>12} {2:>10.2f} {3:>10} {4:>12}  {5}".format(
+                tree_name, result["phase"], result["seconds"], sum(operations.values()),
+                result["peak_memory_kb"], " ".join(
+                    "{0}={1}".format(k, v) for k, v in sorted(operations.items()))))
+        results.extend(tree_results)
+
+    if arguments["--output"]:
+        report = {
+            "benchmark": "sync",
+            "remotes": remote_count,
+            "jobs": jobs,
+            "scale": scale,
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        with open(arguments["--output"], "wb") as output:
+            json.dump(report, output, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
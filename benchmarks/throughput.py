@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of the PartedFS for sequential writes, sequential reads, random reads
+and seeks. Every combination of part size, file size and number of WritableMultiFS backends
+is measured, the backends are MemoryFS or OSFS instances in a temporary directory. The
+PartedFS is configured like the one of the CuckooDriveFS.
+
+The results are printed as a table and can be written to a JSON file to compare them across
+releases.
+
+Usage:
+  throughput [--backend=<type>] [--part-size=<kb>]... [--file-size=<mb>]...
+             [--backends=<n>]... [--repeat=<n>] [--output=<file>]
+  throughput (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --backend=<type>     Type of the backends, memory or os [default: memory]
+  --part-size=<kb>     Max part size of the PartedFS in KB, can be given multiple times
+  --file-size=<mb>     Size of the benchmarked file in MB, can be given multiple times
+  --backends=<n>       Number of backends, can be given multiple times
+  --repeat=<n>         Number of runs of every combination, the best one counts [default: 3]
+  --output=<file>      Write the results as JSON to this file
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from itertools import product
+from os import urandom
+import json
+import platform
+import random
+import time
+
+from docopt import docopt
+from fs.memoryfs import MemoryFS
+from fs.tempfs import TempFS
+
+from cuckoodrive import CuckooDriveFS
+from cuckoodrive.multifs import WritableMultiFS
+from cuckoodrive.partedfs import PartedFS
+from cuckoodrive.utils import kb, mb
+
+BLOCK_SIZE = mb(1)
+RANDOM_READ_SIZE = kb(64)
+RANDOM_READS = 200
+SEEKS = 2000
+
+
+class MemoryBackend(MemoryFS):
+    """A MemoryFS that reports free space, so the WritableMultiFS can write to it"""
+    _meta = dict(MemoryFS._meta, free_space=mb(1024 * 1024))
+
+
+def create_backend(backend_type):
+    return MemoryBackend() if backend_type == "memory" else TempFS()
+
+
+def create_fs(backend_type, backends, part_size):
+    """Create a PartedFS on top of a WritableMultiFS with the given number of backends"""
+    multifs = WritableMultiFS(max_workers=min(CuckooDriveFS.max_workers, backends))
+    for idx in range(backends):
+        multifs.addfs("Backend{0}".format(idx), create_backend(backend_type))
+    return PartedFS(multifs, part_size, use_manifest=CuckooDriveFS.use_manifest,
+                    upload_workers=CuckooDriveFS.upload_workers,
+                    prefetch_parts=CuckooDriveFS.prefetch_parts)
+
+
+def sequential_write(fs, data):
+    """:returns bytes written"""
+    with fs.open("benchmark.bin", "wb") as fh:
+        for offset in range(0, len(data), BLOCK_SIZE):
+            fh.write(data[offset:offset + BLOCK_SIZE])
+    return len(data)
+
+
+def sequential_read(fs, data):
+    """:returns bytes read"""
+    read = 0
+    with fs.open("benchmark.bin", "rb") as fh:
+        while True:
+            block = fh.read(BLOCK_SIZE)
+            if not block:
+                break
+            read += len(block)
+    return read
+
+
+def random_read(fs, data):
+    """:returns bytes read"""
+    rand = random.Random(42)
+    read = 0
+    with fs.open("benchmark.bin", "rb") as fh:
+        for _ in range(RANDOM_READS):
+            fh.seek(rand.randrange(max(1, len(data) - RANDOM_READ_SIZE)))
+            read += len(fh.read(RANDOM_READ_SIZE))
+    return read
+
+
+def seek(fs, data):
+    """:returns number of seeks, every seek is followed by a read of one byte"""
+    rand = random.Random(42)
+    with fs.open("benchmark.bin", "rb") as fh:
+        for _ in range(SEEKS):
+            fh.seek(rand.randrange(len(data)))
+            fh.read(1)
+    return SEEKS
+
+
+OPERATIONS = [sequential_write, sequential_read, random_read, seek]
+
+
+def measure(operation, fs, data, repeat):
+    """
+    Run the operation repeat times.
+    :returns amount processed per second of the fastest run
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        amount = operation(fs, data)
+        elapsed = max(time.time() - start, 1e-9)
+        best = max(best, amount / elapsed) if best is not None else amount / elapsed
+    return best
+
+
+def benchmark(backend_type, part_size, file_size, backends, repeat):
+    """:returns dict with the MB/s of every operation and the seeks per second"""
+    data = urandom(file_size)
+    fs = create_fs(backend_type, backends, part_size)
+    try:
+        result = {}
+        for operation in OPERATIONS:
+            rate = measure(operation, fs, data, repeat)
+            if operation is seek:
+                result["seeks_per_s"] = rate
+            else:
+                result[operation.__name__ + "_mb_per_s"] = rate / mb(1)
+        return result
+    finally:
+        fs.close()
+
+
+def main():
+    arguments = docopt(__doc__)
+    backend_type = arguments["--backend"]
+    part_sizes = [kb(int(p)) for p in arguments["--part-size"]] or [mb(1), mb(10)]
+    file_sizes = [mb(int(f)) for f in arguments["--file-size"]] or [mb(8), mb(64)]
+    backend_counts = [int(b) for b in arguments["--backends"]] or [1, 2, 4]
+    repeat = int(arguments["--repeat"])
+
+    print("{0:>10} {1:>10} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+        "part", "file", "backends", "write", "read", "random", "seeks/s"))
+    results = []
+    for part_size, file_size, backends in product(part_sizes, file_sizes, backend_counts):
+        result = benchmark(backend_type, part_size, file_size, backends, repeat)
+        print("{0:>10} {1:>10} {2:>8} {3:>10.1f} {4:>10.1f} {5:>10.1f} {6:>10.0f}".format(
+            part_size, file_size, backends, result["sequential_write_mb_per_s"],
+            result["sequential_read_mb_per_s"], result["random_read_mb_per_s"],
+            result["seeks_per_s"]))
+        result.update(part_size=part_size, file_size=file_size, backends=backends)
+        results.append(result)
+
+    if arguments["--output"]:
+        report = {
+            "benchmark": "throughput",
+            "backend": backend_type,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        with open(arguments["--output"], "wb") as output:
+            json.dump(report, output, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how many bytes the write path of a PartedFile copies for every byte written to it.
+The written data is wrapped into a string type that counts the bytes of every slice or
+concatenation made of it, the copies the backend makes to store the data are not counted.
+
+Usage:
+  write_copies [--file-size=<mb>] [--part-size=<kb>] [--chunk-size=<kb>]...
+  write_copies (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --file-size=<mb>     Size of the written file in MB [default: 32]
+  --part-size=<kb>     Max part size of the PartedFS in KB [default: 1024]
+  --chunk-size=<kb>    Size of a single write call in KB, can be given multiple times
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from os import urandom
+import time
+
+from docopt import docopt
+from fs.memoryfs import MemoryFS
+
+from cuckoodrive.partedfs import PartedFS
+from cuckoodrive.utils import kb, mb
+
+
+class CopyCounter(object):
+    copied = 0
+
+
+class CountedBytes(bytes):
+    """
+    Bytes that count the bytes of every new string sliced or concatenated out of them.
+    The new strings are counted as well.
+    """
+
+    def _counted(self, result):
+        CopyCounter.copied += len(result)
+        return CountedBytes(result)
+
+    def __getitem__(self, key):
+        result = bytes.__getitem__(self, key)
+        return self._counted(result) if isinstance(key, slice) else result
+
+    def __getslice__(self, start, end):
+        return self._counted(bytes.__getslice__(self, start, end))
+
+    def __add__(self, other):
+        return self._counted(bytes.__add__(self, other))
+
+    def __radd__(self, other):
+        return self._counted(bytes(other) + bytes(self))
+
+
+def write_file(chunk, file_size, part_size):
+    """
+    Write file_size bytes in chunks to a PartedFS.
+    :returns bytes copied by the write path, seconds it took
+    """
+    fs = PartedFS(MemoryFS(), part_size)
+    CopyCounter.copied = 0
+    start = time.time()
+    with fs.open("benchmark.bin", mode="wb") as fh:
+        for _ in range(file_size // len(chunk)):
+            fh.write(chunk)
+    elapsed = time.time() - start
+    fs.close()
+    return CopyCounter.copied, elapsed
+
+
+def main():
+    arguments = docopt(__doc__)
+    file_size = mb(int(arguments["--file-size"]))
+    part_size = kb(int(arguments["--part-size"]))
+    chunk_sizes = [kb(int(c)) for c in arguments["--chunk-size"]] or [kb(100), kb(1000), mb(8)]
+
+    print("{0:>12} {1:>14} {2:>14} {3:>10} {4:>10}".format(
+        "chunk", "written", "copied", "copies/B", "MB/s"))
+    for chunk_size in chunk_sizes:
+        chunk = CountedBytes(urandom(chunk_size))
+        written = file_size // chunk_size * chunk_size
+        copied, elapsed = write_file(chunk, file_size, part_size)
+        print("{0:>12} {1:>14} {2:>14} {3:>10.3f} {4:>10.1f}".format(
+            chunk_size, written, copied, copied / written, written / mb(1) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,33 +4,41 @@ CuckooDrive emulates a user filesystem that aggregates all the free space provid
 cloud storage providers into one big drive.
 
 Usage:
-  cuckoodrive sync [--watch] [-v | --verbose] --remotes <fs_uri>...
+  cuckoodrive sync [--watch] [options] --remotes <fs_uri>...
   cuckoodrive (-h | --help)
   cuckoodrive --version
 
 Options:
-  -h --help     Show this screen.
-  --remotes     Filesystem URIs of remote filesystems
-  --version     Show version
-  --watch       Watch path for changes and synchronize them automatically
-  -v --verbose  Print all filesystem actions to stdout
+  -h --help               Show this screen.
+  --remotes               Filesystem URIs of remote filesystems
+  --version               Show version
+  --watch                 Watch path for changes and synchronize them automatically
+  --quiet-period=<s>      Seconds without changes before they are synchronized [default: 0.5]
+  --jobs=<n>              Number of files that are compared and transferred at once [default: 4]
+  --metrics=<file>        Collect metrics of every filesystem layer and dump them to this file
+  --metrics-format=<f>    Format of the metrics, json or prometheus [default: json]
+  --metrics-interval=<s>  Seconds between two dumps of the metrics [default: 60]
 
 Example #1:
   cuckoodrive sync --remotes dropbox://morgenkaffee  googledrive://morgenkaffe
 """
 from __future__ import print_function, division, absolute_import, unicode_literals
+from contextlib import contextmanager
 import os
 import signal
 import sys
 import json
+import threading
+import time
 
 from docopt import docopt
 from blessings import Terminal
 
 from fs.opener import opener, fsopendir
-from fs.wrapfs.debugfs import DebugFS
 from fs.osfs import OSFS
-from fs.utils import copyfile, copydir
+from fs.errors import FSError
+from fs.path import dirname
+from fs.utils import copyfile_non_atomic, copydir
 from fs.wrapfs import WrapFS
 from fs.watch import ensure_watchable
 from fs.appdirfs import UserDataFS
@@ -38,13 +46,22 @@ import fs.watch
 
 from dropboxfs import DropboxOpener
 
+from cuckoodrive.asyncfs import AsyncFS
+from cuckoodrive.chunkedfs import ChunkedFS
+from cuckoodrive.events import EventQueue
+from cuckoodrive.governor import GovernedFS, TokenBucket
+from cuckoodrive.metrics import Metrics, MetricsDumper, MetricsFS
 from cuckoodrive.multifs import WritableMultiFS
 from cuckoodrive.partedfs import PartedFS
+from cuckoodrive.pipeline import Pipeline
+from cuckoodrive.simulatedfs import SimulatedOpener
+from cuckoodrive.syncstate import SyncState, sync_state_file
 from cuckoodrive.utils import mb
 from cuckoodrive.filelock import FileLock
 
 term = Terminal()
 settings_fs = UserDataFS("cuckoodrive", appauthor="Lukas Martinelli")
+location_index_file = "location_index.json"
 
 
 class CuckooDriveFS(WrapFS):
@@ -70,70 +87,232 @@ class CuckooDriveFS(WrapFS):
     This works for all filesystem that have an Opener implemented::
         fs = CuckooDriveFS.from_uris(remote_uris=['dropbox://morgenkaffee/cuckoo'])
 
-    When the verbose option is specified, each filesystem is wrapped in a DebugFS that logs
-    every action.
+    When metrics are given, the PartedFS, the WritableMultiFS and every remote are wrapped in
+    a MetricsFS that records the calls, bytes and latencies of each layer::
+        fs = CuckooDriveFS(remote_filesystems, metrics=Metrics())
 
     Manipulate the maximum file_size of a PartFile of the PartedFS::
         CuckooDriveFS.file_size = mb(40)
+
+    The PartedFS keeps a manifest for every file so that metadata lookups don't have to list
+    the directories on all remotes. Disable it to only use the parts::
+        CuckooDriveFS.use_manifest = False
+
+    Operations that affect several remotes (like makedir) are run concurrently with at most
+    max_workers threads::
+        CuckooDriveFS.max_workers = 1
+
+    Files are striped: complete parts are uploaded in the background by upload_workers threads,
+    so the parts of a large file are uploaded to several remotes at the same time. Set it to 0
+    to write the parts directly::
+        CuckooDriveFS.upload_workers = 0
+
+    Files that are read sequentially are read ahead: the next prefetch_parts parts are
+    downloaded in the background while the current part is read::
+        CuckooDriveFS.prefetch_parts = 0
+
+    Files can also be split at content-defined boundaries with a ChunkedFS instead of the
+    fixed-size parts of the PartedFS. An edit then only changes the chunks around it and chunks
+    with the same content are only stored once, even across files. The chunks are file_size / 4
+    big on average and never bigger than file_size::
+        CuckooDriveFS.chunking = "content"
+
+    Cloud providers throttle clients that send too many requests at once. Every remote is
+    limited to max_remote_operations concurrent calls (None for no limit), so a slow remote
+    can't take all threads of a concurrent sync. The remotes can also be limited to
+    remote_upload_rate and remote_download_rate bytes per second. upload_rate limits the
+    uploads of all remotes together, e.g. to leave some of a shared uplink to others::
+        CuckooDriveFS.max_remote_operations = 4
+        CuckooDriveFS.upload_rate = mb(1)
     """
-    skip_methods = ('listdir', 'listdirinfo', 'getinfo', 'exists', 'isfile', 'getsize')
     file_size = mb(10)
-
-    def __init__(self, remote_filesystems, verbose=False):
-        self.verbose = verbose
+    use_manifest = True
+    max_workers = 8
+    upload_workers = 4
+    prefetch_parts = 2
+    chunking = "fixed"
+    max_remote_operations = 8
+    remote_upload_rate = None
+    remote_download_rate = None
+    upload_rate = None
+
+    def __init__(self, remote_filesystems, metrics=None):
+        self.metrics = metrics
         fs = self._create_fs(remote_filesystems)
         super(CuckooDriveFS, self).__init__(fs)
 
     def _create_fs(self, remote_filesystems):
         """Create the cuckoo drive fileystem out of the remote filesystems"""
-        multifs = CuckooDriveFS.verbose_fs(WritableMultiFS(), "MultiFS", self.verbose)
+        self.multifs = WritableMultiFS(max_workers=min(self.max_workers, len(remote_filesystems)))
+        multifs = self.instrument_fs(self.multifs, "MultiFS")
+        uplink = TokenBucket(self.upload_rate) if self.upload_rate else None
         for idx, remote_fs in enumerate(remote_filesystems):
-            multifs.addfs("Remote{0}".format(idx), remote_fs)
-
-        return CuckooDriveFS.verbose_fs(PartedFS(multifs, self.file_size),
-                                        "PartedFS",
-                                        self.verbose)
-
-    @staticmethod
-    def verbose_fs(wrapped_fs, identifier, verbose):
-        """Wrap the filesystem into a DebugFS if the verbose option is specified"""
-        if verbose:
-            return DebugFS(wrapped_fs, identifier=identifier,
-                           skip=CuckooDriveFS.skip_methods, verbose=False)
+            name = "Remote{0}".format(idx)
+            # The remote is measured inside the governor, so its latencies don't include
+            # the time spent waiting for a slot or bandwidth
+            multifs.addfs(name, self.govern_fs(self.instrument_fs(remote_fs, name), uplink))
+
+        if self.chunking == "content":
+            self.partedfs = ChunkedFS(multifs, avg_chunk_size=self.file_size // 4,
+                                      max_chunk_size=self.file_size)
+        else:
+            self.partedfs = PartedFS(multifs, self.file_size, use_manifest=self.use_manifest,
+                                     upload_workers=self.upload_workers,
+                                     prefetch_parts=self.prefetch_parts)
+        return self.instrument_fs(self.partedfs, "PartedFS")
+
+    def updatefile(self, path, src_file):
+        """Update a file and only upload the parts that have changed (see PartedFS.updatefile)"""
+        return self.partedfs.updatefile(path, src_file)
+
+    def sweep(self):
+        """Remove the chunks that are no longer referenced (see ChunkedFS.sweep)"""
+        if isinstance(self.partedfs, ChunkedFS):
+            return self.partedfs.sweep()
+        return []
+
+    def govern_fs(self, remote_fs, uplink=None):
+        """Wrap the remote filesystem into a GovernedFS if any limit is specified"""
+        upload_limits = [TokenBucket(self.remote_upload_rate)] if self.remote_upload_rate else []
+        if uplink is not None:
+            upload_limits.append(uplink)
+        download_limits = []
+        if self.remote_download_rate:
+            download_limits.append(TokenBucket(self.remote_download_rate))
+
+        if self.max_remote_operations or upload_limits or download_limits:
+            return GovernedFS(remote_fs, max_operations=self.max_remote_operations,
+                              upload_limits=upload_limits, download_limits=download_limits)
+        return remote_fs
+
+    def instrument_fs(self, wrapped_fs, layer):
+        """Wrap the filesystem into a MetricsFS if metrics are collected"""
+        if self.metrics is not None:
+            return MetricsFS(wrapped_fs, self.metrics, layer)
         return wrapped_fs
 
     @classmethod
-    def from_uris(cls, remote_uris, verbose=False):
+    def from_uris(cls, remote_uris, metrics=None):
         """Create remote filesystem for each given uri and return them"""
-        def create_fs(idx, fs_uri):
-            return CuckooDriveFS.verbose_fs(fsopendir(fs_uri), "Remote{0}".format(idx), verbose)
-
-        remote_filesystems = [create_fs(idx, fs_uri) for idx, fs_uri in enumerate(remote_uris)]
-        return cls(remote_filesystems, verbose)
+        remote_filesystems = [fsopendir(fs_uri) for fs_uri in remote_uris]
+        return cls(remote_filesystems, metrics)
 
 
 class SyncedCuckooDrive(object):
     """
     Watches and synchronizes a local path with the remote_fs.
     The underlying CuckooDriveFS is initialized from the passed remote_uris.
+
+    If a sync_state is given, every synchronized path is recorded in it. Later syncs only
+    compare paths with the remotes whose local size or modification time has changed.
+
+    When watching, every event only synchronizes the path it is about: created and modified
+    paths are copied, removed paths are removed and moved paths are renamed on the remotes.
+    The whole tree is only compared again if the watcher reports an overflow or reconcile
+    is called. The events are queued and synchronized in batches once no new event has
+    arrived for quiet_period seconds (see EventQueue).
+
+    A full sync transfers up to jobs files and compares up to jobs * lookups_per_job files
+    with the remotes at the same time.
+
+    The remotes are locked while they are synchronized. While the lock is held, a background
+    thread renews its heartbeat every heartbeat_interval seconds, even during a long transfer.
+    A lock whose heartbeat is older than lock_stale_timeout seconds has been left over by a
+    crashed drive and is broken::
+        SyncedCuckooDrive.lock_stale_timeout = None
+
+    While watching, the drive should be kept alive with wait, which sleeps and only wakes up
+    every housekeeping_interval seconds to refresh the free space of the remotes.
     """
-    def __init__(self, userfs, remotefs, mode="update", watch=False, verbose=False):
+    heartbeat_interval = 60
+    lock_stale_timeout = 600
+    housekeeping_interval = 60
+    lookups_per_job = 4
+
+    def __init__(self, userfs, remotefs, mode="update", watch=False, verbose=False,
+                 sync_state=None, quiet_period=0.5, jobs=1):
         self.userfs = userfs
         self.remotefs = remotefs
         self.mode = mode
+        self.sync_state = sync_state
+        self.part_size = getattr(remotefs, "file_size", None)
+        self.events = None
+        self.jobs = jobs
+        self.lock = FileLock(self.remotefs, stale_timeout=self.lock_stale_timeout)
+        # The lock may only be acquired by one thread of the drive at a time
+        self._sync_lock = threading.Lock()
+        self._heartbeat_lock = threading.Lock()
+        self._last_heartbeat = 0
 
         if watch:
             ensure_watchable(self.userfs)
+            self.events = EventQueue(self.sync_events, quiet_period=quiet_period)
             self.userfs.add_watcher(self.userfs_changed)
 
-        with FileLock(self.remotefs):
-            self.sync_dirs()
-            self.sync_files()
+        with self.locked():
+            self.reconcile()
+
+    @contextmanager
+    def locked(self):
+        """Lock the remotes against other drives and the other threads of this drive"""
+        with self._sync_lock:
+            with self.lock:
+                self._last_heartbeat = time.time()
+                stopped = threading.Event()
+                heartbeat = threading.Thread(target=self._keep_lock_alive_until,
+                                             args=(stopped,), name="LockHeartbeat")
+                heartbeat.daemon = True
+                heartbeat.start()
+                try:
+                    yield
+                    # Released chunks are removed once per pass, while no other drive writes
+                    sweep = getattr(self.remotefs, "sweep", None)
+                    if sweep is not None:
+                        sweep()
+                finally:
+                    stopped.set()
+                    heartbeat.join()
+
+    def _keep_lock_alive_until(self, stopped):
+        while not stopped.wait(self.heartbeat_interval):
+            self.keep_lock_alive()
+
+    def keep_lock_alive(self):
+        """Touch the lock of the remotes if it is held and the last heartbeat is due"""
+        with self._heartbeat_lock:
+            if not self.lock.is_locked or \
+                    time.time() - self._last_heartbeat < self.heartbeat_interval:
+                return
+            self._last_heartbeat = time.time()
+            try:
+                self.lock.heartbeat()
+            except FSError:
+                # The lock has been released in the meantime
+                pass
+
+    def housekeeping(self):
+        """Refresh the free space of the remotes"""
+        multifs = getattr(self.remotefs, "multifs", None)
+        if multifs is not None:
+            multifs.refresh_free_space()
+
+    def wait(self, stopped=None):
+        """
+        Block while the events are synchronized in the background. Housekeeping is done
+        every housekeeping_interval seconds, otherwise the thread just sleeps.
+        :param stopped: Callable that returns True once waiting should stop
+        """
+        while not (stopped and stopped()):
+            time.sleep(self.housekeeping_interval)
+            try:
+                self.housekeeping()
+            except FSError as e:
+                print(term.red + " " * 4 + "housekeeping failed: {0}".format(e) + term.normal)
 
     @staticmethod
     def create_event_message(event):
         event_name = event.__class__.__name__.lower()
-        message = 4 * " " + event_name + " " + term.normal + event.path
+        message = 4 * " " + event_name + " " + term.normal + (event.path or "")
 
         if type(event) is fs.watch.CREATED:
             return term.green + message
@@ -147,44 +326,222 @@ class SyncedCuckooDrive(object):
             return message
 
     def userfs_changed(self, event):
-        ignored_events = (fs.watch.ACCESSED, fs.watch.CLOSED)
-        if type(event) not in ignored_events:
-            message = self.create_event_message(event)
-            print(message)
-            self.sync_dirs()
-            self.sync_files()
+        """
+        Queue a watch event. The queued events are coalesced and synchronized in one batch
+        once the user fs has been quiet for a moment. Without a queue the event is
+        synchronized right away.
+        """
+        if self.events is not None:
+            self.events.put(event)
+        elif type(event) not in EventQueue.ignored_events:
+            self.sync_events([event])
+
+    def sync_events(self, events):
+        """Synchronize a batch of watch events while holding the lock of the remotes"""
+        with self.locked():
+            for event in events:
+                try:
+                    self.sync_event(event)
+                except FSError as e:
+                    print(term.red + " " * 4 + "failed {0}: {1}".format(event.path, e) +
+                          term.normal)
+
+    def sync_event(self, event):
+        """
+        Synchronize only the path of a watch event. If the watcher has lost events, the
+        whole tree is reconciled.
+        """
+        message = self.create_event_message(event)
+        print(message)
+        if isinstance(event, fs.watch.OVERFLOW):
+            self.reconcile()
+        elif isinstance(event, (fs.watch.CREATED, fs.watch.MODIFIED)):
+            self.sync_path(event.path)
+        elif isinstance(event, fs.watch.REMOVED):
+            self.remove_path(event.path)
+        elif isinstance(event, fs.watch.MOVED_SRC):
+            # The source of a move out of the watched path has no destination
+            if event.destination is not None:
+                self.move_path(event.path, event.destination)
+        elif isinstance(event, fs.watch.MOVED_DST):
+            # A move with a known source has already been handled by its MOVED_SRC event
+            if event.source is None:
+                self.sync_path(event.path)
+
+    def reconcile(self):
+        """Compare the whole user fs with the remotes and synchronize everything that differs"""
+        self.sync_dirs()
+        self.sync_files()
+
+    def sync_path(self, path):
+        """Synchronize a single directory or file of the user fs"""
+        if self.userfs.isdir(path):
+            self.sync_dir(path)
+        elif self.userfs.isfile(path):
+            self.make_remote_parent(path)
+            self.sync_file(path, self.userfs.getinfo(path))
+
+    def make_remote_parent(self, path):
+        """Create the parent directory of a path on the remotes if it doesn't exist yet"""
+        parent = dirname(path)
+        if not self.remotefs.isdir(parent):
+            self.remotefs.makedir(parent, recursive=True)
+
+    def remove_path(self, path):
+        """Remove a directory or file that has been removed from the user fs"""
+        if self.remotefs.isdir(path):
+            self.remotefs.removedir(path, force=True)
+        elif self.remotefs.isfile(path):
+            self.remotefs.remove(path)
+        else:
+            return
+
+        print(term.red + " " * 4 + "removed " + path + term.normal)
+        if self.sync_state is not None:
+            self.sync_state.remove(path)
+
+    def move_path(self, src, dst):
+        """Rename a directory or file that has been moved on the user fs"""
+        if self.remotefs.exists(src):
+            if self.remotefs.exists(dst):
+                # The destination has been overwritten, it is patched below
+                self.remove_path(src)
+            else:
+                self.make_remote_parent(dst)
+                self.remotefs.rename(src, dst)
+                print(term.cyan + " " * 4 + "moved " + src + " to " + dst + term.normal)
+        if self.sync_state is not None:
+            self.sync_state.remove(src)
+        self.sync_path(dst)
+
+    def sync_dir(self, path):
+        """Copy a directory that does not exist on the remote fs"""
+        if self.sync_state is not None and self.sync_state.get(path) is not None:
+            return
+        if not self.remotefs.exists(path):
+            copydir((self.userfs, path), (self.remotefs, path))
+            print(term.green + " " * 4 + "copied " + path + term.normal)
+        if self.sync_state is not None:
+            self.sync_state.record(path)
 
     def sync_dirs(self):
         for path in self.userfs.walkdirs():
-            if not self.remotefs.exists(path):
-                copydir((self.userfs, path), (self.remotefs, path))
-                print(term.green + " " * 4 + "copied " + path + term.normal)
+            self.sync_dir(path)
 
     def has_conflict(self, src, dst):
         src_info = self.userfs.getinfo(src)
         dst_info = self.remotefs.getinfo(dst)
         return src_info["modified_time"] < dst_info["modified_time"]
 
-    def patchfile(self, path):
-        """Patch remote file with new user file if size has changed"""
-        user_info = self.userfs.getinfo(path)
+    def patchfile(self, path, user_info=None):
+        """
+        Patch remote file with new user file if size has changed.
+        If the remote fs supports it, only the parts that have changed are uploaded.
+        """
+        user_info = user_info or self.userfs.getinfo(path)
         remote_info = self.remotefs.getinfo(path)
 
         if user_info["size"] != remote_info["size"]:
-            copyfile(self.userfs, path, self.remotefs, path, overwrite=True)
-            print(term.yellow + " " * 4 + "updated " + path + term.normal)
+            self.uploadfile(path)
+
+    def uploadfile(self, path):
+        """Upload a user file that exists on the remote fs with a different content"""
+        if hasattr(self.remotefs, "updatefile"):
+            with self.userfs.open(path, mode="rb") as src_file:
+                self.remotefs.updatefile(path, src_file)
+        else:
+            copyfile_non_atomic(self.userfs, path, self.remotefs, path, overwrite=True)
+        print(term.yellow + " " * 4 + "updated " + path + term.normal)
+
+    def scan_files(self):
+        """
+        Walk the user fs and yield (path, user_info) for every file that has changed since
+        it has been synchronized the last time. Only the user fs is asked.
+        """
+        for path in self.userfs.walkfiles():
+            user_info = self.userfs.getinfo(path)
+            if self.sync_state is None or \
+                    not self.sync_state.unchanged(path, user_info, self.part_size):
+                yield path, user_info
+
+    def diff_file(self, item):
+        """
+        Compare a scanned file with the remote fs.
+        :param item: (path, user_info) tuple of a scanned file
+        :returns (path, user_info, action) tuple where action is "copy" or "patch",
+        or None if the file is already up to date on the remote fs
+        """
+        path, user_info = item
+        if not self.remotefs.exists(path):
+            return path, user_info, "copy"
+        if self.remotefs.getinfo(path)["size"] != user_info["size"]:
+            return path, user_info, "patch"
+
+        if self.sync_state is not None:
+            self.sync_state.record(path, user_info, self.part_size)
+        return None
+
+    def transfer_file(self, item):
+        """
+        Copy or patch a file as decided by diff_file.
+        :param item: (path, user_info, action) tuple returned by diff_file
+        """
+        path, user_info, action = item
+        if action == "copy":
+            # Unlike copyfile it doesn't lock the user fs, so files are transferred in parallel
+            copyfile_non_atomic(self.userfs, path, self.remotefs, path, overwrite=False)
+            print(term.green + " " * 4 + "copied " + path + term.normal)
+        else:
+            self.uploadfile(path)
+
+        if self.sync_state is not None:
+            self.sync_state.record(path, user_info, self.part_size)
+
+    def sync_file(self, path, user_info):
+        """Copy a file that doesn't exist on remote fs or patch it if it does exist"""
+        if self.sync_state is not None and \
+                self.sync_state.unchanged(path, user_info, self.part_size):
+            return
+
+        item = self.diff_file((path, user_info))
+        if item is not None:
+            self.transfer_file(item)
 
     def sync_files(self):
-        """Copy files that don't exist on remote fs or patch them if they do exist"""
+        """
+        Copy files that don't exist on remote fs or patch them if they do exist.
+        With more than one job, the user fs is scanned, the scanned files are compared with
+        the remote fs and the changed files are transferred at the same time (see Pipeline).
+        The comparisons are run on an AsyncFS. Each remote only serves
+        CuckooDriveFS.max_remote_operations of its calls at a time, so a slow remote doesn't
+        take all threads.
+        """
         if self.mode != "update":
             raise NotImplementedError("Only the update mode has been implemented yet.")
 
-        for path in self.userfs.walkfiles():
-            if self.remotefs.exists(path):
-                self.patchfile(path)
-            else:
-                copyfile(self.userfs, path, self.remotefs, path, overwrite=False)
-                print(term.green + " " * 4 + "copied " + path + term.normal)
+        if self.jobs <= 1:
+            for path, user_info in self.scan_files():
+                item = self.diff_file((path, user_info))
+                if item is not None:
+                    self.transfer_file(item)
+            return
+
+        # Comparing a file only takes a few small requests that mostly wait for the remotes,
+        # so more of them run at the same time than transfers
+        with AsyncFS(self.remotefs, concurrency=self.jobs * self.lookups_per_job) as remotefs:
+            diffs = (remotefs.submit(self.diff_file, item) for item in self.scan_files())
+            Pipeline(diffs, [(self.transfer_diffed, self.jobs)], queue_size=self.jobs * 4).run()
+
+    def transfer_diffed(self, diff):
+        """Transfer a file once it has been compared (see diff_file)"""
+        item = diff.result()
+        if item is not None:
+            self.transfer_file(item)
+
+    def close(self):
+        """Synchronize the queued events and stop watching"""
+        if self.events is not None:
+            self.events.close()
 
 
 class CuckooDropboxOpener(DropboxOpener):
@@ -215,28 +572,49 @@ def main():
     arguments = docopt(__doc__, version="CuckooDrive 0.0.1")
     path = os.getcwd()
     watch = arguments["--watch"]
-    verbose = arguments["--verbose"]
     remote_uris = arguments["<fs_uri>"]
+    quiet_period = float(arguments["--quiet-period"])
+    jobs = int(arguments["--jobs"])
+    metrics = Metrics() if arguments["--metrics"] else None
+    drive = None
+    dumper = None
 
     def register_openers():
         opener.add(CuckooDropboxOpener)
+        opener.add(SimulatedOpener)
+
+    def save_location_index():
+        remotefs.multifs.save_location_index(settings_fs, location_index_file)
 
     def sync_aborted(signal, frame):
+        if drive is not None:
+            drive.close()
+        save_location_index()
+        sync_state.close()
+        if dumper is not None:
+            dumper.close()
         print('Stopped synchronizing!')
         sys.exit(0)
 
-    def wait_abort():
-        while True:
-            continue
-
     register_openers()
-    remotefs = CuckooDriveFS.from_uris(remote_uris, verbose=verbose)
+    remotefs = CuckooDriveFS.from_uris(remote_uris, metrics=metrics)
+    remotefs.multifs.load_location_index(settings_fs, location_index_file)
     userfs = OSFS(path)
+    sync_state = SyncState(settings_fs.getsyspath(sync_state_file(path, remote_uris)))
 
     if arguments["sync"]:
         signal.signal(signal.SIGINT, sync_aborted)
         print(">>> CuckooDrive is synchronizing {0}".format(path))
-        SyncedCuckooDrive(userfs, remotefs, watch=watch, verbose=verbose)
+        if metrics is not None:
+            dumper = MetricsDumper(metrics, arguments["--metrics"],
+                                   interval=float(arguments["--metrics-interval"]),
+                                   format=arguments["--metrics-format"]).start()
+        drive = SyncedCuckooDrive(userfs, remotefs, watch=watch, sync_state=sync_state,
+                                  quiet_period=quiet_period, jobs=jobs)
+        save_location_index()
         if watch:
             print(">>> CuckooDrive is watching for changes. Press Ctrl-C to Stop.")
-            wait_abort()
+            # Sleeps until Ctrl-C calls sync_aborted
+            drive.wait()
+        elif dumper is not None:
+            dumper.close()
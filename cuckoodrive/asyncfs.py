@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import deque
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+from six import reraise
+
+
+class Future(object):
+    """
+    The result of an operation that runs in the background. It offers the same methods as
+    the concurrent.futures.Future of Python 3.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the operation and return its result or raise its error.
+        :raise TimeoutError: If the operation is not done after timeout seconds
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        if self._exc_info is not None:
+            reraise(*self._exc_info)
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the operation and return its error or None if it succeeded"""
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        """Call callback with the future once it is done, right away if it already is"""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """:param exc_info: The sys.exc_info() of the error"""
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def wait_all(futures, timeout=None):
+    """
+    Wait for all futures.
+    :returns List with the results in the order of the futures
+    """
+    return [future.result(timeout) for future in futures]
+
+
+class AsyncFS(object):
+    """
+    Runs the blocking calls of a filesystem on a thread pool and returns a Future for each
+    of them, so many small operations can wait for a high latency backend at the same time::
+
+        remote = AsyncFS(cuckoodrivefs, concurrency=64)
+        infos = wait_all([remote.getinfo(path) for path in paths])
+
+    At most concurrency operations are in flight, submitting more blocks until one of them
+    is done. Several AsyncFS (one per backend) can share a pool and still keep their own
+    limit::
+
+        pool = ThreadPool(96)
+        local, remote = AsyncFS(userfs, 32, pool=pool), AsyncFS(remotefs, 64, pool=pool)
+
+    Files are opened as AsyncFile, whose operations run in the order they were submitted.
+    """
+
+    def __init__(self, fs, concurrency=16, pool=None):
+        """
+        :param fs: The filesystem whose calls are run in the background
+        :param concurrency: Max number of operations that run on the filesystem at once
+        :param pool: ThreadPool to run the operations on, by default one with concurrency
+        threads is created and closed with the AsyncFS
+        """
+        self.fs = fs
+        self.concurrency = concurrency
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._owns_pool = pool is None
+        self._pool = pool if pool is not None else ThreadPool(concurrency)
+
+    def _run(self, future, func, args, kwargs):
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception:
+            future.set_exception(sys.exc_info())
+        finally:
+            self._semaphore.release()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the background. Blocks while concurrency operations
+        are in flight.
+        :returns Future with the result of func
+        """
+        self._semaphore.acquire()
+        future = Future()
+        self._pool.apply_async(self._run, (future, func, args, kwargs))
+        return future
+
+    def open(self, path, mode="r", **kwargs):
+        """:returns Future with an AsyncFile"""
+        return self.submit(lambda: AsyncFile(self, self.fs.open(path, mode, **kwargs)))
+
+    def getcontents(self, path, mode="rb", **kwargs):
+        return self.submit(self.fs.getcontents, path, mode, **kwargs)
+
+    def setcontents(self, path, data=b"", **kwargs):
+        return self.submit(self.fs.setcontents, path, data, **kwargs)
+
+    def listdir(self, path="./", **kwargs):
+        return self.submit(self.fs.listdir, path, **kwargs)
+
+    def getinfo(self, path):
+        return self.submit(self.fs.getinfo, path)
+
+    def exists(self, path):
+        return self.submit(self.fs.exists, path)
+
+    def isdir(self, path):
+        return self.submit(self.fs.isdir, path)
+
+    def isfile(self, path):
+        return self.submit(self.fs.isfile, path)
+
+    def makedir(self, path, **kwargs):
+        return self.submit(self.fs.makedir, path, **kwargs)
+
+    def remove(self, path):
+        return self.submit(self.fs.remove, path)
+
+    def rename(self, src, dst):
+        return self.submit(self.fs.rename, src, dst)
+
+    def close(self):
+        """Wait for the pending operations and close the pool if it has been created here"""
+        if self._owns_pool:
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncFile(object):
+    """
+    A file of an AsyncFS. Every operation returns a Future. The operations of a file run
+    one after another in the order they were submitted, but don't block a pool thread while
+    waiting for their turn.
+    """
+
+    def __init__(self, asyncfs, wrapped_file):
+        self.asyncfs = asyncfs
+        self.wrapped_file = wrapped_file
+        self._operations = deque()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def _submit(self, func, *args):
+        self.asyncfs._semaphore.acquire()
+        future = Future()
+        with self._lock:
+            self._operations.append((future, func, args))
+            start, self._running = not self._running, True
+        if start:
+            self.asyncfs._pool.apply_async(self._run_operations)
+        return future
+
+    def _run_operations(self):
+        while True:
+            with self._lock:
+                if not self._operations:
+                    self._running = False
+                    return
+                future, func, args = self._operations.popleft()
+            self.asyncfs._run(future, func, args, {})
+
+    def read(self, size=-1):
+        return self._submit(self.wrapped_file.read, size)
+
+    def write(self, data):
+        return self._submit(self.wrapped_file.write, data)
+
+    def seek(self, offset, whence=0):
+        return self._submit(self.wrapped_file.seek, offset, whence)
+
+    def tell(self):
+        return self._submit(self.wrapped_file.tell)
+
+    def flush(self):
+        return self._submit(self.wrapped_file.flush)
+
+    def close(self):
+        return self._submit(self.wrapped_file.close)
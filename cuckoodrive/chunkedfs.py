@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from hashlib import sha1
+from io import BytesIO
+from tempfile import TemporaryFile
+import fnmatch
+import math
+import re
+import stat
+
+from six.moves import range
+
+from fs.errors import (
+    ResourceNotFoundError,
+    ResourceInvalidError,
+    DestinationExistsError,
+    ParentDirectoryMissingError,
+    NoSysPathError)
+from fs.filelike import FileLikeBase, FileWrapper
+from fs.path import abspath, normpath, dirname, basename, pathcombine, splitext
+from fs.wrapfs import WrapFS
+
+from cuckoodrive.partedfs import PartManifest
+from cuckoodrive.utils import kb, mb
+
+
+class Chunker(object):
+    """
+    Splits a stream into chunks at content-defined boundaries.
+    A gear hash is rolled over the data and a chunk ends where the hash matches a mask.
+    The boundaries only depend on the last 32 bytes before them, so inserting data into a
+    file only changes the chunks around the insert and all other chunks stay the same.
+
+    No chunk is smaller than min_size (except the last one) or bigger than max_size.
+    On average the chunks are avg_size big.
+    """
+
+    GEAR = [int(sha1(str(i).encode("ascii")).hexdigest()[:8], 16) for i in range(256)]
+
+    def __init__(self, avg_size, min_size=None, max_size=None):
+        """
+        :param avg_size: The average size of a chunk
+        :param min_size: The min size of a chunk, defaults to a quarter of avg_size
+        :param max_size: The max size of a chunk, defaults to four times avg_size
+        """
+        self.min_size = min_size if min_size is not None else avg_size // 4
+        self.max_size = max_size or avg_size * 4
+        bits = max(1, int(round(math.log(max(avg_size - self.min_size, 2), 2))))
+        # The high bits of the hash depend on more bytes than the low bits
+        self.mask = ((1 << bits) - 1) << (32 - bits)
+
+    def boundary(self, data):
+        """
+        Return the length of the first chunk of data. The data must either contain
+        max_size bytes or be the rest of the stream.
+        """
+        end = min(len(data), self.max_size)
+        if end <= self.min_size:
+            return end
+
+        gear, mask = self.GEAR, self.mask
+        h = 0
+        for i in range(self.min_size, end):
+            h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+            if not h & mask:
+                return i + 1
+        return end
+
+    def split(self, stream):
+        """
+        Read the stream and yield its chunks. At most max_size bytes are buffered.
+        """
+        buf = bytearray()
+        eof = False
+        while True:
+            while not eof and len(buf) < self.max_size:
+                data = stream.read(self.max_size - len(buf))
+                if data:
+                    buf.extend(data)
+                else:
+                    eof = True
+            if not buf:
+                return
+            cut = self.boundary(buf)
+            yield bytes(buf[:cut])
+            del buf[:cut]
+
+
+class ChunkedFS(WrapFS):
+    """
+    A virtual filesystem that splits files into content-defined chunks and stores every
+    chunk only once. It is an alternative to the PartedFS with fixed part sizes.
+
+    Every file is described by a manifest (see PartManifest) that lists the checksums
+    and sizes of its chunks. The chunks are stored content-addressed by their checksum
+    in a hidden directory of the wrapped fs::
+
+    |-- .chunks
+    |   |-- 3f
+    |   |   `-- 3f786850e387550fdab836ed7e6dc881de23001b
+    |   `-- 89
+    |       `-- 89e6c98d92887913cadf06b2adb97f26cde4849b
+    `-- backups
+        |-- backup.tar.manifest
+        `-- backup-copy.tar.manifest
+
+    Because the chunk boundaries depend on the content, an edit only changes the chunks
+    around it and writing the edited file only uploads those. Identical content of
+    different files (or copies) is shared. Chunks that are no longer referenced by any
+    manifest are removed by sweep, which is done at the latest when the fs is closed.
+
+    Files opened for writing are spooled to a temporary file and chunked when they are
+    closed. Files opened read-only download one chunk at a time.
+    """
+
+    _meta = {
+        "virtual": True,
+        "read_only": False,
+        "unicode_paths": True,
+        "case_insensitive_paths": False
+    }
+
+    chunk_dir = ".chunks"
+
+    def __init__(self, fs, avg_chunk_size=mb(1), min_chunk_size=None, max_chunk_size=None,
+                 read_buffer_size=kb(64)):
+        """
+        Create a ChunkedFS with an underlying filesystem.
+        :param fs: The underlying filesystem where the manifests and chunks will be stored
+        :param avg_chunk_size: The average size of a chunk
+        :param min_chunk_size: The min size of a chunk
+        :param max_chunk_size: The max size of a chunk
+        :param read_buffer_size: Max bytes that are read from a chunk at once
+        """
+        self.chunker = Chunker(avg_chunk_size, min_chunk_size, max_chunk_size)
+        self.read_buffer_size = read_buffer_size
+        self._refs = None
+        self._unreferenced = set()
+        super(ChunkedFS, self).__init__(fs)
+
+    def close(self):
+        if not self.closed and self._unreferenced:
+            self.sweep()
+        super(ChunkedFS, self).close()
+
+    def _encode(self, path):
+        """
+        Add the .manifest extension to the given path
+        """
+        return PartManifest.encode_path(path)
+
+    def _decode(self, path):
+        """
+        Remove the .manifest extension from the given path
+        """
+        return splitext(path)[0]
+
+    def _chunk_path(self, chunk_id):
+        return "/{0}/{1}/{2}".format(self.chunk_dir, chunk_id[:2], chunk_id)
+
+    def _is_chunk_path(self, path):
+        path = abspath(normpath(path))
+        return path == "/" + self.chunk_dir or path.startswith("/" + self.chunk_dir + "/")
+
+    def getmanifest(self, path):
+        """
+        Return the manifest of a virtual file or None if there is no such file.
+        """
+        return PartManifest.load(self.wrapped_fs, path)
+
+    def readchunk(self, chunk_id):
+        """
+        Return the contents of a chunk.
+        """
+        return self.wrapped_fs.getcontents(self._chunk_path(chunk_id), mode="rb")
+
+    def _references(self, recount=False):
+        """
+        Return how many manifests reference each chunk. The counts are looked up once by
+        reading all manifests and kept up to date afterwards.
+        :param recount: Read all manifests again instead of using the kept counts
+        """
+        with self._lock:
+            if self._refs is None or recount:
+                refs = Counter()
+                for manifest_path in self.wrapped_fs.walkfiles(wildcard="*.manifest"):
+                    if self._is_chunk_path(manifest_path):
+                        continue
+                    manifest = self.getmanifest(self._decode(manifest_path))
+                    if manifest is not None:
+                        refs.update(manifest.part_checksums or [])
+                self._refs = refs
+            return self._refs
+
+    def _reference(self, new_ids, old_ids):
+        """
+        Count the references of a new manifest and release the ones of the old manifest.
+        Chunks that are no longer referenced are remembered for the next sweep.
+        """
+        with self._lock:
+            refs = self._references()
+            refs.update(new_ids)
+            refs.subtract(old_ids)
+            self._unreferenced.update(chunk_id for chunk_id in set(old_ids)
+                                      if refs[chunk_id] <= 0)
+
+    def sweep(self):
+        """
+        Remove the chunks that have lost their last reference since the last sweep.
+
+        The kept counts don't know the manifests other drives sharing the wrapped fs have
+        written in the meantime. So before the chunks are removed, the references are
+        counted again from all manifests, once for all chunks released since the last
+        sweep. The sweep has to be done while the lock of the remotes is held, so no other
+        drive can add a reference during the recount.
+        :returns List with the ids of the removed chunks
+        """
+        with self._lock:
+            refs = self._references()
+            unreferenced = sorted(chunk_id for chunk_id in self._unreferenced
+                                  if refs[chunk_id] <= 0)
+            self._unreferenced.clear()
+            if not unreferenced:
+                return []
+            refs = self._references(recount=True)
+            removed = []
+            for chunk_id in unreferenced:
+                if refs[chunk_id] <= 0 and self.wrapped_fs.exists(self._chunk_path(chunk_id)):
+                    self.wrapped_fs.remove(self._chunk_path(chunk_id))
+                    removed.append(chunk_id)
+            return removed
+
+    def _check_parent(self, path):
+        if not self.wrapped_fs.isdir(dirname(abspath(normpath(path)))):
+            raise ParentDirectoryMissingError(path)
+
+    def _store(self, path, stream):
+        """
+        Chunk the stream, upload the chunks that are not stored yet and write the manifest.
+        :returns List with the indexes of the uploaded chunks
+        """
+        self._references()
+        old_manifest = self.getmanifest(path)
+
+        part_sizes, part_checksums, uploaded = [], [], []
+        for idx, chunk in enumerate(self.chunker.split(stream)):
+            chunk_id = sha1(chunk).hexdigest()
+            chunk_path = self._chunk_path(chunk_id)
+            if not self.wrapped_fs.exists(chunk_path):
+                self.wrapped_fs.makedir(dirname(chunk_path), recursive=True,
+                                        allow_recreate=True)
+                self.wrapped_fs.setcontents(chunk_path, chunk)
+                uploaded.append(idx)
+            part_sizes.append(len(chunk))
+            part_checksums.append(chunk_id)
+
+        manifest = PartManifest(part_sizes=part_sizes, part_checksums=part_checksums)
+        if old_manifest is not None:
+            manifest.created_time = old_manifest.created_time
+        manifest.save(self.wrapped_fs, path)
+        old_ids = old_manifest.part_checksums or [] if old_manifest is not None else []
+        self._reference(part_checksums, old_ids)
+        return uploaded
+
+    def updatefile(self, path, src_file):
+        """
+        Update a file with the contents of src_file. Only chunks that are not stored yet
+        are uploaded.
+        :param src_file: File-like object the new contents are read from
+        :returns List with the indexes of the uploaded chunks
+        """
+        self._check_parent(path)
+        return self._store(path, src_file)
+
+    def setcontents(self, path, data=b"", encoding=None, errors=None, chunk_size=64 * 1024):
+        if not isinstance(data, bytes):
+            return super(WrapFS, self).setcontents(path, data, encoding=encoding,
+                                                   errors=errors, chunk_size=chunk_size)
+        if self.isdir(path):
+            raise ResourceInvalidError(path)
+        self.updatefile(path, BytesIO(data))
+        return len(data)
+
+    def createfile(self, path, wipe=False):
+        if wipe or not self.isfile(path):
+            self.setcontents(path, b"")
+
+    def open(self, path, mode='r', **kwargs):
+        """
+        Open a ChunkedFile for reading or a ChunkingFile for all other modes.
+        """
+        if self.isdir(path):
+            raise ResourceInvalidError(path)
+
+        if "r" in mode and "+" not in mode:
+            manifest = self.getmanifest(path)
+            if manifest is None:
+                raise ResourceNotFoundError(path)
+            return ChunkedFile(self, path, manifest, self.read_buffer_size)
+
+        self._check_parent(path)
+        spool = TemporaryFile()
+        manifest = self.getmanifest(path)
+        if manifest is None:
+            if "r" in mode:
+                raise ResourceNotFoundError(path)
+            # The file exists as soon as it is opened, like on other filesystems
+            self._store(path, spool)
+        elif "w" not in mode:
+            with ChunkedFile(self, path, manifest, self.read_buffer_size) as fh:
+                for data in iter(lambda: fh.read(self.read_buffer_size), b""):
+                    spool.write(data)
+            spool.seek(0, 2 if "a" in mode else 0)
+        return ChunkingFile(self, path, mode, spool)
+
+    def remove(self, path):
+        """
+        Remove the manifest of a file and the chunks only this file referenced.
+        """
+        manifest = self.getmanifest(path)
+        if manifest is None:
+            if self.isdir(path):
+                raise ResourceInvalidError(path)
+            raise ResourceNotFoundError(path)
+
+        self._references()
+        PartManifest.remove(self.wrapped_fs, path)
+        self._reference([], manifest.part_checksums or [])
+
+    def isdir(self, path):
+        return self.wrapped_fs.isdir(path)
+
+    def isfile(self, path):
+        return self.wrapped_fs.isfile(self._encode(path))
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def makedir(self, path, *args, **kwds):
+        if self.isfile(path):
+            raise ResourceInvalidError(path)
+        return self.wrapped_fs.makedir(path, *args, **kwds)
+
+    def removedir(self, path, recursive=False, force=False):
+        if self.isfile(path):
+            raise ResourceInvalidError(path)
+        if force:
+            for filepath in list(self.walkfiles(path)):
+                self.remove(filepath)
+        return self.wrapped_fs.removedir(path, recursive=recursive, force=force)
+
+    def movedir(self, src, dst, **kwds):
+        return self.wrapped_fs.movedir(src, dst, **kwds)
+
+    def copydir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384):
+        return super(WrapFS, self).copydir(src, dst, overwrite=overwrite,
+                                           ignore_errors=ignore_errors, chunk_size=chunk_size)
+
+    def listdir(self, path="", wildcard=None, full=False, absolute=False, dirs_only=False,
+                files_only=False):
+        """
+        Lists the files and directories under a given path.
+        Manifests are listed as files, the directory with the chunks is hidden.
+        """
+        if self.isfile(path):
+            raise ResourceInvalidError(path)
+
+        dirs = self.wrapped_fs.listdir(path=path, dirs_only=True, full=full, absolute=absolute)
+        dirs = [d for d in dirs if not self._is_chunk_path(pathcombine(path, basename(d)))]
+        files = self.wrapped_fs.listdir(path=path, files_only=True, full=full,
+                                        absolute=absolute)
+        files = [self._decode(f) for f in files if f.endswith(".manifest")]
+
+        if wildcard is not None:
+            if not callable(wildcard):
+                wildcard_re = re.compile(fnmatch.translate(wildcard))
+                wildcard = lambda fn: bool(wildcard_re.match(fn))
+            dirs = [p for p in dirs if wildcard(basename(p))]
+            files = [p for p in files if wildcard(basename(p))]
+
+        if dirs_only:
+            return dirs
+        if files_only:
+            return files
+        return dirs + files
+
+    def listdirinfo(self, path="", wildcard=None, full=False, absolute=False,
+                    dirs_only=False, files_only=False):
+        entries = self.listdir(path=path, wildcard=wildcard, dirs_only=dirs_only,
+                               files_only=files_only)
+        infos = [self.getinfo(pathcombine(path, entry)) for entry in entries]
+        if full or absolute:
+            entries = [pathcombine(path, entry) for entry in entries]
+            if absolute:
+                entries = [abspath(entry) for entry in entries]
+        return list(zip(entries, infos))
+
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth",
+             ignore_errors=False):
+        return super(WrapFS, self).walk(path, wildcard, dir_wildcard, search, ignore_errors)
+
+    def walkfiles(self, path="/", wildcard=None, dir_wildcard=None, search="breadth",
+                  ignore_errors=False):
+        return super(WrapFS, self).walkfiles(path, wildcard, dir_wildcard, search,
+                                             ignore_errors)
+
+    def walkdirs(self, path="/", wildcard=None, search="breadth", ignore_errors=False):
+        return super(WrapFS, self).walkdirs(path, wildcard, search, ignore_errors)
+
+    def rename(self, src, dst):
+        """
+        Rename the manifest of a file, the chunks stay where they are.
+        """
+        if not self.exists(src):
+            raise ResourceNotFoundError(src)
+
+        if self.isdir(src):
+            self.wrapped_fs.rename(src, dst)
+        else:
+            PartManifest.rename(self.wrapped_fs, src, dst)
+
+    def move(self, src, dst, overwrite=False, chunk_size=16384):
+        if not self.exists(src):
+            raise ResourceNotFoundError(src)
+        if self.isdir(src):
+            raise ResourceInvalidError(src)
+
+        if self.exists(dst):
+            if not overwrite:
+                raise DestinationExistsError(dst)
+            self.remove(dst)
+
+        self.rename(src, dst)
+
+    def copy(self, src, dst, overwrite=False, chunk_size=16384):
+        """
+        Copy a file by writing a new manifest that shares the chunks of the source.
+        """
+        manifest = self.getmanifest(src)
+        if manifest is None:
+            if self.isdir(src):
+                raise ResourceInvalidError(src)
+            raise ResourceNotFoundError(src)
+        if self.isdir(dst):
+            raise ResourceInvalidError(dst)
+        self._check_parent(dst)
+
+        old_manifest = self.getmanifest(dst)
+        if old_manifest is not None and not overwrite:
+            raise DestinationExistsError(dst)
+
+        self._references()
+        PartManifest(part_sizes=manifest.part_sizes,
+                     part_checksums=manifest.part_checksums).save(self.wrapped_fs, dst)
+        old_ids = old_manifest.part_checksums or [] if old_manifest is not None else []
+        self._reference(manifest.part_checksums or [], old_ids)
+
+    def getinfo(self, path):
+        manifest = self.getmanifest(path)
+        if manifest is not None:
+            info = manifest.getinfo()
+            info['st_mode'] = 0o666 | stat.S_IFREG
+            return info
+        if not self.isdir(path):
+            raise ResourceNotFoundError(path)
+        return self.wrapped_fs.getinfo(path)
+
+    def getsize(self, path):
+        manifest = self.getmanifest(path)
+        if manifest is not None:
+            return manifest.size
+        if not self.isdir(path):
+            raise ResourceNotFoundError(path)
+        return self.wrapped_fs.getsize(path)
+
+    def settimes(self, path, accessed_time=None, modified_time=None):
+        if self.isdir(path):
+            return self.wrapped_fs.settimes(path, accessed_time, modified_time)
+
+        manifest = self.getmanifest(path)
+        if manifest is None:
+            raise ResourceNotFoundError(path)
+        now = datetime.now()
+        manifest.accessed_time = accessed_time or now
+        manifest.modified_time = modified_time or now
+        manifest.save(self.wrapped_fs, path)
+
+    def getsyspath(self, path, allow_none=False):
+        """Because the file is split into chunks we cannot provide a syspath"""
+        if not allow_none:
+            raise NoSysPathError(path=path)
+        return None
+
+
+class ChunkedFile(FileLikeBase):
+    """
+    A read-only file that is assembled out of the chunks of its manifest.
+    Only the chunk that contains the file pointer is held in memory.
+    """
+
+    def __init__(self, fs, path, manifest, read_buffer_size=kb(64)):
+        super(ChunkedFile, self).__init__()
+        self.mode = "rb"
+        self._fs = fs
+        self._path = path
+        self._chunk_ids = manifest.part_checksums or []
+        self._offsets = []
+        offset = 0
+        for chunk_size in manifest.part_sizes:
+            self._offsets.append(offset)
+            offset += chunk_size
+        self._size = offset
+        self._file_pointer = 0
+        self._read_buffer_size = read_buffer_size
+        self._chunk_idx = None
+        self._chunk = None
+
+    @property
+    def size(self):
+        return self._size
+
+    def _chunk_at(self, idx):
+        if idx != self._chunk_idx:
+            self._chunk = self._fs.readchunk(self._chunk_ids[idx])
+            self._chunk_idx = idx
+        return self._chunk
+
+    def _read(self, sizehint=-1):
+        if self._file_pointer >= self._size:
+            return None
+
+        idx = bisect_right(self._offsets, self._file_pointer) - 1
+        chunk = self._chunk_at(idx)
+        offset = self._file_pointer - self._offsets[idx]
+        size = min(self._read_buffer_size, len(chunk) - offset)
+        if sizehint > 0:
+            size = min(size, sizehint)
+        read_data = chunk[offset:offset + size]
+        self._file_pointer += len(read_data)
+        return read_data or None
+
+    def _seek(self, offset, whence):
+        self._file_pointer = offset + [0, self._file_pointer, self._size][whence]
+
+    def _tell(self):
+        return self._file_pointer
+
+    def close(self):
+        super(ChunkedFile, self).close()
+        self._chunk = None
+
+
+class ChunkingFile(FileWrapper):
+    """
+    A writable file of the ChunkedFS. The contents are spooled to a temporary file and
+    chunked and stored when the file is closed.
+    """
+
+    def __init__(self, fs, path, mode, spool):
+        super(ChunkingFile, self).__init__(spool, mode)
+        self._fs = fs
+        self._path = path
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.flush()
+        # The fs might already be closed if the file is closed by the garbage collector
+        if not self._fs.closed:
+            self.wrapped_file.seek(0)
+            self._fs._store(self._path, self.wrapped_file)
+        super(ChunkingFile, self).close()
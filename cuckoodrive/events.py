@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import OrderedDict
+import itertools
+import threading
+import time
+import traceback
+
+import fs.watch
+
+
+class EventQueue(object):
+    """
+    Collects the watch events of a filesystem and hands them to a handler in batches.
+    Events are only handed over once no new event has arrived for quiet_period seconds, but
+    at the latest max_delay seconds after the first pending event. This way a burst of
+    events (e.g. a checkout of thousands of files) is synchronized in one pass.
+
+    While waiting the events are coalesced:
+
+    * Only the last event of every path is kept (last writer wins).
+    * A move is kept as one MOVED_SRC event that knows its destination. The MOVED_DST
+      event of the same move is dropped, and so are pending events of the source and the
+      destination. Later events don't replace a pending move, because the moved file
+      still has to arrive at its destination (e.g. an editor renames a file to a backup
+      and writes the file again).
+    * The pending events below a moved directory are moved along: they are rewritten to
+      the destination and handed over after the move.
+    * A removed directory drops the pending events of everything below it, except the
+      moves out of the directory.
+    * An OVERFLOW drops all pending events, because the whole tree has to be compared anyway.
+
+    The handler is called with the list of events from a background thread::
+
+        queue = EventQueue(drive.sync_events, quiet_period=0.5)
+        userfs.add_watcher(queue.put)
+    """
+
+    ignored_events = (fs.watch.ACCESSED, fs.watch.CLOSED)
+
+    def __init__(self, handler, quiet_period=0.5, max_delay=10):
+        """
+        :param handler: Callable that is called with a list of coalesced events
+        :param quiet_period: Seconds without a new event before the events are handed over
+        :param max_delay: Max seconds an event is kept back during a continuous burst
+        """
+        self.handler = handler
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self._pending = OrderedDict()
+        self._move_ids = itertools.count()
+        self._overflow = None
+        self._first_event = None
+        self._last_event = None
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="EventQueue")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending) + (1 if self._overflow is not None else 0)
+
+    def put(self, event):
+        """Add an event to the queue, it can be used as the callback of a watcher"""
+        if type(event) in self.ignored_events:
+            return
+
+        with self._condition:
+            if isinstance(event, fs.watch.OVERFLOW):
+                self._pending.clear()
+                self._overflow = event
+            elif self._overflow is None:
+                self._coalesce(event)
+            now = time.time()
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            self._condition.notify_all()
+
+    def _coalesce(self, event):
+        if isinstance(event, fs.watch.MOVED_DST) and event.source is not None:
+            # The move is already pending as the MOVED_SRC event of its source
+            return
+
+        prefix = event.path.rstrip("/") + "/"
+        below = [(key, e) for key, e in self._pending.items() if e.path.startswith(prefix)]
+        if self._is_move(event):
+            self._pending.pop(event.destination, None)
+            moved = [self._moved(e, event.path, event.destination) for _, e in below]
+        elif isinstance(event, fs.watch.REMOVED):
+            below = [(key, e) for key, e in below
+                     if not self._is_move(e) or e.destination.startswith(prefix)]
+            moved = []
+        else:
+            below = moved = []
+
+        for key, _ in below:
+            del self._pending[key]
+        self._append(event)
+        for child in moved:
+            self._append(child)
+
+    @staticmethod
+    def _is_move(event):
+        return isinstance(event, fs.watch.MOVED_SRC) and event.destination is not None
+
+    def _append(self, event):
+        # Move the path to the end, so events are handled in the order they last happened
+        self._pending.pop(event.path, None)
+        if self._is_move(event):
+            # Every move gets a key of its own, so no later event of its path replaces it
+            self._pending[(event.path, next(self._move_ids))] = event
+        else:
+            self._pending[event.path] = event
+
+    @staticmethod
+    def _moved(event, src, dst):
+        """Return a copy of an event below the moved directory src with the paths below dst"""
+        src, dst = src.rstrip("/"), dst.rstrip("/")
+
+        def moved_path(path):
+            if path is not None and path.startswith(src + "/"):
+                return dst + path[len(src):]
+            return path
+
+        moved = event.clone(path=moved_path(event.path))
+        if isinstance(event, fs.watch.MOVED_SRC):
+            moved.destination = moved_path(event.destination)
+        return moved
+
+    def _take(self):
+        if self._overflow is not None:
+            events = [self._overflow]
+        else:
+            events = list(self._pending.values())
+        self._pending.clear()
+        self._overflow = None
+        self._first_event = self._last_event = None
+        return events
+
+    def _wait_time(self):
+        """Seconds until the pending events are due or None if there are none"""
+        if self._first_event is None:
+            return None
+        if self._closed:
+            return 0
+        due = min(self._last_event + self.quiet_period, self._first_event + self.max_delay)
+        return max(0, due - time.time())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                wait_time = self._wait_time()
+                while wait_time is None or wait_time > 0:
+                    if wait_time is None and self._closed:
+                        return
+                    self._condition.wait(wait_time)
+                    wait_time = self._wait_time()
+                events = self._take()
+                self._busy = True
+
+            try:
+                self.handler(events)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until all pending events have been handled.
+        :returns True if the queue is idle, False if the timeout has been reached
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while self._busy or self._first_event is not None:
+                remaining = end - time.time() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def close(self):
+        """Hand over the pending events without waiting for the quiet period and stop"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join()
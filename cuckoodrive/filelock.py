@@ -29,7 +29,7 @@ class FileLock(object):
         Original Repository: https://github.com/dmfrey/FileLock
     """
 
-    def __init__(self, fs, filename=".lock", timeout=10, delay=.5):
+    def __init__(self, fs, filename=".lock", timeout=10, delay=.5, stale_timeout=None):
         """ Prepare the file locker. Specify the file to lock and optionally
             the maximum timeout and the delay between each attempt to lock.
         :param fs: Filesystem implementation to use for locking
@@ -37,13 +37,19 @@ class FileLock(object):
         :param timeout: Timeout used when trying to acquire a lock
         If timeout is reached, a FileLockError is raised
         :param delay: Delay between checks weather there is a lockfile
+        :param stale_timeout: Seconds after which a lockfile whose heartbeat
+        has not been renewed is considered left over by a crashed process and
+        is broken. With None a lockfile is never broken.
         """
         self.fs = fs
         self.is_locked = False
         self.filename = filename
-        self.lockfile = None
+        # The heartbeat is kept next to the lockfile, so renewing it never
+        # removes the lockfile (e.g. on filesystems that recreate written files)
+        self.heartbeat_filename = "{0}.heartbeat".format(filename)
         self.timeout = timeout
         self.delay = delay
+        self.stale_timeout = stale_timeout
 
     def acquire(self):
         """ Acquire the lock, if possible. If the lock is in use, it check again
@@ -55,8 +61,14 @@ class FileLock(object):
         while True:
             try:
                 if not self.fs.exists(self.filename):
-                    self.lockfile = self.fs.open(self.filename, 'w')
+                    # The heartbeat comes first, so the stale heartbeat of a
+                    # broken lock never belongs to the new lockfile
+                    self._write_heartbeat()
+                    with self.fs.open(self.filename, 'wb'):
+                        pass
                     break
+                elif self.is_stale():
+                    self.fs.remove(self.filename)
                 else:
                     if (time.time() - start_time) >= self.timeout:
                         raise FileLockError("Timeout occured.", self.filename)
@@ -65,13 +77,43 @@ class FileLock(object):
                 raise
         self.is_locked = True
 
+    def is_stale(self):
+        """ Check weather the heartbeat of the lockfile is older than
+            stale_timeout seconds. The modified time of the lockfile is not
+            used, because not every filesystem can set it and it is taken from
+            the clock of the remote. A lockfile without a heartbeat (e.g. one
+            of a process that couldn't write it) is never stale.
+        """
+        if self.stale_timeout is None:
+            return False
+        try:
+            heartbeat = float(self.fs.getcontents(self.heartbeat_filename, mode="rb"))
+        except (FSError, ValueError):
+            return False
+        return time.time() - heartbeat >= self.stale_timeout
+
+    def heartbeat(self):
+        """ Renew the heartbeat of the lockfile, so other processes see that
+            the lock is still held and don't break it. Call it more often than
+            stale_timeout while the lock is held for a long time.
+        """
+        if self.is_locked:
+            self._write_heartbeat()
+
+    def _write_heartbeat(self):
+        with self.fs.open(self.heartbeat_filename, 'wb') as heartbeat_file:
+            heartbeat_file.write("{0!r}".format(time.time()).encode("ascii"))
+
     def release(self):
-        """ Get rid of the lock by deleting the lockfile.
+        """ Get rid of the lock by deleting the lockfile and its heartbeat.
             When working in a `with` statement, this gets automatically
             called at the end.
         """
         if self.is_locked:
-            self.lockfile.close()
+            # Without its heartbeat the lockfile is never stale, so it isn't
+            # broken while it is removed
+            if self.fs.exists(self.heartbeat_filename):
+                self.fs.remove(self.heartbeat_filename)
             self.fs.remove(self.filename)
             self.is_locked = False
 
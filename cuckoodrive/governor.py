@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from contextlib import contextmanager
+import threading
+import time
+
+from fs.base import NoDefaultMeta
+from fs.filelike import FileLikeBase, FileWrapper
+from fs.wrapfs import WrapFS
+
+from cuckoodrive.multifs import FreeSpaceWrapFS
+
+
+class TokenBucket(object):
+    """
+    Limits the number of bytes per second. Every transferred byte takes a token out of the
+    bucket, which is refilled with rate tokens per second and holds at most capacity tokens.
+    If there are not enough tokens, the transfer waits until they have been refilled.
+
+    A bucket can be shared by several filesystems to limit their transfers together, e.g.
+    to leave some of a shared uplink to others.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Bytes per second
+        :param capacity: Max bytes that can be transferred at once after an idle time,
+        defaults to rate
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Take amount tokens out of the bucket and wait until they are available. Transfers
+        bigger than the capacity are allowed, the bucket is just in debt afterwards.
+        :returns Seconds waited
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class GovernedFS(FreeSpaceWrapFS):
+    """
+    Wraps a remote filesystem and keeps the transfers to it within the limits of its
+    provider: at most max_operations calls run on it at the same time and the bytes
+    written and read are limited by token buckets::
+
+        uplink = TokenBucket(mb(2))
+        remote = GovernedFS(dropboxfs, max_operations=4,
+                            upload_limits=[TokenBucket(kb(512)), uplink])
+
+    Reads and writes of open files count as single operations, so an open file doesn't
+    hold on to an operation slot while the caller isn't using it. Walks and copies of
+    directories are composed of the governed calls (listdir, open, ...) instead of being
+    passed to the remote as a whole.
+    """
+
+    def __init__(self, fs, max_operations=None, upload_limits=(), download_limits=()):
+        """
+        :param fs: The remote filesystem
+        :param max_operations: Max number of concurrent calls, None for no limit
+        :param upload_limits: TokenBuckets that limit the written bytes
+        :param download_limits: TokenBuckets that limit the read bytes
+        """
+        self.max_operations = max_operations
+        self.upload_limits = list(upload_limits)
+        self.download_limits = list(download_limits)
+        self._slots = threading.BoundedSemaphore(max_operations) if max_operations else None
+        super(GovernedFS, self).__init__(fs)
+
+    def __getstate__(self):
+        state = super(GovernedFS, self).__getstate__()
+        state["_slots"] = None
+        return state
+
+    def __setstate__(self, state):
+        super(GovernedFS, self).__setstate__(state)
+        if self.max_operations:
+            self._slots = threading.BoundedSemaphore(self.max_operations)
+
+    @contextmanager
+    def operation(self):
+        """Wait for a free operation slot and hold it"""
+        if self._slots is None:
+            yield
+            return
+        with self._slots:
+            yield
+
+    def upload(self, size):
+        """Wait until size bytes may be written"""
+        for bucket in self.upload_limits:
+            bucket.consume(size)
+
+    def download(self, size):
+        """Account size bytes that have been read"""
+        for bucket in self.download_limits:
+            bucket.consume(size)
+
+    def _call(self, method, *args, **kwargs):
+        with self.operation():
+            return method(*args, **kwargs)
+
+    def open(self, path, mode="r", **kwargs):
+        return GovernedFile(self._call(self.wrapped_fs.open, path, mode, **kwargs), self, mode)
+
+    def setcontents(self, path, data=b"", encoding=None, errors=None, chunk_size=64 * 1024):
+        # Write through open instead of passing the data to the wrapped filesystem, so the
+        # bytes are taken from the upload limits chunk by chunk
+        return super(WrapFS, self).setcontents(path, data, encoding=encoding, errors=errors,
+                                               chunk_size=chunk_size)
+
+    def getmeta(self, meta_name, default=NoDefaultMeta):
+        # The free_space query may be a round trip to the remote
+        return self._call(super(GovernedFS, self).getmeta, meta_name, default)
+
+    def exists(self, path):
+        return self._call(self.wrapped_fs.exists, path)
+
+    def isdir(self, path):
+        return self._call(self.wrapped_fs.isdir, path)
+
+    def isfile(self, path):
+        return self._call(self.wrapped_fs.isfile, path)
+
+    def listdir(self, *args, **kwargs):
+        return self._call(self.wrapped_fs.listdir, *args, **kwargs)
+
+    def listdirinfo(self, *args, **kwargs):
+        return self._call(self.wrapped_fs.listdirinfo, *args, **kwargs)
+
+    def ilistdir(self, *args, **kwargs):
+        return iter(self.listdir(*args, **kwargs))
+
+    def ilistdirinfo(self, *args, **kwargs):
+        return iter(self.listdirinfo(*args, **kwargs))
+
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth",
+             ignore_errors=False):
+        return super(WrapFS, self).walk(path, wildcard, dir_wildcard, search, ignore_errors)
+
+    def walkfiles(self, path="/", wildcard=None, dir_wildcard=None, search="breadth",
+                  ignore_errors=False):
+        return super(WrapFS, self).walkfiles(path, wildcard, dir_wildcard, search,
+                                             ignore_errors)
+
+    def walkdirs(self, path="/", wildcard=None, search="breadth", ignore_errors=False):
+        return super(WrapFS, self).walkdirs(path, wildcard, search, ignore_errors)
+
+    def getinfo(self, path):
+        return self._call(self.wrapped_fs.getinfo, path)
+
+    def getsize(self, path):
+        return self._call(self.wrapped_fs.getsize, path)
+
+    def makedir(self, path, *args, **kwargs):
+        return self._call(self.wrapped_fs.makedir, path, *args, **kwargs)
+
+    def remove(self, path):
+        return self._call(self.wrapped_fs.remove, path)
+
+    def removedir(self, path, *args, **kwargs):
+        return self._call(self.wrapped_fs.removedir, path, *args, **kwargs)
+
+    def rename(self, src, dst):
+        return self._call(self.wrapped_fs.rename, src, dst)
+
+    def copy(self, src, dst, *args, **kwargs):
+        return self._call(self.wrapped_fs.copy, src, dst, *args, **kwargs)
+
+    def move(self, src, dst, *args, **kwargs):
+        return self._call(self.wrapped_fs.move, src, dst, *args, **kwargs)
+
+    def settimes(self, path, *args, **kwargs):
+        return self._call(self.wrapped_fs.settimes, path, *args, **kwargs)
+
+    def createfile(self, path, *args, **kwargs):
+        return self._call(self.wrapped_fs.createfile, path, *args, **kwargs)
+
+    def copydir(self, src, dst, **kwargs):
+        return super(WrapFS, self).copydir(src, dst, **kwargs)
+
+    def movedir(self, src, dst, **kwargs):
+        return super(WrapFS, self).movedir(src, dst, **kwargs)
+
+
+class GovernedFile(FileWrapper):
+    """
+    A file of a GovernedFS. Every read and write waits for an operation slot and the
+    transferred bytes are taken from the token buckets of the filesystem. Flushing and
+    closing the wrapped file wait for a slot as well, because remote files often upload
+    the written bytes only then. The bytes have already been taken from the buckets when
+    they were written.
+    """
+
+    def __init__(self, wrapped_file, fs, mode=None):
+        self.fs = fs
+        self._closing = False
+        super(GovernedFile, self).__init__(wrapped_file, mode)
+
+    def _read(self, sizehint=-1):
+        data = self.fs._call(super(GovernedFile, self)._read, sizehint)
+        if data:
+            self.fs.download(len(data))
+        return data
+
+    def _write(self, string, flushing=False):
+        if string:
+            self.fs.upload(len(string))
+        return self.fs._call(super(GovernedFile, self)._write, string, flushing)
+
+    def flush(self):
+        # The buffered bytes are written with _write, which takes a slot of its own
+        FileLikeBase.flush(self)
+        if not self._closing and hasattr(self.wrapped_file, "flush"):
+            self.fs._call(self.wrapped_file.flush)
+
+    def close(self):
+        if self.closed:
+            return
+        self._closing = True
+        FileLikeBase.close(self)
+        if hasattr(self.wrapped_file, "close"):
+            self.fs._call(self.wrapped_file.close)
+
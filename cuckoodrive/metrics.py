@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from bisect import bisect_left
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+import traceback
+
+from fs.filelike import FileWrapper
+
+from cuckoodrive.multifs import FreeSpaceWrapFS
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+INSTRUMENTED_METHODS = ["exists", "isdir", "isfile", "listdir", "listdirinfo", "getinfo",
+                        "getsize", "makedir", "remove", "removedir", "rename", "copy", "move",
+                        "copydir", "movedir", "settimes", "createfile"]
+
+
+class OperationStats(object):
+    """Calls, errors, bytes and the latency histogram of one method of one layer"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # The last bucket counts the calls slower than all LATENCY_BUCKETS
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self):
+        return OrderedDict([("count", self.count), ("errors", self.errors),
+                            ("bytes", self.bytes), ("seconds", self.seconds),
+                            ("buckets", list(self.buckets))])
+
+
+class Metrics(object):
+    """
+    Collects how often the methods of every layer of the filesystem stack are called, how
+    many bytes they transfer and how long they take. The layers are wrapped in a MetricsFS
+    that records its calls here::
+
+        metrics = Metrics()
+        fs = CuckooDriveFS(remote_filesystems, metrics=metrics)
+        print(metrics.to_prometheus())
+
+    Recording a call only takes a lock and a few additions, so it can be left enabled.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"operations": self._operations}
+
+    def __setstate__(self, state):
+        self._operations = state["operations"]
+        self._lock = threading.Lock()
+
+    def record(self, layer, method, seconds, size=0, failed=False):
+        """
+        Record a call.
+        :param layer: Name of the layer, e.g. PartedFS or Remote0
+        :param method: Name of the called method
+        :param seconds: Time the call took
+        :param size: Bytes transferred by the call
+        :param failed: True if the call raised an error
+        """
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self._operations.get((layer, method))
+            if stats is None:
+                stats = self._operations[(layer, method)] = OperationStats()
+            stats.count += 1
+            stats.errors += failed
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.buckets[bucket] += 1
+
+    def snapshot(self):
+        """
+        :returns Dict with the stats of every method of every layer, the buckets count the
+        calls that took at most the corresponding LATENCY_BUCKETS (not cumulative)
+        """
+        with self._lock:
+            layers = OrderedDict()
+            for layer, method in sorted(self._operations):
+                stats = self._operations[(layer, method)]
+                layers.setdefault(layer, OrderedDict())[method] = stats.to_dict()
+        return OrderedDict([("latency_buckets", list(LATENCY_BUCKETS)), ("layers", layers)])
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus(self):
+        """:returns The metrics in the Prometheus text exposition format"""
+        lines = [
+            "# TYPE cuckoodrive_operations_total counter",
+            "# TYPE cuckoodrive_operation_errors_total counter",
+            "# TYPE cuckoodrive_operation_bytes_total counter",
+            "# TYPE cuckoodrive_operation_duration_seconds histogram",
+        ]
+        for layer, methods in self.snapshot()["layers"].items():
+            for method, stats in methods.items():
+                labels = 'layer="{0}",method="{1}"'.format(layer, method)
+                lines.append("cuckoodrive_operations_total{{{0}}} {1}".format(
+                    labels, stats["count"]))
+                lines.append("cuckoodrive_operation_errors_total{{{0}}} {1}".format(
+                    labels, stats["errors"]))
+                lines.append("cuckoodrive_operation_bytes_total{{{0}}} {1}".format(
+                    labels, stats["bytes"]))
+                cumulative = 0
+                for le, count in zip(LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+                    cumulative += count
+                    lines.append(
+                        'cuckoodrive_operation_duration_seconds_bucket{{{0},le="{1}"}} {2}'
+                        .format(labels, le, cumulative))
+                lines.append("cuckoodrive_operation_duration_seconds_sum{{{0}}} {1!r}".format(
+                    labels, stats["seconds"]))
+                lines.append("cuckoodrive_operation_duration_seconds_count{{{0}}} {1}".format(
+                    labels, stats["count"]))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, format="json"):
+        """
+        Write the metrics to a file. The file is replaced at once, so a reader never sees
+        half of it.
+        :param format: json or prometheus
+        """
+        text = self.to_prometheus() if format == "prometheus" else self.to_json()
+        tmp_path = "{0}.tmp".format(path)
+        with open(tmp_path, "wb") as fh:
+            fh.write(text.encode("utf-8"))
+        os.rename(tmp_path, path)
+
+
+class MetricsFS(FreeSpaceWrapFS):
+    """
+    Records the calls of a layer of the filesystem stack in a Metrics instance. Reads and
+    writes of open files are recorded as the read and write methods of the layer.
+    """
+
+    def __init__(self, fs, metrics, layer):
+        """
+        :param fs: The filesystem of the layer
+        :param metrics: Metrics the calls are recorded in
+        :param layer: Name of the layer in the metrics
+        """
+        super(MetricsFS, self).__init__(fs)
+        self.metrics = metrics
+        self.layer = layer
+
+    def record(self, method, start, size=0, failed=False):
+        self.metrics.record(self.layer, method, time.time() - start, size, failed)
+
+    def measure(self, method, func, *args, **kwargs):
+        """Call func and record it as method of this layer"""
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(method, start, failed=True)
+            raise
+        self.record(method, start)
+        return result
+
+    def open(self, path, mode="r", **kwargs):
+        return MetricsFile(self.measure("open", self.wrapped_fs.open, path, mode, **kwargs),
+                           self, mode)
+
+    def setcontents(self, path, data=b"", *args, **kwargs):
+        start = time.time()
+        try:
+            result = self.wrapped_fs.setcontents(path, data, *args, **kwargs)
+        except Exception:
+            self.record("setcontents", start, failed=True)
+            raise
+        self.record("setcontents", start, len(data) if isinstance(data, bytes) else 0)
+        return result
+
+    def getcontents(self, path, *args, **kwargs):
+        start = time.time()
+        try:
+            contents = self.wrapped_fs.getcontents(path, *args, **kwargs)
+        except Exception:
+            self.record("getcontents", start, failed=True)
+            raise
+        self.record("getcontents", start, len(contents))
+        return contents
+
+
+def _instrumented(name):
+    def method(self, *args, **kwargs):
+        return self.measure(name, getattr(self.wrapped_fs, name), *args, **kwargs)
+    method.__name__ = str(name)
+    return method
+
+
+for _name in INSTRUMENTED_METHODS:
+    setattr(MetricsFS, _name, _instrumented(_name))
+
+
+class MetricsFile(FileWrapper):
+    """A file of a MetricsFS, records every read and write with its bytes"""
+
+    def __init__(self, wrapped_file, fs, mode=None):
+        super(MetricsFile, self).__init__(wrapped_file, mode)
+        self.fs = fs
+
+    def _read(self, sizehint=-1):
+        start = time.time()
+        try:
+            data = super(MetricsFile, self)._read(sizehint)
+        except Exception:
+            self.fs.record("read", start, failed=True)
+            raise
+        self.fs.record("read", start, len(data) if data else 0)
+        return data
+
+    def _write(self, string, flushing=False):
+        start = time.time()
+        try:
+            result = super(MetricsFile, self)._write(string, flushing)
+        except Exception:
+            self.fs.record("write", start, failed=True)
+            raise
+        self.fs.record("write", start, len(string))
+        return result
+
+
+class MetricsDumper(object):
+    """Dumps metrics to a file every interval seconds from a background thread"""
+
+    def __init__(self, metrics, path, interval=60, format="json"):
+        """
+        :param metrics: The dumped Metrics
+        :param path: Path of the file, it is replaced by every dump
+        :param interval: Seconds between two dumps
+        :param format: json or prometheus
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="MetricsDumper")
+        self._worker.daemon = True
+
+    def start(self):
+        self._worker.start()
+        return self
+
+    def dump(self):
+        try:
+            self.metrics.dump(self.path, self.format)
+        except Exception:
+            traceback.print_exc()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.dump()
+
+    def close(self):
+        """Stop dumping and write the final metrics"""
+        self._stopped.set()
+        if self._worker.is_alive():
+            self._worker.join()
+        self.dump()
@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import (print_function, division,
                         absolute_import, unicode_literals)
+from multiprocessing.pool import ThreadPool
+import json
+import sys
+import threading
+import time
 
+from six import reraise
+
+from fs.base import NoDefaultMeta
 from fs.errors import (
+    FSError,
     NoMetaError,
     ResourceNotFoundError,
     ResourceInvalidError,
     RemoveRootError,
+    OperationFailedError,
     NoSysPathError)
+from fs.filelike import FileWrapper
 from fs.multifs import MultiFS
-from fs.path import normpath
+from fs.path import (
+    normpath, abspath, pathjoin, basename, dirname, recursepath)
+from fs.wrapfs import WrapFS
 
 
 def free_space(fs):
@@ -21,7 +34,8 @@ def free_space(fs):
     :raise NoMetaError: If filesystem has no information about how much free
     space is left a NoMetaError exception is raised.
     """
-    if hasattr(fs, "cur_size") and hasattr(fs, "max_size"):
+    # A wrapper forwards cur_size and max_size, but not the private _get_cur_size
+    if hasattr(fs, "cur_size") and hasattr(fs, "max_size") and hasattr(fs, "_get_cur_size"):
         return fs.max_size - fs._get_cur_size()
     if fs.hasmeta("free_space"):
         return fs.getmeta("free_space")
@@ -31,14 +45,486 @@ def free_space(fs):
         msg="FS has no meta information about free space")
 
 
+class FreeSpaceWrapFS(WrapFS):
+    """
+    A WrapFS that reports the free space of the wrapped filesystem as free_space meta, even
+    if the wrapped filesystem only knows it through its cur_size and max_size (see free_space).
+    A plain WrapFS hides it, because it doesn't forward the private methods of the wrapped fs.
+    """
+
+    def getmeta(self, meta_name, default=NoDefaultMeta):
+        if meta_name == "free_space":
+            try:
+                return free_space(self.wrapped_fs)
+            except NoMetaError:
+                if default is NoDefaultMeta:
+                    raise
+                return default
+        return self.wrapped_fs.getmeta(meta_name, default)
+
+    def hasmeta(self, meta_name):
+        try:
+            self.getmeta(meta_name)
+        except NoMetaError:
+            return False
+        return True
+
+
+class FreeSpaceCache(object):
+
+    """
+    Caches the free space of filesystems, because asking a filesystem for
+    its free space either walks the whole tree or costs a remote round trip.
+    The cached values are adjusted by the bytes written and removed through
+    the WritableMultiFS and refreshed from the filesystem itself once they
+    are older than refresh_interval seconds.
+    """
+
+    def __init__(self, refresh_interval=60):
+        """
+        :param refresh_interval: Seconds after which the free space is asked
+        from the filesystem again. With 0 it is asked every time.
+        """
+        self.refresh_interval = refresh_interval
+        self._free_space = {}
+        self._refreshed_at = {}
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # Locks can't be pickled and the cache is rebuilt anyway
+        return {"refresh_interval": self.refresh_interval}
+
+    def __setstate__(self, state):
+        self.__init__(state["refresh_interval"])
+
+    def __contains__(self, fs):
+        return fs in self._free_space
+
+    def get(self, fs):
+        """
+        Return the free space of the filesystem and refresh it if the cached
+        value is outdated.
+        :raise NoMetaError: If the filesystem has no information about free space
+        """
+        with self._lock:
+            refreshed_at = self._refreshed_at.get(fs)
+            if refreshed_at is not None and \
+                    time.time() - refreshed_at < self.refresh_interval:
+                return self._free_space[fs]
+
+        return self.refresh(fs)
+
+    def refresh(self, fs):
+        """
+        Ask the filesystem for its free space, even if the cached value is
+        still up to date.
+        :raise NoMetaError: If the filesystem has no information about free space
+        """
+        space = free_space(fs)
+        with self._lock:
+            self._free_space[fs] = space
+            self._refreshed_at[fs] = time.time()
+        return space
+
+    def consume(self, fs, size):
+        """Account size bytes that have been written to the filesystem"""
+        with self._lock:
+            if fs in self._free_space:
+                self._free_space[fs] -= size
+
+    def release(self, fs, size):
+        """Account size bytes that have been removed from the filesystem"""
+        self.consume(fs, -size)
+
+    def invalidate(self, fs=None):
+        """
+        Forget the cached free space of the filesystem (or of all filesystems)
+        so it is refreshed the next time it is needed.
+        """
+        with self._lock:
+            for cached_fs in ([fs] if fs is not None else list(self._free_space)):
+                self._free_space.pop(cached_fs, None)
+                self._refreshed_at.pop(cached_fs, None)
+
+    def snapshot(self):
+        """
+        Return the current view of the cache without contacting any filesystem
+        :return: dict with the free space in Bytes for each cached filesystem
+        """
+        with self._lock:
+            return dict(self._free_space)
+
+
+class LocationIndex(object):
+
+    """
+    Remembers on which filesystems of a WritableMultiFS a path exists, so
+    that the filesystems don't have to be asked one after another.
+    Only paths that exist somewhere are recorded. For unknown paths the
+    WritableMultiFS still has to look on every filesystem.
+    The sizes of the files written or looked up through the WritableMultiFS
+    are remembered as well, so removing them doesn't have to ask for them.
+    The indexed paths are linked to their parent directories, so everything
+    below a directory is found without looking at all the other paths.
+    """
+
+    def __init__(self):
+        self._locations = {}
+        self._sizes = {}
+        self._children = {}
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        return {"locations": self._locations}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._locations.update(state["locations"])
+        for key in self._locations:
+            self._link(key)
+
+    def __len__(self):
+        return len(self._locations)
+
+    @staticmethod
+    def _key(path):
+        return abspath(normpath(path))
+
+    def _link(self, key):
+        """Link key and all its parent directories up to the root"""
+        while key != "/":
+            parent = dirname(key)
+            children = self._children.setdefault(parent, set())
+            if key in children:
+                break
+            children.add(key)
+            key = parent
+
+    def _unlink(self, key):
+        """Unlink key and the parent directories that only led to key"""
+        while (key != "/" and key not in self._locations and
+               not self._children.get(key)):
+            self._children.pop(key, None)
+            parent = dirname(key)
+            self._children.get(parent, set()).discard(key)
+            key = parent
+
+    def get(self, path):
+        """
+        Return the names of the filesystems containing path
+        :return: set of filesystem names or None if the path is not indexed
+        """
+        with self._lock:
+            names = self._locations.get(self._key(path))
+            return set(names) if names is not None else None
+
+    def set(self, path, names):
+        """Record that path exists exactly on the given filesystems"""
+        key = self._key(path)
+        with self._lock:
+            if names:
+                self._locations[key] = set(names)
+                self._link(key)
+                for name in list(self._sizes.get(key, {})):
+                    if name not in names:
+                        del self._sizes[key][name]
+            else:
+                self._locations.pop(key, None)
+                self._sizes.pop(key, None)
+                self._unlink(key)
+
+    def add(self, path, name, size=None):
+        """
+        Record that path exists on the filesystem name
+        :param size: Size of the file on the filesystem if it is known
+        """
+        key = self._key(path)
+        with self._lock:
+            self._locations.setdefault(key, set()).add(name)
+            self._link(key)
+            if size is not None:
+                self._sizes.setdefault(key, {})[name] = size
+
+    def size(self, path, name):
+        """
+        Return the remembered size of the file path on the filesystem name
+        :return: Size in Bytes or None if it is not known
+        """
+        with self._lock:
+            return self._sizes.get(self._key(path), {}).get(name)
+
+    def discard(self, path):
+        """Forget the location of path"""
+        key = self._key(path)
+        with self._lock:
+            self._locations.pop(key, None)
+            self._sizes.pop(key, None)
+            self._unlink(key)
+
+    def invalidate(self, path):
+        """Forget the location of path and of everything below it"""
+        key = self._key(path)
+        with self._lock:
+            below = [key]
+            while below:
+                indexed_path = below.pop()
+                self._locations.pop(indexed_path, None)
+                self._sizes.pop(indexed_path, None)
+                below.extend(self._children.pop(indexed_path, ()))
+            self._unlink(key)
+
+    def clear(self):
+        with self._lock:
+            self._locations.clear()
+            self._sizes.clear()
+            self._children.clear()
+
+    def dumps(self, filesystems):
+        """
+        Serialize the index together with a description of the filesystems
+        it was built for.
+        :param filesystems: dict of filesystem name to description
+        """
+        with self._lock:
+            locations = dict((path, sorted(names))
+                             for path, names in self._locations.items())
+        return json.dumps({"filesystems": filesystems,
+                           "locations": locations})
+
+    def loads(self, data, filesystems):
+        """
+        Replace the index with a serialized one. The snapshot is ignored if it
+        was made for other filesystems.
+        :return: True if the snapshot was loaded
+        """
+        snapshot = json.loads(data)
+        if snapshot["filesystems"] != filesystems:
+            return False
+        with self._lock:
+            self._locations = dict((path, set(names)) for path, names
+                                   in snapshot["locations"].items())
+            self._sizes.clear()
+            self._children.clear()
+            for key in self._locations:
+                self._link(key)
+        return True
+
+
+class SpaceTrackingFile(FileWrapper):
+
+    """
+    A file opened for writing through the WritableMultiFS that accounts the
+    written bytes in the FreeSpaceCache of its filesystem. If on_close is
+    given, it is called with the number of written bytes when the file is
+    closed.
+    """
+
+    def __init__(self, wrapped_file, fs, free_space_cache, on_close=None):
+        super(SpaceTrackingFile, self).__init__(wrapped_file)
+        self.fs = fs
+        self.free_space_cache = free_space_cache
+        self.written = 0
+        self._on_close = on_close
+
+    def _write(self, string, flushing=False):
+        self.wrapped_file.write(string)
+        self.free_space_cache.consume(self.fs, len(string))
+        self.written += len(string)
+
+    def close(self):
+        if self.closed:
+            return
+        super(SpaceTrackingFile, self).close()
+        if self._on_close is not None:
+            self._on_close(self.written)
+
+
 class WritableMultiFS(MultiFS):
 
     """
     A filesystem that let's you write to the MultiFS without choosing
     a writefs explicitely. The WritableMultiFS chooses the best writefs
     automatically, by using the filesystem with the most space left.
+
+    The free space of the filesystems is cached in a FreeSpaceCache and
+    refreshed every free_space_interval seconds.
+
+    Operations that have to be done on several filesystems (makedir, remove,
+    removedir, rename and settimes) are run concurrently on a thread pool
+    with max_workers threads. With a single worker they run one after another.
     """
 
+    def __init__(self, auto_close=True, free_space_interval=60, max_workers=1):
+        """
+        :param auto_close: If True the child filesystems will be closed when
+        the MultiFS is closed
+        :param free_space_interval: Seconds after which the cached free space
+        of a filesystem is refreshed
+        :param max_workers: Number of threads used to run an operation on
+        several filesystems at the same time
+        """
+        super(WritableMultiFS, self).__init__(auto_close=auto_close)
+        self.free_space_cache = FreeSpaceCache(free_space_interval)
+        self.location_index = LocationIndex()
+        self.max_workers = max_workers
+        self._pool = None
+
+    def __getstate__(self):
+        state = super(WritableMultiFS, self).__getstate__()
+        state["_pool"] = None
+        return state
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+        super(WritableMultiFS, self).close()
+
+    def _fan_out(self, action, items):
+        """
+        Call action for every item (usually the affected filesystems). With
+        more than one worker the calls run concurrently. Like the serial loop
+        the error of the first failing item is raised, but only after all the
+        other calls have finished.
+        :return: list of the results in the order of the items
+        """
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [action(item) for item in items]
+
+        def call(item):
+            try:
+                return action(item), None
+            except Exception:
+                return None, sys.exc_info()
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            pool = self._pool
+
+        results = pool.map(call, items)
+        for _, error in results:
+            if error is not None:
+                reraise(*error)
+        return [result for result, _ in results]
+
+    def refresh_free_space(self):
+        """
+        Ask every filesystem for its free space, so the next write doesn't
+        have to wait for it. It is meant to be called while idle.
+        :return: dict with the free space in Bytes for each filesystem
+        """
+        filesystems = [fs for fs in self.fs_sequence if not fs.closed]
+        self._fan_out(self.free_space_cache.refresh, filesystems)
+        return self.free_space_cache.snapshot()
+
+    def _fs_names(self):
+        """Return the names of the filesystems in the order they are searched"""
+        return sorted(self.fs_lookup, key=self._get_priority, reverse=True)
+
+    def _fs_name(self, fs):
+        for name, named_fs in self.fs_lookup.items():
+            if named_fs is fs:
+                return name
+
+    def _locate(self, path):
+        """
+        Return the filesystems that contain path. The location index is used
+        if it knows the path, otherwise every filesystem is asked and the
+        result recorded in the index.
+        """
+        names = self.location_index.get(path)
+        if names is None:
+            names = [name for name in self._fs_names()
+                     if self.fs_lookup[name].exists(path)]
+            self.location_index.set(path, names)
+        return [self.fs_lookup[name] for name in self._fs_names()
+                if name in names]
+
+    def _on_located(self, path, action):
+        """
+        Call action with the filesystems that contain path. If a filesystem
+        doesn't know the path anymore, the index was outdated and the path is
+        looked up on all filesystems again.
+        """
+        indexed = self.location_index.get(path) is not None
+        try:
+            return action(self._locate(path))
+        except ResourceNotFoundError:
+            if not indexed:
+                raise
+            self.location_index.invalidate(path)
+            return action(self._locate(path))
+
+    def _delegate_search(self, path):
+        filesystems = self._locate(path)
+        return filesystems[0] if filesystems else None
+
+    def _check_located(self, path, check=None):
+        """
+        Call check with the first filesystem that contains path. A location
+        from the index is only a hint (it might come from a snapshot of an
+        earlier run), so it is confirmed by the filesystem. If the filesystem
+        doesn't know the path anymore, the location is dropped and the path
+        is searched on all filesystems again.
+        :param check: Function called with the filesystem, None to only check
+        whether the path exists
+        :return: Result of check or whether the path exists
+        """
+        indexed = self.location_index.get(path) is not None
+        fs = self._delegate_search(path)
+        if fs is None:
+            return False
+        if not indexed:
+            # The filesystem has just been asked whether the path exists
+            return check is None or check(fs)
+        if check is not None and check(fs):
+            return True
+        if fs.exists(path):
+            return check is None
+        self.location_index.discard(path)
+        return self._check_located(path, check)
+
+    # Unlike in the MultiFS the lookups are not synchronized, so several
+    # threads can wait for the remotes at the same time. The location index
+    # has a lock of its own.
+
+    def exists(self, path):
+        return self._check_located(path)
+
+    def isdir(self, path):
+        return self._check_located(path, lambda fs: fs.isdir(path))
+
+    def isfile(self, path):
+        return self._check_located(path, lambda fs: fs.isfile(path))
+
+    def save_location_index(self, fs, path):
+        """
+        Write a snapshot of the location index to a file so that it can
+        be loaded again after a restart.
+        :param fs: Filesystem to write the snapshot to
+        :param path: Path of the snapshot
+        """
+        fs.setcontents(path, self.location_index.dumps(self._fs_descriptions()))
+
+    def load_location_index(self, fs, path):
+        """
+        Load a snapshot of the location index. Snapshots that don't exist or
+        that were taken with other filesystems are ignored. The locations of
+        the snapshot are only hints, they are confirmed by the filesystems
+        when the paths are looked up.
+        :return: True if the snapshot was loaded
+        """
+        if not fs.exists(path):
+            return False
+        return self.location_index.loads(fs.getcontents(path, mode="rb"),
+                                         self._fs_descriptions())
+
+    def _fs_descriptions(self):
+        return dict((name, "{0}".format(fs))
+                    for name, fs in self.fs_lookup.items())
+
     @property
     def writefs(self):
         """
@@ -47,7 +533,7 @@ class WritableMultiFS(MultiFS):
         """
         writable_fs = [fs for fs in self.fs_sequence if not fs.closed]
         if len(writable_fs) > 0:
-            return max(writable_fs, key=free_space)
+            return max(writable_fs, key=self.free_space_cache.get)
         else:
             return None
 
@@ -71,31 +557,52 @@ class WritableMultiFS(MultiFS):
             line_buffering=False,
             **kwargs):
         """Search the file and open it on the fileystem where it exists if
-        read mode is specified. Otherwise the best writefs will be choosen
-        and a file created.
+        read or append mode is specified. Otherwise the best writefs will be
+        choosen and a file created.
         """
         if self.isdir(path):
             raise ResourceInvalidError(path)
 
-        if 'r' in mode:
-            for fs in self:
-                if fs.exists(path):
-                    return fs.open(
-                        path,
-                        mode=mode,
-                        buffering=buffering,
-                        encoding=encoding,
-                        errors=errors,
-                        newline=newline,
-                        line_buffering=line_buffering,
-                        **kwargs)
+        def open_located(filesystems):
+            for fs in filesystems:
+                f = fs.open(
+                    path,
+                    mode=mode,
+                    buffering=buffering,
+                    encoding=encoding,
+                    errors=errors,
+                    newline=newline,
+                    line_buffering=line_buffering,
+                    **kwargs)
+                if 'a' not in mode:
+                    return f
+                # The appended bytes grow the file where it already is
+                name = self._fs_name(fs)
+                size = self.location_index.size(path, name)
+
+                def on_close(written):
+                    if size is not None:
+                        self.location_index.add(path, name, size + written)
+                return SpaceTrackingFile(f, fs, self.free_space_cache,
+                                         on_close)
+
+        if 'r' in mode or 'a' in mode:
+            f = self._on_located(path, open_located)
+            if f is not None:
+                return f
 
         if 'w' in mode and '+' not in mode and self.exists(path):
             self.remove(path)
 
-        return super(
-            WritableMultiFS,
-            self).open(
+        if 'w' not in mode and '+' not in mode and 'a' not in mode:
+            return super(WritableMultiFS, self).open(path, mode=mode, **kwargs)
+
+        writefs = self.writefs
+        if writefs is None:
+            raise OperationFailedError('open', path=path,
+                                       msg="No writeable FS set")
+
+        f = writefs.open(
             path,
             mode=mode,
             buffering=buffering,
@@ -104,56 +611,152 @@ class WritableMultiFS(MultiFS):
             newline=newline,
             line_buffering=line_buffering,
             **kwargs)
+        name = self._fs_name(writefs)
+        self.location_index.add(path, name)
+        on_close = None
+        if 'w' in mode:
+            # A new file has exactly the written size
+            def on_close(written):
+                self.location_index.add(path, name, written)
+        return SpaceTrackingFile(f, writefs, self.free_space_cache, on_close)
+
+    def setcontents(self, path, data=b'', encoding=None, errors=None,
+                    chunk_size=64 * 1024):
+        """
+        Write data to the filesystem with the most free space. If the size of
+        the data is known it is reserved in the free space cache before
+        writing, so that concurrent writes are spread over the filesystems.
+        """
+        if not isinstance(data, bytes):
+            return super(WritableMultiFS, self).setcontents(
+                path, data, encoding=encoding, errors=errors,
+                chunk_size=chunk_size)
 
-    def remove(self, path):
-        """Remove the file on all filesystems"""
         if self.isdir(path):
             raise ResourceInvalidError(path)
+        if self.exists(path):
+            self.remove(path)
+
+        with self._lock:
+            writefs = self.writefs
+            if writefs is None:
+                raise OperationFailedError('setcontents', path=path,
+                                           msg="No writeable FS set")
+            self.free_space_cache.consume(writefs, len(data))
 
-        affected_filesystems = [fs for fs in self if fs.exists(path)]
+        try:
+            writefs.setcontents(path, data, chunk_size=chunk_size)
+        except Exception:
+            self.free_space_cache.release(writefs, len(data))
+            raise
+        self.location_index.add(path, self._fs_name(writefs), len(data))
+        return len(data)
 
-        if len(affected_filesystems) == 0:
+    def getinfo(self, path):
+        def getinfo_located(filesystems):
+            for fs in filesystems:
+                info = fs.getinfo(path)
+                if "size" in info:
+                    self.location_index.add(path, self._fs_name(fs), info["size"])
+                return info
             raise ResourceNotFoundError(path)
 
-        for fs in affected_filesystems:
+        return self._on_located(path, getinfo_located)
+
+    def remove(self, path):
+        """Remove the file on all filesystems"""
+        if self.isdir(path):
+            raise ResourceInvalidError(path)
+
+        def remove_from(fs):
+            size = self.location_index.size(path, self._fs_name(fs))
             fs.remove(path)
+            if size is not None:
+                self.free_space_cache.release(fs, size)
+            else:
+                # Asking for the free space again once is cheaper than asking
+                # for the size of every removed file
+                self.free_space_cache.invalidate(fs)
+
+        def remove_located(affected_filesystems):
+            if len(affected_filesystems) == 0:
+                raise ResourceNotFoundError(path)
+
+            self._fan_out(remove_from, affected_filesystems)
+
+        self._on_located(path, remove_located)
+        self.location_index.discard(path)
 
-    def listdir(self, path="/", *args, **kwargs):
+    def listdir(self, path="/", wildcard=None, full=False, absolute=False,
+                dirs_only=False, files_only=False):
         """
         Default path has to be "/" and not "./" (like in the normal MultiFS
-        implementation). Otherwise the absolute paths look really weird
+        implementation). Otherwise the absolute paths look really weird.
+        The listings of the filesystems are recorded in the location index.
         :raise ResourceNotFoundError: when given path does not exist
         """
         if not self.exists(path):
             raise ResourceNotFoundError(path)
         if not self.isdir(path):
             raise ResourceInvalidError(path)
-        return super(WritableMultiFS, self).listdir(path, *args, **kwargs)
+
+        paths = []
+        locations = {}
+        for name in self._fs_names():
+            try:
+                listing = self.fs_lookup[name].listdir(
+                    path, wildcard=wildcard, full=full, absolute=absolute,
+                    dirs_only=dirs_only, files_only=files_only)
+            except FSError:
+                continue
+            paths += listing
+            for entry in listing:
+                locations.setdefault(basename(entry), set()).add(name)
+
+        for entry, names in locations.items():
+            self.location_index.set(pathjoin(path, entry), names)
+        return list(set(paths))
 
     def settimes(self, path, accessed_time=None, modified_time=None):
         """Set accessed_time and modified_time on all filesystems
         that contain the the file"""
-        affected_filesystems = [fs for fs in self if fs.exists(path)]
-        for fs in affected_filesystems:
-            fs.settimes(path, accessed_time, modified_time)
+        def settimes_located(affected_filesystems):
+            self._fan_out(lambda fs: fs.settimes(path, accessed_time, modified_time),
+                          affected_filesystems)
+
+        self._on_located(path, settimes_located)
 
     def rename(self, src, dst):
         """Rename file on all filesystems where it exists"""
-        affected_filesystems = [fs for fs in self if fs.exists(src)]
-        for fs in affected_filesystems:
-            fs.rename(src, dst)
+        def rename_located(affected_filesystems):
+            self._fan_out(lambda fs: fs.rename(src, dst), affected_filesystems)
+            return [self._fs_name(fs) for fs in affected_filesystems]
+
+        names = self._on_located(src, rename_located)
+        self.location_index.invalidate(src)
+        self.location_index.invalidate(dst)
+        self.location_index.set(dst, names)
 
     def removedir(self, path, recursive=False, force=False):
         if normpath(path) in ('', '/'):
             raise RemoveRootError(path)
 
-        affected_filesystems = [fs for fs in self if fs.exists(path)]
+        def removedir_from(fs):
+            fs.removedir(path, recursive=recursive, force=force)
+            self.free_space_cache.invalidate(fs)
 
-        if len(affected_filesystems) == 0:
-            raise ResourceNotFoundError(path)
+        def removedir_located(affected_filesystems):
+            if len(affected_filesystems) == 0:
+                raise ResourceNotFoundError(path)
 
-        for fs in affected_filesystems:
-            fs.removedir(path, recursive=recursive, force=force)
+            self._fan_out(removedir_from, affected_filesystems)
+
+        self._on_located(path, removedir_located)
+        self.location_index.invalidate(path)
+        if recursive:
+            # Empty parent directories have been removed as well
+            for parent in recursepath(dirname(path))[1:]:
+                self.location_index.discard(parent)
 
     def getsyspath(self, path, allow_none=False):
         """
@@ -165,5 +768,23 @@ class WritableMultiFS(MultiFS):
         return None
 
     def makedir(self, path, **kwargs):
-        for fs in self:
-            fs.makedir(path, **kwargs)
+        def makedir_on(name):
+            self.fs_lookup[name].makedir(path, **kwargs)
+            self.location_index.add(path, name)
+
+        self._fan_out(makedir_on, self._fs_names())
+
+    def getmeta(self, meta_name, default=NoDefaultMeta):
+        """
+        The free space of the WritableMultiFS is the sum of the cached free
+        space of all filesystems.
+        """
+        if meta_name == "free_space":
+            try:
+                return sum(self.free_space_cache.get(fs) for fs in self
+                           if not fs.closed)
+            except NoMetaError:
+                if default is not NoDefaultMeta:
+                    return default
+                raise
+        return super(WritableMultiFS, self).getmeta(meta_name, default)
@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
+from datetime import datetime
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from hashlib import sha1
 import fnmatch
+import json
 import re
 import stat
-
-from fs.errors import ResourceNotFoundError, ResourceInvalidError, NoSysPathError
-from fs.filelike import FileLikeBase, FileWrapper
+import threading
+
+from fs.errors import (
+    ResourceNotFoundError,
+    ResourceInvalidError,
+    DestinationExistsError,
+    NoSysPathError)
+from fs.filelike import FileLikeBase, FileWrapper, NotSeekableError
 from fs.path import dirname, basename, splitext, pathcombine, abspath
 from fs.wrapfs import WrapFS, wrap_fs_methods, rewrite_errors
 
+from cuckoodrive.utils import datetime_to_epoch, epoch_to_datetime, kb
+
 
 class PartedFS(WrapFS):
     """
@@ -32,6 +44,40 @@ class PartedFS(WrapFS):
 
     One problem is, that we never know wether a file is complete, because there might
     be one missing part.
+
+    If use_manifest is set, every file gets a small manifest next to its parts that records
+    the part sizes and timestamps (see PartManifest)::
+
+    `-- backups
+        |-- backup.tar.manifest
+        |-- backup.tar.part0 (100MB)
+        |-- backup.tar.part1 (100MB)
+        `-- backup.tar.part2 (40MB)
+
+    Metadata operations like getsize or getinfo then only need to read the manifest
+    instead of listing the whole directory on the wrapped filesystem. Files without a
+    manifest are still handled by looking up their parts.
+
+    If upload_workers is set, files opened in write mode are striped: every part after
+    the first one is filled in memory and uploaded in the background as soon as it is
+    complete, so several parts of a large file are uploaded at the same time
+    (see PartUploader).
+
+    If prefetch_parts is set, files opened read-only are read ahead: while the consumer
+    reads one part, the next prefetch_parts parts are already downloaded in the background
+    (see PartPrefetcher).
+
+    Files opened read-only open their parts on demand the first time the file pointer
+    enters them. If close_parts is set, a part is closed again as soon as the file pointer
+    leaves it, so only a single part of the file is open at a time.
+
+    Reads are streamed: a single read from a part never returns more than
+    read_buffer_size bytes, so reading or copying a large file only holds a small buffer
+    in memory instead of whole parts.
+
+    Byte ranges of a file can be read without opening it with readrange and readranges.
+    They only open the parts that cover the ranges and read them concurrently with
+    range_workers threads.
     """
 
     _meta = {
@@ -41,15 +87,57 @@ class PartedFS(WrapFS):
         "case_insensitive_paths": False
     }
 
-    def __init__(self, fs, max_part_size):
+    def __init__(self, fs, max_part_size, use_manifest=False, upload_workers=0,
+                 max_upload_buffer=None, prefetch_parts=0, close_parts=False,
+                 read_buffer_size=kb(64), range_workers=4):
         """
         Create a PartedFS with an underlying filesystem.
         :param fs: The underlying filesystem where the many small files will be stored
         :param max_part_size: The max size one part of a file can reach.
+        :param use_manifest: Write a manifest for every file and use it for metadata lookups
+        :param upload_workers: Number of parts that are uploaded in the background at the
+        same time. With 0 the parts are written directly.
+        :param max_upload_buffer: Max bytes of completed parts waiting for their upload.
+        Defaults to one part per upload worker.
+        :param prefetch_parts: Number of parts that are read ahead in the background when a
+        file is read sequentially. With 0 the parts are read when they are reached.
+        :param close_parts: Close the parts of files opened read-only once they are left
+        :param read_buffer_size: Max bytes that are read from a part at once
+        :param range_workers: Number of parts that are read at the same time by readranges
         """
         self.max_part_size = max_part_size
+        self.use_manifest = use_manifest
+        self.close_parts = close_parts
+        self.read_buffer_size = read_buffer_size
+        self.uploader = None
+        if upload_workers > 0:
+            self.uploader = PartUploader(upload_workers,
+                                         max_upload_buffer or upload_workers * max_part_size)
+        self.prefetcher = None
+        if prefetch_parts > 0:
+            self.prefetcher = PartPrefetcher(prefetch_parts)
+        self.range_workers = range_workers
+        self._range_pool = None
         super(PartedFS, self).__init__(fs)
 
+    def __getstate__(self):
+        state = super(PartedFS, self).__getstate__()
+        state["uploader"] = None
+        state["prefetcher"] = None
+        state["_range_pool"] = None
+        return state
+
+    def close(self):
+        if self.uploader is not None:
+            self.uploader.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        with self._lock:
+            if self._range_pool is not None:
+                self._range_pool.close()
+                self._range_pool = None
+        super(PartedFS, self).close()
+
     def _encode(self, path, part_index=0):
         """
         Add the .part0 extension to the given path
@@ -77,6 +165,27 @@ class PartedFS(WrapFS):
                                        wildcard="{0}.part*".format(basename(path)),
                                        full=full, absolute=absolute, files_only=True)
 
+    def getmanifest(self, path):
+        """
+        Return the manifest of a virtual file.
+        :param path: Path of the virtual file
+        :returns PartManifest or None if manifests are disabled or the file has none
+        """
+        if not self.use_manifest:
+            return None
+        return PartManifest.load(self.wrapped_fs, path)
+
+    def _part_paths(self, path, manifest=None):
+        """
+        Return the paths of all parts of a virtual file in the correct order. The manifest
+        is used if there is one, otherwise the parts are looked up on the wrapped fs.
+        """
+        if manifest is None:
+            manifest = self.getmanifest(path)
+        if manifest is not None:
+            return [self._encode(path, idx) for idx in range(len(manifest.part_sizes))]
+        return sorted(self.listparts(path))
+
     def remove(self, path):
         """
         Remove a virtual file with path from the filesystem. This will delete all associated paths.
@@ -88,8 +197,11 @@ class PartedFS(WrapFS):
         if self.isdir(path):
             raise ResourceInvalidError(path)
 
-        for part in self.listparts(path):
+        manifest = self.getmanifest(path)
+        for part in self._part_paths(path, manifest):
             self.wrapped_fs.remove(part)
+        if manifest is not None:
+            PartManifest.remove(self.wrapped_fs, path)
 
     def isdir(self, path):
         return self.wrapped_fs.isdir(path)
@@ -181,19 +293,56 @@ class PartedFS(WrapFS):
             raise ResourceInvalidError(path)
 
         if "w" not in mode and "a" not in mode:
-            if self.exists(path):
-                parts = [create_file_part(p) for p in sorted(self.listparts(path))]
+            manifest = self.getmanifest(path)
+            if manifest is not None or self.exists(path):
+                part_paths = self._part_paths(path, manifest)
+                if "+" in mode:
+                    parts = [create_file_part(p) for p in part_paths]
+                else:
+                    parts = [None] * len(part_paths)
+                if manifest is not None:
+                    size = manifest.size
+                else:
+                    size = self._size_of_parts(path, len(part_paths))
+                if manifest is None and self.use_manifest and "+" in mode:
+                    # Only a file that might be written gets a manifest, reading doesn't
+                    # touch the remote
+                    manifest = self._manifest_of_parts(part_paths)
+                prefetcher = self.prefetcher if "+" not in mode else None
+                close_parts = self.close_parts and "+" not in mode
                 return PartedFile(fs=self.wrapped_fs, path=path, mode=mode,
-                                  max_part_size=self.max_part_size, parts=parts)
+                                  max_part_size=self.max_part_size, parts=parts,
+                                  size=size, manifest=manifest, prefetcher=prefetcher,
+                                  close_parts=close_parts,
+                                  read_buffer_size=self.read_buffer_size)
             else:
                 raise ResourceNotFoundError(path)
 
         if 'w' in mode and not '+' in mode and self.exists(path):
             self.remove(path)
 
+        if "a" in mode and self.exists(path):
+            # Append behind the existing parts, only the last part is written to
+            manifest = self.getmanifest(path)
+            part_paths = self._part_paths(path, manifest)
+            if manifest is not None:
+                size = manifest.size
+            else:
+                size = self._size_of_parts(path, len(part_paths))
+            if manifest is None and self.use_manifest:
+                manifest = self._manifest_of_parts(part_paths)
+            parts = [None] * (len(part_paths) - 1) + [create_file_part(part_paths[-1])]
+            return PartedFile(fs=self.wrapped_fs, path=path, mode=mode,
+                              max_part_size=self.max_part_size, parts=parts, size=size,
+                              manifest=manifest, read_buffer_size=self.read_buffer_size)
+
+        manifest = PartManifest() if self.use_manifest else None
+        uploader = self.uploader if "w" in mode and "+" not in mode else None
         return PartedFile(fs=self.wrapped_fs, path=path, mode=mode,
                           max_part_size=self.max_part_size,
-                          parts=[create_file_part(self._encode(path))])
+                          parts=[create_file_part(self._encode(path))],
+                          manifest=manifest, uploader=uploader,
+                          read_buffer_size=self.read_buffer_size)
 
     def rename(self, src, dst):
         """
@@ -205,10 +354,29 @@ class PartedFS(WrapFS):
         if self.isdir(src):
             self.wrapped_fs.rename(src, dst)
         else:
-            for idx, part in enumerate(sorted(self.listparts(src))):
+            manifest = self.getmanifest(src)
+            for idx, part in enumerate(self._part_paths(src, manifest)):
                 part_src = self._encode(self._decode(part), part_index=idx)
                 part_dst = self._encode(dst, part_index=idx)
                 self.wrapped_fs.rename(part_src, part_dst)
+            if manifest is not None:
+                PartManifest.rename(self.wrapped_fs, src, dst)
+
+    def move(self, src, dst, overwrite=False, chunk_size=16384):
+        """
+        Move a virtual file by renaming all of its parts.
+        """
+        if not self.exists(src):
+            raise ResourceNotFoundError(src)
+        if self.isdir(src):
+            raise ResourceInvalidError(src)
+
+        if self.exists(dst):
+            if not overwrite:
+                raise DestinationExistsError(dst)
+            self.remove(dst)
+
+        self.rename(src, dst)
 
     def walkfiles(self, path="/", wildcard=None, dir_wildcard=None, search="breadth",
                   ignore_errors=False):
@@ -227,6 +395,8 @@ class PartedFS(WrapFS):
                 wildcard = lambda fn: bool(wildcard_re.match(fn))
             for filepath in self.wrapped_fs.walkfiles(path, search=search,
                                                       ignore_errors=ignore_errors):
+                if not filepath.endswith(".part0"):
+                    continue
                 filepath = abspath(self._decode(filepath))
                 if wildcard is not None:
                     if not wildcard(basename(filepath)):
@@ -246,7 +416,7 @@ class PartedFS(WrapFS):
             for (dirpath, filepaths) in self.wrapped_fs.walk(path, search=search,
                                                              ignore_errors=ignore_errors):
                 filepaths = [basename(self._decode(pathcombine(dirpath, p)))
-                             for p in filepaths]
+                             for p in filepaths if p.endswith(".part0")]
                 if wildcard is not None:
                     filepaths = [p for p in filepaths if wildcard(p)]
                 yield (dirpath, filepaths)
@@ -259,6 +429,12 @@ class PartedFS(WrapFS):
         Assemble the info of all the parts and use the most recent updated
         timestamps of the parts as values of the file.
         """
+        manifest = self.getmanifest(path)
+        if manifest is not None:
+            info = manifest.getinfo()
+            info['st_mode'] = 0o666 | stat.S_IFREG
+            return info
+
         if not self.exists(path):
             raise ResourceNotFoundError(path)
 
@@ -283,18 +459,158 @@ class PartedFS(WrapFS):
             Copies a file from src to dst. This will copy al the parts of one file
             to the respective location of the new file
             """
-        if not self.exists(src):
+        manifest = self.getmanifest(src)
+        if manifest is None and not self.exists(src):
             raise ResourceNotFoundError(src)
-        for idx, part_src in enumerate(sorted(self.listparts(src))):
+        for idx, part_src in enumerate(self._part_paths(src, manifest)):
             part_dst = self._encode(dst, idx)
             self.wrapped_fs.copy(part_src, part_dst, **kwds)
+        if manifest is not None:
+            manifest.save(self.wrapped_fs, dst)
 
     def getsize(self, path):
         """Calculates the sum of all parts as filesize"""
+        manifest = self.getmanifest(path)
+        if manifest is not None:
+            return manifest.size
         if not self.exists(path):
             raise ResourceNotFoundError(path)
         return sum([self.wrapped_fs.getsize(part) for part in self.listparts(path)])
 
+    def updatefile(self, path, src_file):
+        """
+        Update a file with the contents of src_file and only rewrite the parts that changed.
+        The source is hashed at the part borders and compared with the checksums of the
+        manifest. Parts with another checksum or new parts are written, parts that are no
+        longer needed are removed. Without checksums the whole file is rewritten.
+        :param src_file: File-like object the new contents are read from
+        :returns List with the indexes of the written parts
+        """
+        manifest = self.getmanifest(path)
+        if manifest is None or manifest.part_checksums is None:
+            with self.open(path, mode="wb") as fh:
+                while True:
+                    data = src_file.read(self.max_part_size)
+                    if not data:
+                        break
+                    fh.write(data)
+            return list(range(len(self._part_paths(path))))
+
+        written, part_sizes, part_checksums = [], [], []
+        while True:
+            data = src_file.read(self.max_part_size)
+            idx = len(part_sizes)
+            if not data and idx > 0:
+                break
+
+            checksum = sha1(data).hexdigest()
+            if idx >= len(manifest.part_checksums) or manifest.part_checksums[idx] != checksum:
+                self.wrapped_fs.setcontents(self._encode(path, idx), data)
+                written.append(idx)
+            part_sizes.append(len(data))
+            part_checksums.append(checksum)
+            if len(data) < self.max_part_size:
+                break
+
+        for idx in range(len(part_sizes), len(manifest.part_sizes)):
+            self.wrapped_fs.remove(self._encode(path, idx))
+
+        manifest.part_sizes = part_sizes
+        manifest.part_checksums = part_checksums
+        manifest.modified_time = manifest.accessed_time = datetime.now()
+        manifest.save(self.wrapped_fs, path)
+        return written
+
+    def _size_of_parts(self, path, part_count):
+        """
+        Calculate the size of a file out of its number of parts. All parts except the last
+        one are full, so only the size of the last part has to be looked up.
+        """
+        if part_count == 0:
+            return 0
+        last_part = self.wrapped_fs.getsize(self._encode(path, part_count - 1))
+        return (part_count - 1) * self.max_part_size + last_part
+
+    def _manifest_of_parts(self, part_paths):
+        """
+        Build the manifest of a file that has been written without one. The timestamps are
+        taken from the parts like getinfo does, so adding the manifest doesn't change them.
+        """
+        part_infos = [self.wrapped_fs.getinfo(part_path) for part_path in part_paths]
+        return PartManifest(part_sizes=[info.get("size", 0) for info in part_infos],
+                            created_time=max(i.get("created_time") for i in part_infos),
+                            modified_time=max(i.get("modified_time") for i in part_infos),
+                            accessed_time=max(i.get("accessed_time") for i in part_infos))
+
+    def readrange(self, path, offset, length):
+        """
+        Read length bytes at offset of a file without opening the whole file.
+        :returns The bytes of the range, less if the file ends before
+        """
+        return self.readranges(path, [(offset, length)])[0]
+
+    def readranges(self, path, ranges):
+        """
+        Read many byte ranges of a file at once. Only the parts that cover the ranges are
+        opened and the pieces of all ranges are read concurrently.
+        :param ranges: List of (offset, length) tuples
+        :returns List with the bytes of every range
+        """
+        if not self.isfile(path):
+            raise ResourceNotFoundError(path)
+
+        pieces = []
+        range_pieces = []
+        for offset, length in ranges:
+            first = len(pieces)
+            end = offset + length
+            while offset < end:
+                idx = offset // self.max_part_size
+                part_offset = offset - idx * self.max_part_size
+                piece_length = min(end - offset, self.max_part_size - part_offset)
+                pieces.append((self._encode(path, idx), part_offset, piece_length))
+                offset += piece_length
+            range_pieces.append((first, len(pieces)))
+
+        if len(pieces) > 1 and self.range_workers > 1:
+            with self._lock:
+                if self._range_pool is None:
+                    self._range_pool = ThreadPool(self.range_workers)
+                pool = self._range_pool
+            data = pool.map(self._read_piece, pieces)
+        else:
+            data = [self._read_piece(piece) for piece in pieces]
+        return [b"".join(data[first:last]) for first, last in range_pieces]
+
+    def _read_piece(self, piece):
+        """
+        Read a piece of a range out of a single part. Parts after the end of the file are empty.
+        """
+        part_path, offset, length = piece
+        try:
+            with self.wrapped_fs.open(part_path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        except ResourceNotFoundError:
+            return b""
+
+    def settimes(self, path, accessed_time=None, modified_time=None):
+        """
+        Set the times on all parts of a file and keep the manifest up to date.
+        """
+        if self.isdir(path):
+            return self.wrapped_fs.settimes(path, accessed_time, modified_time)
+
+        manifest = self.getmanifest(path)
+        for part in self._part_paths(path, manifest):
+            self.wrapped_fs.settimes(part, accessed_time, modified_time)
+
+        if manifest is not None:
+            now = datetime.now()
+            manifest.accessed_time = accessed_time or now
+            manifest.modified_time = modified_time or now
+            manifest.save(self.wrapped_fs, path)
+
     def getsyspath(self, path, allow_none=False):
         """Because the file is split into two parts we cannot provide a syspath"""
         if not allow_none:
@@ -302,6 +618,220 @@ class PartedFS(WrapFS):
         return None
 
 
+class PartManifest(object):
+    """
+    A manifest describes the layout of a virtual file of the PartedFS. It records the size of
+    every part and the timestamps of the file and is stored next to the parts on the wrapped fs::
+
+        {"parts": [4096, 4096, 1024], "checksums": [...], "created_time": ..., ...}
+
+    The manifest is written by the PartedFile when it is closed. If the file has been
+    written from start to end, the manifest also records a SHA-1 checksum of every part,
+    so an update can find out which parts have changed (see PartedFS.updatefile).
+    """
+
+    def __init__(self, part_sizes=None, created_time=None, modified_time=None,
+                 accessed_time=None, part_checksums=None):
+        now = datetime.now()
+        self.part_sizes = part_sizes or []
+        self.part_checksums = part_checksums
+        self.created_time = created_time or now
+        self.modified_time = modified_time or now
+        self.accessed_time = accessed_time or now
+
+    @staticmethod
+    def encode_path(path):
+        """
+        Add the .manifest extension to the given path
+        """
+        return "{0}.manifest".format(path)
+
+    @property
+    def size(self):
+        return sum(self.part_sizes)
+
+    def update(self, size, part_count, max_part_size, part_checksums=None):
+        """
+        Recalculate the part sizes for a file with the given size and touch the file.
+        All parts except the last one are always completely filled.
+        :param size: New size of the whole file
+        :param part_count: Number of parts the file consists of
+        :param max_part_size: The max size one part of a file can reach
+        :param part_checksums: Checksums of the parts or None if they are unknown
+        """
+        self.part_sizes = [max(0, min(max_part_size, size - idx * max_part_size))
+                           for idx in range(part_count)]
+        self.part_checksums = part_checksums
+        self.modified_time = self.accessed_time = datetime.now()
+
+    def getinfo(self):
+        """
+        Return the info dictionary of the file the same way PartedFS.getinfo would
+        assemble it from the parts.
+        """
+        times = {
+            "created_time": self.created_time,
+            "modified_time": self.modified_time,
+            "accessed_time": self.accessed_time
+        }
+        info = dict(times, size=self.size)
+        info["parts"] = [dict(times, size=part_size) for part_size in self.part_sizes]
+        return info
+
+    def dumps(self):
+        return json.dumps({
+            "parts": self.part_sizes,
+            "checksums": self.part_checksums,
+            "created_time": datetime_to_epoch(self.created_time),
+            "modified_time": datetime_to_epoch(self.modified_time),
+            "accessed_time": datetime_to_epoch(self.accessed_time)
+        })
+
+    @classmethod
+    def loads(cls, data):
+        values = json.loads(data)
+        return cls(part_sizes=values["parts"],
+                   part_checksums=values.get("checksums"),
+                   created_time=epoch_to_datetime(values["created_time"]),
+                   modified_time=epoch_to_datetime(values["modified_time"]),
+                   accessed_time=epoch_to_datetime(values["accessed_time"]))
+
+    def save(self, fs, path):
+        """
+        Write the manifest of the virtual file path to the filesystem
+        """
+        fs.setcontents(self.encode_path(path), self.dumps())
+
+    @classmethod
+    def load(cls, fs, path):
+        """
+        Read the manifest of the virtual file path from the filesystem
+        :returns PartManifest or None if there is no manifest for the path
+        """
+        try:
+            return cls.loads(fs.getcontents(cls.encode_path(path), mode="rb"))
+        except (ResourceNotFoundError, ResourceInvalidError):
+            return None
+
+    @classmethod
+    def remove(cls, fs, path):
+        fs.remove(cls.encode_path(path))
+
+    @classmethod
+    def rename(cls, fs, src, dst):
+        fs.rename(cls.encode_path(src), cls.encode_path(dst))
+
+
+class PartUploader(object):
+    """
+    Uploads completed parts of striped PartedFiles in the background.
+    The parts are written with setcontents, so a WritableMultiFS can reserve the
+    space of a part and place parts that are uploaded at the same time on different
+    remotes. At most max_buffer bytes of parts are waiting for their upload. If a file
+    completes parts faster, writing blocks until an upload has finished.
+    """
+
+    def __init__(self, workers, max_buffer):
+        """
+        :param workers: Number of parts that are uploaded at the same time
+        :param max_buffer: Max bytes of parts that are queued or being uploaded
+        """
+        self.workers = workers
+        self.max_buffer = max_buffer
+        self.buffered = 0
+        self._pool = None
+        self._condition = threading.Condition()
+
+    def _upload(self, fs, path, data):
+        try:
+            fs.setcontents(path, data)
+        finally:
+            with self._condition:
+                self.buffered -= len(data)
+                self._condition.notify_all()
+
+    def submit(self, fs, path, data):
+        """
+        Upload data to path in the background. Blocks while too many bytes are buffered.
+        :returns AsyncResult that raises the error of the upload on get()
+        """
+        with self._condition:
+            while self.buffered > 0 and self.buffered + len(data) > self.max_buffer:
+                self._condition.wait()
+            self.buffered += len(data)
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            pool = self._pool
+        return pool.apply_async(self._upload, (fs, path, data))
+
+    def close(self):
+        with self._condition:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+class PartPrefetcher(object):
+    """
+    Reads the parts of sequentially read PartedFiles ahead in the background.
+    Every part is downloaded as a whole with getcontents, so a WritableMultiFS fetches
+    each part from the remote that holds it and parts on different remotes are downloaded
+    at the same time. A file keeps at most the current part and the parts_ahead following
+    parts in memory. Parts are only read ahead while a file is read sequentially, a seek
+    cancels the fetches that haven't started yet.
+    """
+
+    def __init__(self, parts_ahead):
+        """
+        :param parts_ahead: Number of parts that are read ahead of the current part
+        """
+        self.parts_ahead = parts_ahead
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def fetch(self, fs, path):
+        """
+        Read the contents of path in the background.
+        :returns PartFetch that returns the contents or raises the error of the read on get()
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.parts_ahead + 1)
+            pool = self._pool
+        fetch = PartFetch()
+        fetch.result = pool.apply_async(fetch.run, (fs, path))
+        return fetch
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+class PartFetch(object):
+    """A part that is read in the background by the PartPrefetcher"""
+
+    def __init__(self):
+        self.result = None
+        self.cancelled = False
+
+    def run(self, fs, path):
+        if self.cancelled:
+            return None
+        return fs.getcontents(path, "rb")
+
+    def get(self, timeout=None):
+        return self.result.get(timeout)
+
+    def wait(self, timeout=None):
+        self.result.wait(timeout)
+
+    def cancel(self):
+        """Skip the read if it hasn't started yet"""
+        self.cancelled = True
+
+
 class PartSizeExceeded(Exception):
     pass
 
@@ -319,14 +849,56 @@ class PartedFile(FileLikeBase):
     The _write method for example, just tries to write the data, that can fit into the current
     part, the rest is returned.
     The FileLikeBase will buffer that by itself and look that this will be written again.
+    If a manifest is given, it is updated and written to the fs when the file is closed.
+
+    If an uploader is given, the file is striped: the first part is written directly but
+    the following parts are in-memory buffers that are handed to the uploader as soon as
+    they are full. A striped file cannot seek back into parts that have been left behind.
+
+    If a prefetcher is given, the file is read from whole parts instead of from the part
+    files. The following parts are fetched ahead once the file is read sequentially, i.e.
+    from its start or on from the previous part, until the next seek.
+
+    Parts that are None have not been opened yet and are opened once the file pointer
+    enters them. With close_parts, the part that has been left is closed again.
+
+    A read returns at most read_buffer_size bytes and never crosses the border of a part.
+    The FileLikeBase calls _read again until it has read the requested size.
+
+    The size of the file is passed in when it is opened, which allows seeking relative to
+    the end of the file and reading its tail without touching the other parts.
     """
 
-    def __init__(self, fs, path, mode, parts, max_part_size):
+    def __init__(self, fs, path, mode, parts, max_part_size, size=0, manifest=None,
+                 uploader=None, prefetcher=None, close_parts=False, read_buffer_size=kb(64)):
         super(PartedFile, self).__init__()
         self._path = path
         self._fs = fs
         self._file_pointer = 0
         self._mode = mode
+        self._size = size
+        self._manifest = manifest
+        # Running checksums of the parts, only known while the file is written sequentially
+        self._hashes = [] if manifest is not None and "w" in mode else None
+        self._uploader = uploader
+        self._uploads = []
+        self._prefetcher = prefetcher
+        self._prefetched = {}
+        self._read_ahead = True
+        self._read_part_idx = None
+        self._close_parts = close_parts
+        self._read_buffer_size = read_buffer_size
+        # A manifest that has never been saved is written on close, otherwise the manifest
+        # is only rewritten if the file has been written
+        self._modified = manifest is not None and not manifest.part_sizes
+        # All parts start at their beginning like the file pointer
+        self._part_idx = 0
+        self._part_positioned = True
+        if "a" in mode:
+            # An appended file starts at its end, the last part has been opened in append
+            # mode and is already positioned there
+            self._file_pointer = size
+            self._part_idx = len(parts) - 1
 
         self.parts = parts
         self.max_part_size = max_part_size
@@ -334,88 +906,307 @@ class PartedFile(FileLikeBase):
     @property
     def current_part(self):
         """
-        Calculates the current part by looking up in which part the file pointer must be.
-        If there are no parts it returns None.
+        Calculates the current part directly from the file pointer and the max part size.
         """
-        size = 0
-        for part in self.parts:
-            size += self.max_part_size
-            if size > self._file_pointer:
-                return part
+        idx = self._file_pointer // self.max_part_size
+        if idx < len(self.parts):
+            return self._part(idx)
 
         if self._mode == "r":
             raise InvalidFilePointerLocation(
                 "File pointer points to a location that is not part of the file.")
         else:
+            self._part_idx = len(self.parts)
+            self._part_positioned = True
             return self._expand_part()
 
+    def _part(self, idx):
+        """
+        Return the part idx and open it if it has not been opened yet.
+        When the file pointer has entered the part from another part or has been moved by a
+        seek, the part is positioned at the file pointer. Only this part is touched, the
+        other parts are positioned once the file pointer enters them.
+        If close_parts is set, the part that was used before is closed.
+        """
+        if idx != self._part_idx:
+            if self._close_parts and self._part_idx < len(self.parts):
+                previous = self.parts[self._part_idx]
+                if previous is not None:
+                    previous.close()
+                    self.parts[self._part_idx] = None
+            self._part_idx = idx
+            self._part_positioned = False
+
+        part = self.parts[idx]
+        offset = self._file_pointer - idx * self.max_part_size
+        if part is None:
+            path = self._path + ".part{0}".format(idx)
+            part = self.parts[idx] = FilePart(self._fs.open(path, mode=self._mode))
+            self._part_positioned = offset == 0
+        if not self._part_positioned:
+            part.seek(offset, 0)
+            self._part_positioned = True
+        return part
+
     def _expand_part(self):
         """
         Expand the current_part to a new file and return it.
         TODO: this logic should perhaps go into the filesystem not the file
         """
-        path = self._path + ".part{0}".format(len(self.parts))
-        wrapped_part = self._fs.open(path, mode=self._mode)
-        new_part = FilePart(wrapped_part)
+        if self._uploader is not None:
+            self._upload_part(len(self.parts) - 1)
+            new_part = FilePart(BytesIO())
+        else:
+            path = self._path + ".part{0}".format(len(self.parts))
+            # Not every filesystem creates missing files in append mode
+            new_part = FilePart(self._fs.open(path, mode=self._mode.replace("a", "w")))
         self.parts.append(new_part)
         return new_part
 
+    def _upload_part(self, idx):
+        """
+        Hand the buffer of a completed part to the uploader and release it.
+        The first part is not buffered and is written directly.
+        """
+        if idx == 0:
+            return
+        part = self.parts[idx]
+        part.flush()
+        data = part.wrapped_file.getvalue()
+        part.close()
+        path = self._path + ".part{0}".format(idx)
+        self._uploads.append(self._uploader.submit(self._fs, path, data))
+
     @property
     def _space_left(self):
         return self.max_part_size - (self._file_pointer % self.max_part_size)
 
     def _write(self, data, flushing=False):
-        if data and len(data) > self._space_left:
-            self.current_part.write(data[:self._space_left])
-            unwritten_data = data[self._space_left:]
-            self._file_pointer += len(data) - len(unwritten_data)
-            return unwritten_data if not flushing else self._write(unwritten_data, flushing)
-        else:
-            self.current_part.write(data)
-            self._file_pointer += len(data)
+        """
+        Write all data to the parts. The data is split at the part borders with memoryview
+        slices, so it is handed to the parts without being copied.
+        """
+        view = memoryview(data)
+        if len(view) > 0:
+            self._modified = True
+        while len(view) > 0:
+            space_left = self._space_left
+            part = self.current_part
+            part.write(view[:space_left])
+            if self._hashes is not None:
+                self._part_hash(self._file_pointer // self.max_part_size).update(
+                    view[:space_left])
+            written = min(space_left, len(view))
+            self._file_pointer += written
+            view = view[written:]
+        self._size = max(self._size, self._file_pointer)
+
+    def _part_hash(self, idx):
+        while len(self._hashes) <= idx:
+            self._hashes.append(sha1())
+        return self._hashes[idx]
+
+    def _part_checksums(self):
+        """
+        Return the checksums of all parts or None if the file has not been written
+        sequentially from the start.
+        """
+        if self._hashes is None:
+            return None
+        return [self._part_hash(idx).hexdigest() for idx in range(len(self.parts))]
 
     def _seek(self, offset, whence):
+        if offset + [0, self._file_pointer, self._size][whence] != self._file_pointer:
+            # Parts can be overwritten in the middle, the running checksums are lost
+            self._hashes = None
+        if self._uploader is not None:
+            return self._seek_striped(offset, whence)
+
+        previous = self._file_pointer
         if whence == 0:
             self._file_pointer = offset
         if whence == 1:
             self._file_pointer += offset
         if whence == 2:
-            raise NotImplementedError("Seeking from end is not implemented")
+            self._file_pointer = self._size + offset
 
-        for part in self.parts:
-            if part == self.current_part:
-                part.seek(offset % self.max_part_size, 0)
-            else:
-                part.seek(0, 0)
+        if self._prefetcher is not None:
+            if self._file_pointer != previous:
+                self._stop_read_ahead()
+            return
+
+        self._part_positioned = False
+        idx = self._file_pointer // self.max_part_size
+        if idx < len(self.parts) and self.parts[idx] is not None:
+            self._part(idx)
+
+    def _seek_striped(self, offset, whence):
+        """
+        A striped file can only seek inside the part that has not been uploaded yet
+        """
+        pointer = offset + [0, self._file_pointer, self._size][whence]
+        part_start = (len(self.parts) - 1) * self.max_part_size
+        if pointer < part_start:
+            raise NotSeekableError("Striped files cannot seek into uploaded parts")
+
+        self._file_pointer = pointer
+        if pointer < part_start + self.max_part_size:
+            self.parts[-1].seek(pointer - part_start, 0)
 
     def _tell(self):
         return self._file_pointer
 
-    def _read(self, sizehint=-1):
-        part = self.current_part
-        read_data = part.read()
+    @property
+    def size(self):
+        """
+        The size of the file. It is known when the file is opened and kept up to date by
+        writes, so seeking from the end does not have to read the file.
+        """
+        return self._size
 
-        if len(read_data) > 0:
-            self._file_pointer += len(read_data)
-        else:
+    def _stop_read_ahead(self):
+        """
+        Stop reading ahead after a seek until the file is read sequentially again. Only the
+        part the file pointer has been moved to is kept, the fetches of the other parts are
+        cancelled if they haven't started yet.
+        """
+        self._read_ahead = False
+        self._read_part_idx = None
+        idx = self._file_pointer // self.max_part_size
+        for i in list(self._prefetched):
+            if i != idx:
+                self._prefetched.pop(i).cancel()
+
+    def _prefetched_part(self, idx):
+        """
+        Return the contents of the part idx. If the file pointer has moved on from the
+        previous part, the following parts are fetched as well. Parts outside of the read
+        ahead window are released.
+        """
+        if self._read_part_idx is not None and idx == self._read_part_idx + 1:
+            self._read_ahead = True
+        self._read_part_idx = idx
+
+        parts_ahead = self._prefetcher.parts_ahead if self._read_ahead else 0
+        window = range(idx, min(idx + parts_ahead + 1, len(self.parts)))
+        for i in list(self._prefetched):
+            if i not in window:
+                self._prefetched.pop(i).cancel()
+        for i in window:
+            if i not in self._prefetched:
+                path = self._path + ".part{0}".format(i)
+                self._prefetched[i] = self._prefetcher.fetch(self._fs, path)
+        return self._prefetched[idx].get()
+
+    def _read_size(self, sizehint):
+        """
+        Return how many bytes to read at once: the sizehint but at most the read buffer size
+        and the rest of the current part.
+        """
+        size = min(self._read_buffer_size, self._space_left)
+        return min(size, sizehint) if sizehint > 0 else size
+
+    def _read_prefetched(self, sizehint=-1):
+        idx = self._file_pointer // self.max_part_size
+        if idx >= len(self.parts):
             return None
 
-        if sizehint > 0:
-            return read_data
+        offset = self._file_pointer - idx * self.max_part_size
+        data = self._prefetched_part(idx)
+        read_data = data[offset:offset + self._read_size(sizehint)]
+        if len(read_data) == 0:
+            return None
+
+        self._file_pointer += len(read_data)
+        return read_data
+
+    def readinto(self, buffer):
+        """
+        Read up to len(buffer) bytes into the writable buffer (e.g. a bytearray).
+        Parts that support readinto fill the buffer directly, so a reused buffer allows
+        reading without allocating new strings.
+        :returns Number of bytes read, 0 at the end of the file
+        """
+        if self.closed:
+            raise IOError("File has been closed")
+        self._assert_mode("r-")
+
+        view = memoryview(buffer)
+        if self._wbuffer or self._sbuffer or self._soffset:
+            # Let the FileLikeBase settle pending writes and simulated seeks
+            data = self.read(len(view))
+            view[:len(data)] = data
+            return len(data)
+
+        count = 0
+        if self._rbuffer:
+            count = min(len(view), len(self._rbuffer))
+            view[:count] = self._rbuffer[:count]
+            self._rbuffer = self._rbuffer[count:]
+        while count < len(view):
+            read_count = self._readinto(view[count:])
+            if not read_count:
+                break
+            count += read_count
+        return count
+
+    def _readinto(self, view):
+        """
+        Read from the current part into the memoryview. Never crosses the border of a part.
+        """
+        idx = self._file_pointer // self.max_part_size
+        if idx >= len(self.parts):
+            return 0
+
+        view = view[:self._space_left]
+        if self._prefetcher is not None:
+            data = self._prefetched_part(idx)
+            offset = self._file_pointer - idx * self.max_part_size
+            read_count = max(min(len(view), len(data) - offset), 0)
+            view[:read_count] = memoryview(data)[offset:offset + read_count]
         else:
-            if self.parts[-1] == part:
-                return read_data
-            else:
-                remaining_data = self._read()
-                return read_data + remaining_data if remaining_data else read_data
+            read_count = self.current_part.readinto(view)
+        self._file_pointer += read_count
+        return read_count
+
+    def _read(self, sizehint=-1):
+        if self._prefetcher is not None:
+            return self._read_prefetched(sizehint)
+        if self._file_pointer >= len(self.parts) * self.max_part_size:
+            return None
+
+        read_data = self.current_part.read(self._read_size(sizehint))
+        if len(read_data) == 0:
+            return None
+
+        self._file_pointer += len(read_data)
+        return read_data
 
     def close(self):
         """
-        Flushes current file and closes all parts
+        Flushes current file, closes all parts and writes the manifest if the file has
+        been written.
         """
+        if self.closed:
+            return
+
         super(PartedFile, self).close()
+        if self._uploader is not None:
+            self._upload_part(len(self.parts) - 1)
         for part in self.parts:
-            part.close()
+            if part is not None:
+                part.close()
+        for upload in self._uploads:
+            upload.get()
+        for fetch in self._prefetched.values():
+            fetch.cancel()
+        self._prefetched.clear()
+
+        # The fs might already be closed if the file is closed by the garbage collector
+        if self._manifest is not None and self._modified and not self._fs.closed:
+            self._manifest.update(self._size, len(self.parts), self.max_part_size,
+                                  self._part_checksums())
+            self._manifest.save(self._fs, self._path)
 
 
 class FilePart(FileWrapper):
@@ -425,3 +1216,14 @@ class FilePart(FileWrapper):
     """
     def __init__(self, wrapped_file):
         super(FilePart, self).__init__(wrapped_file)
+
+    def readinto(self, buffer):
+        """
+        Read into the buffer with readinto of the wrapped file if it has one.
+        """
+        readinto = getattr(self.wrapped_file, "readinto", None)
+        if readinto is None or self._rbuffer or self._wbuffer or self._sbuffer or self._soffset:
+            data = self.read(len(buffer))
+            buffer[:len(data)] = data
+            return len(data)
+        return readinto(buffer) or 0
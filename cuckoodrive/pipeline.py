@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import sys
+import threading
+
+from six import reraise
+from six.moves import range
+from six.moves.queue import Queue
+
+
+_DONE = object()
+
+
+class Pipeline(object):
+    """
+    Streams items through stages that run on their own worker threads. The stages are
+    connected by bounded queues, so a slow stage holds the stages in front of it back
+    instead of piling up all items in memory, and every stage works at the same time.
+
+    A stage is a function that takes an item and returns the item for the next stage or
+    None if the item is done. The items of the source are read by a separate thread::
+
+        pipeline = Pipeline(walk_files(), [(compare, 4), (upload, 8)], queue_size=16)
+        pipeline.run()
+
+    If a stage raises an error, no new items are started and the first error is raised by
+    run once all workers have stopped.
+    """
+
+    def __init__(self, source, stages, queue_size=16):
+        """
+        :param source: Iterable with the items for the first stage
+        :param stages: List of (function, workers) tuples
+        :param queue_size: Max number of items waiting in front of a stage
+        """
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self._errors = []
+        self._stopped = threading.Event()
+
+    def _fail(self):
+        self._errors.append(sys.exc_info())
+        self._stopped.set()
+
+    def _feed(self, queue, workers):
+        try:
+            for item in self.source:
+                if self._stopped.is_set():
+                    break
+                queue.put(item)
+        except Exception:
+            self._fail()
+        finally:
+            for _ in range(workers):
+                queue.put(_DONE)
+
+    def _work(self, function, queue, next_queue, finished):
+        try:
+            while True:
+                item = queue.get()
+                if item is _DONE:
+                    break
+                if self._stopped.is_set():
+                    # Keep draining the queue so the stage in front never blocks
+                    continue
+                try:
+                    result = function(item)
+                    if result is not None and next_queue is not None:
+                        next_queue.put(result)
+                except Exception:
+                    self._fail()
+        finally:
+            finished()
+
+    def run(self):
+        """Run all items through the stages and block until they are done"""
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(queues[0], self.stages[0][1]))]
+
+        for idx, (function, workers) in enumerate(self.stages):
+            next_queue = queues[idx + 1] if idx + 1 < len(queues) else None
+            next_workers = self.stages[idx + 1][1] if next_queue is not None else 0
+            finished = self._finisher(workers, next_queue, next_workers)
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(function, queues[idx], next_queue, finished)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            reraise(*self._errors[0])
+
+    @staticmethod
+    def _finisher(workers, next_queue, next_workers):
+        """Return a callback that stops the next stage once all workers of a stage are done"""
+        lock = threading.Lock()
+        remaining = [workers]
+
+        def finished():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0 or next_queue is None:
+                    return
+            for _ in range(next_workers):
+                next_queue.put(_DONE)
+
+        return finished
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import Counter
+import random
+import threading
+import time
+
+from six.moves.urllib.parse import parse_qsl
+
+from fs.base import NoDefaultMeta
+from fs.errors import NoMetaError, RemoteConnectionError, StorageSpaceError
+from fs.filelike import FileWrapper
+from fs.memoryfs import MemoryFS
+from fs.opener import Opener
+from fs.wrapfs import WrapFS
+
+from cuckoodrive.governor import TokenBucket
+
+
+def constant(seconds):
+    """Latency distribution that always takes the given seconds"""
+    return lambda rand: seconds
+
+
+def uniform(low, high):
+    """Latency distribution that takes between low and high seconds"""
+    return lambda rand: rand.uniform(low, high)
+
+
+def lognormal(median, sigma):
+    """
+    Latency distribution with a long tail like the one of most cloud providers: most
+    operations take about median seconds, but a few take many times as long.
+    """
+    return lambda rand: median * rand.lognormvariate(0, sigma)
+
+
+class SimulatedFS(WrapFS):
+    """
+    Behaves like the filesystem of a cloud provider, but keeps the files in memory (or in any
+    other wrapped filesystem). It is meant for tests and benchmarks that have to reproduce
+    the behaviour of real remotes offline::
+
+        remote = SimulatedFS(latency=lognormal(0.08, 0.5), upload_rate=mb(1), quota=mb(100))
+        fs = CuckooDriveFS(remote_filesystems=[remote, SimulatedFS(quota=mb(50))])
+
+    Every call of a method waits for a latency drawn from its distribution, latencies can
+    be given per method and default to latency. Reads and writes of open files only wait for
+    the bandwidth. The free space meta is the quota minus the size of all files, writes
+    beyond the quota raise a StorageSpaceError.
+
+    Operations fail with a RemoteConnectionError at the given failure_rate, or on purpose::
+
+        remote.fail_next("open", count=2)
+
+    The calls of every method are counted in counts, the transferred bytes in uploaded and
+    downloaded. Pass a seed to draw the same latencies and failures in every run.
+
+    Simulated remotes can also be created with the sim:// URI once the SimulatedOpener has
+    been registered (see SimulatedOpener).
+    """
+
+    def __init__(self, fs=None, latency=None, latencies=None, upload_rate=None,
+                 download_rate=None, quota=None, failure_rate=0, seed=None):
+        """
+        :param fs: The filesystem that stores the files, by default a new MemoryFS
+        :param latency: Default latency distribution of all methods, None for no latency
+        :param latencies: Dict with the latency distributions of single methods
+        :param upload_rate: Max bytes per second written to the files, None for no limit
+        :param download_rate: Max bytes per second read from the files, None for no limit
+        :param quota: Max bytes stored in the files, None for the free space of fs
+        :param failure_rate: Probability that an operation fails
+        :param seed: Seed of the random latencies and failures
+        """
+        super(SimulatedFS, self).__init__(fs if fs is not None else MemoryFS())
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        # The buckets can't burst, so every transfer takes as long as on a saturated link
+        self.upload_limit = TokenBucket(upload_rate, capacity=1) if upload_rate else None
+        self.download_limit = TokenBucket(download_rate, capacity=1) if download_rate else None
+        self.quota = quota
+        self.failure_rate = failure_rate
+        self.counts = Counter()
+        self.uploaded = 0
+        self.downloaded = 0
+        self.used = sum(self.wrapped_fs.getsize(path) for path in self.wrapped_fs.walkfiles())
+        self._failures = Counter()
+        self._random = random.Random(seed)
+        self._stats_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = super(SimulatedFS, self).__getstate__()
+        del state["_stats_lock"]
+        return state
+
+    def __setstate__(self, state):
+        super(SimulatedFS, self).__setstate__(state)
+        self._stats_lock = threading.Lock()
+
+    def fail_next(self, method, count=1):
+        """Let the next count calls of method fail with a RemoteConnectionError"""
+        with self._stats_lock:
+            self._failures[method] += count
+
+    def simulate(self, method):
+        """Count a call of method, fail it if it should and wait for its latency"""
+        with self._stats_lock:
+            self.counts[method] += 1
+            fail = self._failures[method] > 0 or self._random.random() < self.failure_rate
+            if self._failures[method] > 0:
+                self._failures[method] -= 1
+            distribution = self.latencies.get(method, self.latency)
+            latency = distribution(self._random) if distribution is not None else 0
+
+        if latency > 0:
+            time.sleep(latency)
+        if fail:
+            raise RemoteConnectionError(opname=method, msg="Simulated failure of %(opname)s")
+
+    def upload(self, size):
+        """Reserve size bytes of the quota and wait for the bandwidth"""
+        with self._stats_lock:
+            if self.quota is not None and self.used + size > self.quota:
+                raise StorageSpaceError("write")
+            self.used += size
+            self.uploaded += size
+        if self.upload_limit is not None:
+            self.upload_limit.consume(size)
+
+    def download(self, size):
+        """Count size read bytes and wait for the bandwidth"""
+        with self._stats_lock:
+            self.downloaded += size
+        if self.download_limit is not None:
+            self.download_limit.consume(size)
+
+    def release(self, size):
+        """Give size bytes of the quota back"""
+        with self._stats_lock:
+            self.used -= size
+
+    def _size(self, path):
+        """Size of a file or of all files in a directory, 0 if the path doesn't exist"""
+        if self.wrapped_fs.isfile(path):
+            return self.wrapped_fs.getsize(path)
+        if self.wrapped_fs.isdir(path):
+            return sum(self.wrapped_fs.getsize(p) for p in self.wrapped_fs.walkfiles(path))
+        return 0
+
+    def _accounted(self, paths, method, *args, **kwargs):
+        """Call method and account the change of the size of the paths in the quota"""
+        before = sum(self._size(path) for path in paths)
+        result = method(*args, **kwargs)
+        self.release(before - sum(self._size(path) for path in paths))
+        return result
+
+    def open(self, path, mode="r", **kwargs):
+        self.simulate("open")
+        size = self._size(path)
+        return SimulatedFile(self.wrapped_fs.open(path, mode, **kwargs), self, path, mode, size)
+
+    def setcontents(self, path, data=b"", encoding=None, errors=None, chunk_size=64 * 1024):
+        # Write through open, so the bytes are counted against the quota and bandwidth
+        return super(WrapFS, self).setcontents(path, data, encoding=encoding, errors=errors,
+                                               chunk_size=chunk_size)
+
+    def createfile(self, path, wipe=False):
+        self.simulate("createfile")
+        return self._accounted([path], self.wrapped_fs.createfile, path, wipe=wipe)
+
+    def exists(self, path):
+        self.simulate("exists")
+        return self.wrapped_fs.exists(path)
+
+    def isdir(self, path):
+        self.simulate("isdir")
+        return self.wrapped_fs.isdir(path)
+
+    def isfile(self, path):
+        self.simulate("isfile")
+        return self.wrapped_fs.isfile(path)
+
+    def listdir(self, *args, **kwargs):
+        self.simulate("listdir")
+        return self.wrapped_fs.listdir(*args, **kwargs)
+
+    def listdirinfo(self, *args, **kwargs):
+        self.simulate("listdirinfo")
+        return self.wrapped_fs.listdirinfo(*args, **kwargs)
+
+    def getinfo(self, path):
+        self.simulate("getinfo")
+        return self.wrapped_fs.getinfo(path)
+
+    def getsize(self, path):
+        self.simulate("getsize")
+        return self.wrapped_fs.getsize(path)
+
+    def makedir(self, path, *args, **kwargs):
+        self.simulate("makedir")
+        return self.wrapped_fs.makedir(path, *args, **kwargs)
+
+    def remove(self, path):
+        self.simulate("remove")
+        return self._accounted([path], self.wrapped_fs.remove, path)
+
+    def removedir(self, path, *args, **kwargs):
+        self.simulate("removedir")
+        return self._accounted([path], self.wrapped_fs.removedir, path, *args, **kwargs)
+
+    def rename(self, src, dst):
+        self.simulate("rename")
+        return self._accounted([src, dst], self.wrapped_fs.rename, src, dst)
+
+    def move(self, src, dst, *args, **kwargs):
+        self.simulate("move")
+        return self._accounted([src, dst], self.wrapped_fs.move, src, dst, *args, **kwargs)
+
+    def movedir(self, src, dst, *args, **kwargs):
+        self.simulate("movedir")
+        return self._accounted([src, dst], self.wrapped_fs.movedir, src, dst, *args, **kwargs)
+
+    def copy(self, src, dst, *args, **kwargs):
+        # Copies are done by the provider, they only use up quota but no bandwidth
+        self.simulate("copy")
+        return self._accounted([dst], self.wrapped_fs.copy, src, dst, *args, **kwargs)
+
+    def copydir(self, src, dst, *args, **kwargs):
+        self.simulate("copydir")
+        return self._accounted([dst], self.wrapped_fs.copydir, src, dst, *args, **kwargs)
+
+    def settimes(self, path, *args, **kwargs):
+        self.simulate("settimes")
+        return self.wrapped_fs.settimes(path, *args, **kwargs)
+
+    def getmeta(self, meta_name, default=NoDefaultMeta):
+        if meta_name == "free_space" and self.quota is not None:
+            return self.quota - self.used
+        return self.wrapped_fs.getmeta(meta_name, default)
+
+    def hasmeta(self, meta_name):
+        try:
+            self.getmeta(meta_name)
+        except NoMetaError:
+            return False
+        return True
+
+
+class SimulatedFile(FileWrapper):
+    """
+    A file of a SimulatedFS. Reads and writes wait for the bandwidth of the filesystem and
+    bytes that make the file bigger are taken from its quota. When the file is closed, the
+    quota is corrected by the size the file really has.
+    """
+
+    def __init__(self, wrapped_file, fs, path, mode, size):
+        super(SimulatedFile, self).__init__(wrapped_file, mode)
+        self.fs = fs
+        self.path = path
+        self.size = size
+        self.append = "a" in mode
+        self._accounted = False
+
+    def _read(self, sizehint=-1):
+        data = super(SimulatedFile, self)._read(sizehint)
+        if data:
+            self.fs.download(len(data))
+        return data
+
+    def _write(self, string, flushing=False):
+        if string:
+            end = self.size + len(string) if self.append else self._tell() + len(string)
+            self.fs.upload(max(0, end - self.size))
+            self.size = max(self.size, end)
+        return super(SimulatedFile, self)._write(string, flushing)
+
+    def close(self):
+        super(SimulatedFile, self).close()
+        if not self._accounted:
+            self._accounted = True
+            self.fs.release(self.size - self.fs._size(self.path))
+
+
+class SimulatedOpener(Opener):
+    """
+    Opens SimulatedFS instances. Remotes with the same name are the same instance within a
+    process, so their files survive a new CuckooDriveFS like the files of a real remote.
+    The behaviour is configured with query parameters (seconds and bytes)::
+
+        opener.add(SimulatedOpener)
+        fs = CuckooDriveFS.from_uris(["sim://remote1?latency=0.05&quota=104857600",
+                                      "sim://remote2?latency=0.1&jitter=0.05&failure_rate=0.01"])
+
+    Supported parameters are latency (median), jitter (uniform latencies between latency -
+    jitter and latency + jitter), sigma (lognormal latencies), upload_rate, download_rate,
+    quota, failure_rate and seed.
+    """
+    names = ["sim"]
+    desc = """Creates a simulated cloud filesystem in memory.
+
+examples:
+* sim://remote1 (a simulated remote without latency and limits)
+* sim://remote1?latency=0.05&upload_rate=1048576&quota=104857600"""
+
+    instances = {}
+    _instances_lock = threading.Lock()
+
+    @staticmethod
+    def create_fs(params):
+        """Create a SimulatedFS out of the query parameters"""
+        latency = float(params.get("latency", 0))
+        if "jitter" in params:
+            jitter = float(params["jitter"])
+            distribution = uniform(max(0, latency - jitter), latency + jitter)
+        elif "sigma" in params:
+            distribution = lognormal(latency, float(params["sigma"]))
+        else:
+            distribution = constant(latency) if latency else None
+
+        def optional_int(name):
+            return int(params[name]) if name in params else None
+
+        return SimulatedFS(latency=distribution,
+                           upload_rate=optional_int("upload_rate"),
+                           download_rate=optional_int("download_rate"),
+                           quota=optional_int("quota"),
+                           failure_rate=float(params.get("failure_rate", 0)),
+                           seed=optional_int("seed"))
+
+    @classmethod
+    def get_fs(cls, registry, fs_name, fs_name_params, fs_path, writeable, create_dir):
+        name, _, query = fs_path.partition("?")
+        with cls._instances_lock:
+            if name not in cls.instances:
+                cls.instances[name] = cls.create_fs(dict(parse_qsl(query)))
+            return cls.instances[name], None
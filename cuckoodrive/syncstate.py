@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from hashlib import sha1
+import sqlite3
+import threading
+
+from fs.path import abspath, normpath
+
+from cuckoodrive.utils import datetime_to_epoch
+
+
+def sync_state_file(path, remote_uris):
+    """
+    Return the name of the sync state database for a local path synced with the given remotes.
+    Every combination gets its own database, so the state of one sync never leaks into another.
+    """
+    key = "\n".join([path] + sorted(remote_uris)).encode("utf-8")
+    return "sync_state_{0}.db".format(sha1(key).hexdigest()[:16])
+
+
+class SyncState(object):
+    """
+    Remembers the size, modification time and part layout of every path that has been
+    synchronized in a sqlite database. A later sync only has to compare a path with the
+    remotes if its local size or modification time has changed since.
+
+    The database is usually kept in the settings directory of CuckooDrive::
+        state = SyncState(settings_fs.getsyspath("sync_state.db"))
+
+    Directories are recorded without size and modification time.
+    """
+
+    def __init__(self, database=":memory:"):
+        """
+        :param database: Path of the sqlite database, by default it is kept in memory
+        """
+        self._lock = threading.RLock()
+        # The watcher calls back from its own thread
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "path TEXT PRIMARY KEY, size INTEGER, modified_time REAL, part_size INTEGER)")
+
+    @staticmethod
+    def _key(path):
+        return abspath(normpath(path))
+
+    def get(self, path):
+        """
+        Return the recorded state of a path.
+        :returns dict with size, modified_time and part_size or None if it is unknown
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, modified_time, part_size FROM entries WHERE path = ?",
+                (self._key(path),)).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "modified_time": row[1], "part_size": row[2]}
+
+    def record(self, path, info=None, part_size=None):
+        """
+        Record that a path has been synchronized.
+        :param info: Local info of a file (size and modified_time), None for a directory
+        :param part_size: Max part size the file has been split with
+        """
+        size, modified_time = None, None
+        if info is not None:
+            size, modified_time = info["size"], datetime_to_epoch(info["modified_time"])
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (self._key(path), size, modified_time, part_size))
+
+    def unchanged(self, path, info, part_size=None):
+        """
+        Check wether a file has not changed locally since it has been recorded.
+        :param info: Current local info of the file
+        """
+        state = self.get(path)
+        return state is not None and \
+            state["size"] == info["size"] and \
+            state["modified_time"] == datetime_to_epoch(info["modified_time"]) and \
+            state["part_size"] == part_size
+
+    def remove(self, path):
+        """Forget a path and everything below it"""
+        key = self._key(path)
+        prefix = key.rstrip("/") + "/"
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM entries WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (key, len(prefix), prefix))
+
+    def paths(self):
+        """Return all recorded paths"""
+        with self._lock:
+            rows = self._connection.execute("SELECT path FROM entries ORDER BY path").fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
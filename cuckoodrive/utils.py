@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
+from datetime import datetime
+import time
 
 
 def kb(value):
@@ -16,3 +18,19 @@ def mb(value):
     Helper method to return value in MB as values in Bytes
     """
     return kb(value) * 1024
+
+
+def datetime_to_epoch(value):
+    """
+    Helper method to convert a naive local datetime into seconds since the epoch
+    :param value: datetime to convert
+    :return: seconds since the epoch as float
+    """
+    return time.mktime(value.timetuple()) + value.microsecond / 1000000
+
+
+def epoch_to_datetime(value):
+    """
+    Helper method to convert seconds since the epoch back into a naive local datetime
+    """
+    return datetime.fromtimestamp(value)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+import time
+
+from mock import Mock
+from pytest import fixture, raises
+
+from fs.errors import ResourceNotFoundError
+from fs.memoryfs import MemoryFS
+
+from cuckoodrive.asyncfs import AsyncFS, Future, wait_all
+
+
+class TestFuture(object):
+    def test_result_returns_result(self):
+        # Arrange
+        future = Future()
+        # Act
+        future.set_result(42)
+        # Assert
+        assert future.done()
+        assert future.result() == 42
+
+    def test_result_raises_error(self):
+        # Arrange
+        future = Future()
+        try:
+            raise ValueError("failed")
+        except ValueError:
+            future.set_exception(sys.exc_info())
+        # Act & Assert
+        with raises(ValueError):
+            future.result()
+        assert isinstance(future.exception(), ValueError)
+
+    def test_result_raises_timeout_error(self):
+        # Act & Assert
+        with raises(TimeoutError):
+            Future().result(timeout=0.01)
+
+    def test_add_done_callback_calls_back_when_done(self):
+        # Arrange
+        future, callback = Future(), Mock()
+        future.add_done_callback(callback)
+        # Act
+        future.set_result(None)
+        # Assert
+        callback.assert_called_once_with(future)
+
+    def test_add_done_callback_calls_back_right_away_if_done(self):
+        # Arrange
+        future, callback = Future(), Mock()
+        future.set_result(None)
+        # Act
+        future.add_done_callback(callback)
+        # Assert
+        callback.assert_called_once_with(future)
+
+
+class TestAsyncFS(object):
+    @fixture
+    def fs(self, request):
+        fs = AsyncFS(MemoryFS(), concurrency=4)
+        request.addfinalizer(fs.close)
+        return fs
+
+    def test_setcontents_and_getcontents(self, fs):
+        # Act
+        fs.setcontents("backup.tar", b"backup").result()
+        # Assert
+        assert fs.getcontents("backup.tar").result() == b"backup"
+
+    def test_getinfo_raises_error_of_filesystem(self, fs):
+        # Act & Assert
+        with raises(ResourceNotFoundError):
+            fs.getinfo("backup.tar").result()
+
+    def test_listdir_returns_entries(self, fs):
+        # Arrange
+        wait_all([fs.setcontents("file{0}.txt".format(idx), b"") for idx in range(10)])
+        # Act & Assert
+        assert len(fs.listdir("/").result()) == 10
+
+    def test_operations_run_at_the_same_time(self, fs):
+        # Arrange
+        running = []
+        all_running = threading.Event()
+
+        def wait_for_others():
+            running.append(True)
+            if len(running) == 4:
+                all_running.set()
+            return all_running.wait(5)
+
+        # Act
+        futures = [fs.submit(wait_for_others) for _ in range(4)]
+        # Assert
+        assert all(wait_all(futures))
+
+    def test_submit_blocks_while_concurrency_operations_are_in_flight(self, fs):
+        # Arrange
+        release = threading.Event()
+        futures = [fs.submit(release.wait, 5) for _ in range(4)]
+        submitted = threading.Event()
+
+        def submit():
+            fs.submit(lambda: None)
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        # Act
+        thread.start()
+        # Assert
+        assert not submitted.wait(0.1)
+        release.set()
+        assert submitted.wait(5)
+        wait_all(futures)
+        thread.join()
+
+    def test_filesystems_sharing_pool_keep_own_limit(self):
+        # Arrange
+        pool = ThreadPool(8)
+        slow, fast = AsyncFS(MemoryFS(), 1, pool=pool), AsyncFS(MemoryFS(), 4, pool=pool)
+        release = threading.Event()
+        blocked = slow.submit(release.wait, 5)
+        # Act
+        results = wait_all([fast.submit(lambda: True) for _ in range(8)], timeout=5)
+        # Assert
+        assert all(results)
+        release.set()
+        blocked.result()
+        pool.close()
+
+    def test_open_returns_file_with_ordered_operations(self, fs):
+        # Arrange
+        fh = fs.open("backup.tar", "wb").result()
+        # Act
+        writes = [fh.write("{0},".format(idx).encode("ascii")) for idx in range(100)]
+        fh.close().result()
+        # Assert
+        assert all(write.done() for write in writes)
+        expected = "".join("{0},".format(idx) for idx in range(100)).encode("ascii")
+        assert fs.getcontents("backup.tar").result() == expected
+
+    def test_file_read_and_seek(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", b"0123456789").result()
+        fh = fs.open("backup.tar", "rb").result()
+        # Act
+        fh.seek(5)
+        data = fh.read(3)
+        position = fh.tell()
+        fh.close()
+        # Assert
+        assert data.result() == b"567"
+        assert position.result() == 8
+
+    def test_many_small_operations_overlap_their_latency(self):
+        # Arrange
+        fs = AsyncFS(MemoryFS(), concurrency=50)
+        start = time.time()
+        # Act
+        wait_all([fs.submit(time.sleep, 0.05) for _ in range(100)])
+        # Assert
+        assert time.time() - start < 1
+        fs.close()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from io import BytesIO
+from os import urandom
+
+from pytest import fixture, raises
+from mock import Mock
+import unittest
+
+from fs.errors import ResourceNotFoundError
+from fs.memoryfs import MemoryFS
+from fs.tests import FSTestCases
+
+from cuckoodrive.chunkedfs import ChunkedFS, Chunker
+from cuckoodrive.utils import kb
+
+
+class TestExternalChunkedFS(unittest.TestCase, FSTestCases):
+    def setUp(self):
+        self.fs = ChunkedFS(MemoryFS(), kb(4))
+
+    def tearDown(self):
+        self.fs.close()
+
+
+class TestChunker(object):
+    @fixture
+    def chunker(self):
+        return Chunker(kb(4))
+
+    def test_split_yields_chunks_between_min_and_max_size(self, chunker):
+        # Arrange
+        data = urandom(kb(256))
+        # Act
+        chunks = list(chunker.split(BytesIO(data)))
+        # Assert
+        assert b"".join(chunks) == data
+        assert all(chunker.min_size <= len(c) <= chunker.max_size for c in chunks[:-1])
+
+    def test_split_yields_max_size_chunks_for_uniform_data(self, chunker):
+        # Act
+        chunks = list(chunker.split(BytesIO(b"\x00" * kb(64))))
+        # Assert
+        assert [len(c) for c in chunks] == [chunker.max_size] * (kb(64) // chunker.max_size)
+
+    def test_split_keeps_chunks_after_insert(self, chunker):
+        # Arrange
+        data = urandom(kb(256))
+        chunks = list(chunker.split(BytesIO(data)))
+        # Act
+        changed = list(chunker.split(BytesIO(data[:kb(1)] + b"inserted" + data[kb(1):])))
+        # Assert
+        assert changed[-len(chunks) + 2:] == chunks[2:]
+
+    def test_split_yields_nothing_for_empty_stream(self, chunker):
+        # Act & Assert
+        assert list(chunker.split(BytesIO())) == []
+
+
+class TestChunkedFS(object):
+    @fixture
+    def fs(self, request):
+        fs = ChunkedFS(MemoryFS(), kb(4))
+        request.addfinalizer(fs.close)
+        return fs
+
+    def chunk_ids(self, fs):
+        return set(fs.wrapped_fs.listdir(fs.chunk_dir, files_only=True) +
+                   [name for d in fs.wrapped_fs.listdir(fs.chunk_dir, dirs_only=True)
+                    for name in fs.wrapped_fs.listdir("{0}/{1}".format(fs.chunk_dir, d))])
+
+    def test_setcontents_writes_manifest_and_chunks(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        # Act
+        fs.setcontents("backup.tar", data)
+        # Assert
+        manifest = fs.getmanifest("backup.tar")
+        assert fs.wrapped_fs.isfile("backup.tar.manifest")
+        assert manifest.size == kb(64)
+        assert set(manifest.part_checksums) == self.chunk_ids(fs)
+        assert fs.getcontents("backup.tar", "rb") == data
+
+    def test_listdir_hides_chunks_and_manifest_extension(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(16)))
+        # Act & Assert
+        assert fs.listdir("/") == ["backup.tar"]
+
+    def test_setcontents_stores_same_content_only_once(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        fs.wrapped_fs.setcontents = Mock(wraps=fs.wrapped_fs.setcontents)
+        # Act
+        fs.setcontents("backup-copy.tar", data)
+        # Assert
+        assert fs.wrapped_fs.setcontents.call_count == 1
+        assert fs.getcontents("backup-copy.tar", "rb") == data
+
+    def test_updatefile_uploads_only_chunks_around_edit(self, fs):
+        # Arrange
+        data = urandom(kb(256))
+        fs.setcontents("backup.tar", data)
+        chunk_count = len(fs.getmanifest("backup.tar").part_sizes)
+        changed = data[:kb(128)] + b"inserted" + data[kb(128):]
+        # Act
+        uploaded = fs.updatefile("backup.tar", BytesIO(changed))
+        # Assert
+        assert 0 < len(uploaded) <= 3 < chunk_count
+        assert fs.getcontents("backup.tar", "rb") == changed
+
+    def test_remove_removes_chunks_that_are_no_longer_referenced(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        fs.setcontents("backup-copy.tar", data)
+        fs.setcontents("other.tar", urandom(kb(16)))
+        # Act
+        fs.remove("backup.tar")
+        fs.sweep()
+        shared = self.chunk_ids(fs)
+        fs.remove("backup-copy.tar")
+        fs.sweep()
+        # Assert
+        assert not fs.exists("backup-copy.tar")
+        assert set(fs.getmanifest("other.tar").part_checksums) == self.chunk_ids(fs)
+        assert self.chunk_ids(fs) < shared
+
+    def test_overwrite_removes_chunks_of_old_content(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(64)))
+        # Act
+        fs.setcontents("backup.tar", urandom(kb(64)))
+        fs.sweep()
+        # Assert
+        assert set(fs.getmanifest("backup.tar").part_checksums) == self.chunk_ids(fs)
+
+    def test_sweep_counts_references_once_for_all_released_chunks(self, fs):
+        # Arrange
+        for idx in range(3):
+            fs.setcontents("backup{0}.tar".format(idx), urandom(kb(16)))
+        fs.wrapped_fs.walkfiles = Mock(wraps=fs.wrapped_fs.walkfiles)
+        # Act
+        for idx in range(3):
+            fs.remove("backup{0}.tar".format(idx))
+        removed = fs.sweep()
+        # Assert
+        assert fs.wrapped_fs.walkfiles.call_count == 1
+        assert len(removed) > 0
+        assert self.chunk_ids(fs) == set()
+
+    def test_close_sweeps_released_chunks(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(16)))
+        fs.remove("backup.tar")
+        fs.sweep = Mock(wraps=fs.sweep)
+        # Act
+        fs.close()
+        # Assert
+        fs.sweep.assert_called_once_with()
+
+    def test_references_are_counted_from_existing_manifests(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        fs.setcontents("backup-copy.tar", data)
+        reopened = ChunkedFS(fs.wrapped_fs, kb(4))
+        # Act
+        reopened.remove("backup.tar")
+        reopened.sweep()
+        # Assert
+        assert reopened.getcontents("backup-copy.tar", "rb") == data
+
+    def test_remove_keeps_chunks_referenced_by_other_drive(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        other_drive = ChunkedFS(fs.wrapped_fs, kb(4))
+        other_drive.setcontents("backup-copy.tar", data)
+        # Act
+        fs.remove("backup.tar")
+        fs.sweep()
+        # Assert
+        assert fs.getcontents("backup-copy.tar", "rb") == data
+
+    def test_copy_does_not_upload_chunks(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        fs.wrapped_fs.setcontents = Mock(wraps=fs.wrapped_fs.setcontents)
+        # Act
+        fs.copy("backup.tar", "backup-copy.tar")
+        fs.remove("backup.tar")
+        fs.sweep()
+        # Assert
+        assert fs.wrapped_fs.setcontents.call_count == 1
+        assert fs.getcontents("backup-copy.tar", "rb") == data
+
+    def test_open_reads_only_chunk_at_file_pointer(self, fs):
+        # Arrange
+        data = urandom(kb(64))
+        fs.setcontents("backup.tar", data)
+        last_chunk_size = fs.getmanifest("backup.tar").part_sizes[-1]
+        fs.readchunk = Mock(wraps=fs.readchunk)
+        # Act
+        with fs.open("backup.tar", "rb") as fh:
+            fh.seek(-last_chunk_size, 2)
+            read_data = fh.read()
+        # Assert
+        assert read_data == data[-last_chunk_size:]
+        assert fs.readchunk.call_count == 1
+
+    def test_open_raises_error_for_missing_file(self, fs):
+        # Act & Assert
+        with raises(ResourceNotFoundError):
+            fs.open("backup.tar", "rb")
@@ -3,19 +3,24 @@ from __future__ import print_function, division, absolute_import, unicode_litera
 
 from os import urandom
 from datetime import datetime, timedelta
+import threading
+import time
 
 import unittest
 
-from pytest import fixture, mark
+from pytest import fixture, mark, raises
 from mock import Mock
 
 from fs.tests import FSTestCases
 from fs.wrapfs.limitsizefs import LimitSizeFS
+from fs.errors import ResourceNotFoundError
 from fs.memoryfs import MemoryFS
 from fs.tempfs import TempFS
-from fs.watch import EVENT
+from fs.watch import EVENT, CREATED, MODIFIED, REMOVED, MOVED_SRC, MOVED_DST, OVERFLOW
 
 from cuckoodrive import CuckooDriveFS, SyncedCuckooDrive
+from cuckoodrive.chunkedfs import ChunkedFS
+from cuckoodrive.syncstate import SyncState
 from cuckoodrive.utils import mb, kb
 
 
@@ -30,6 +35,32 @@ class TestCuckooDriveFS(object):
 
     # Special integration tests
 
+    def test_append_writes_last_part_on_its_remote(self, fs, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(fs.partedfs, "max_part_size", kb(40))
+        data = urandom(kb(30))
+        fs.setcontents("backup.tar", data)
+        # Act
+        with fs.open("backup.tar", "ab") as fh:
+            fh.write(b"appended")
+        # Assert
+        assert sum(remote.exists("backup.tar.part0") for remote in fs.multifs.fs_sequence) == 1
+        assert fs.getcontents("backup.tar", "rb") == data + b"appended"
+        assert fs.getsize("backup.tar") == kb(30) + len(b"appended")
+
+    def test_content_chunking_stores_files_in_chunkedfs(self, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(CuckooDriveFS, "chunking", "content")
+        fs = CuckooDriveFS([LimitSizeFS(MemoryFS(), mb(300)), LimitSizeFS(MemoryFS(), mb(300))])
+        data = urandom(kb(64))
+        # Act
+        fs.setcontents("backup.tar", data)
+        # Assert
+        assert isinstance(fs.partedfs, ChunkedFS)
+        assert fs.partedfs.chunker.max_size == CuckooDriveFS.file_size
+        assert fs.getcontents("backup.tar", "rb") == data
+        fs.close()
+
 
 class TestSyncedCuckooDrive(object):
     @fixture
@@ -77,14 +108,191 @@ class TestSyncedCuckooDrive(object):
     def test_userfs_changed_invokes_synchronization(self, filesystems, monkeypatch):
         # Arrange
         userfs, remotefs = filesystems
+        synced = threading.Event()
         monkeypatch.setattr(SyncedCuckooDrive, 'sync_dirs', Mock())
         monkeypatch.setattr(SyncedCuckooDrive, 'sync_files', Mock())
-        drive = SyncedCuckooDrive(userfs, remotefs, watch=True)
+        monkeypatch.setattr(SyncedCuckooDrive, 'sync_path',
+                            Mock(side_effect=lambda path: synced.set()))
+        drive = SyncedCuckooDrive(userfs, remotefs, watch=True, quiet_period=0.05)
         # Act
         drive.userfs.setcontents("newfile.txt", "Sync me if you can!")
         # Arrange
-        assert drive.sync_dirs.called
-        assert drive.sync_files.called
+        assert synced.wait(5)
+        drive.close()
+        drive.sync_path.assert_called_with("/newfile.txt")
+        assert drive.sync_dirs.call_count == 1
+        assert drive.sync_files.call_count == 1
+
+    def test_userfs_changed_queues_events_if_watching(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        drive = SyncedCuckooDrive(userfs, remotefs, watch=True, quiet_period=60)
+        drive.sync_events = Mock()
+        drive.events.handler = drive.sync_events
+        event = CREATED(userfs, "backup.tar")
+        # Act
+        drive.userfs_changed(event)
+        # Assert
+        assert not drive.sync_events.called
+        drive.close()
+        drive.sync_events.assert_called_once_with([event])
+
+    def test_sync_events_continues_after_failed_event(self, drive):
+        # Arrange
+        drive.userfs.setcontents("backup.tar", b"backup")
+        drive.sync_path = Mock(side_effect=[ResourceNotFoundError("gone.tar"), None])
+        # Act
+        drive.sync_events([CREATED(drive.userfs, "gone.tar"), CREATED(drive.userfs, "backup.tar")])
+        # Assert
+        drive.sync_path.assert_called_with("/backup.tar")
+
+    def test_sync_events_sweeps_chunks_once_while_locked(self, drive):
+        # Arrange
+        drive.userfs.setcontents("backup.tar", b"backup")
+        drive.userfs.setcontents("other.tar", b"other")
+        locked = []
+        drive.remotefs.sweep = lambda: locked.append(drive.lock.is_locked)
+        # Act
+        drive.sync_events([CREATED(drive.userfs, "backup.tar"),
+                           CREATED(drive.userfs, "other.tar")])
+        # Assert
+        assert locked == [True]
+
+    def test_move_path_removes_source_if_destination_exists(self, drive):
+        # Arrange
+        drive.userfs.setcontents("backup.tar", b"new backup")
+        drive.remotefs.setcontents("backup.tar", b"old")
+        drive.remotefs.setcontents("backup-new.tar", b"new backup")
+        # Act
+        drive.move_path("/backup-new.tar", "/backup.tar")
+        # Assert
+        assert not drive.remotefs.exists("backup-new.tar")
+        assert drive.remotefs.getcontents("backup.tar", "rb") == b"new backup"
+
+    def test_userfs_changed_created_copies_only_path(self, drive):
+        # Arrange
+        drive.userfs.makedir("backups")
+        drive.userfs.setcontents("backups/newfile.txt", urandom(kb(1)))
+        drive.userfs.setcontents("otherfile.txt", urandom(kb(1)))
+        # Act
+        drive.userfs_changed(CREATED(drive.userfs, "backups/newfile.txt"))
+        # Assert
+        assert drive.remotefs.exists("backups/newfile.txt")
+        assert not drive.remotefs.exists("otherfile.txt")
+
+    def test_userfs_changed_modified_patches_path(self, drive):
+        # Arrange
+        drive.userfs.setcontents("backup.tar", urandom(kb(1)))
+        drive.remotefs.setcontents("backup.tar", urandom(kb(2)))
+        # Act
+        drive.userfs_changed(MODIFIED(drive.userfs, "backup.tar"))
+        # Assert
+        assert drive.remotefs.getcontents("backup.tar", "rb") == \
+            drive.userfs.getcontents("backup.tar", "rb")
+
+    def test_userfs_changed_removed_removes_path(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        userfs.makedir("backups")
+        userfs.setcontents("backups/backup.tar", urandom(kb(1)))
+        state = SyncState()
+        drive = SyncedCuckooDrive(userfs, remotefs, sync_state=state)
+        userfs.removedir("backups", force=True)
+        # Act
+        drive.userfs_changed(REMOVED(userfs, "backups"))
+        # Assert
+        assert not remotefs.exists("backups")
+        assert state.paths() == ["/"]
+
+    def test_userfs_changed_moved_renames_path(self, drive):
+        # Arrange
+        data = urandom(kb(1))
+        drive.userfs.setcontents("backup.tar", data)
+        drive.remotefs.setcontents("backup.tar", data)
+        drive.userfs.rename("backup.tar", "backup-old.tar")
+        drive.remotefs.setcontents = Mock()
+        # Act
+        drive.userfs_changed(MOVED_SRC(drive.userfs, "backup.tar", "backup-old.tar"))
+        drive.userfs_changed(MOVED_DST(drive.userfs, "backup-old.tar", "backup.tar"))
+        # Assert
+        assert not drive.remotefs.exists("backup.tar")
+        assert drive.remotefs.getcontents("backup-old.tar", "rb") == data
+        assert not drive.remotefs.setcontents.called
+
+    def test_userfs_changed_moved_without_source_copies_path(self, drive):
+        # Arrange
+        drive.userfs.setcontents("backup.tar", urandom(kb(1)))
+        # Act
+        drive.userfs_changed(MOVED_DST(drive.userfs, "backup.tar"))
+        # Assert
+        assert drive.remotefs.exists("backup.tar")
+
+    def test_userfs_changed_overflow_reconciles_whole_tree(self, drive, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(drive, 'reconcile', Mock())
+        # Act
+        drive.userfs_changed(OVERFLOW(drive.userfs, None))
+        # Assert
+        assert drive.reconcile.called
+
+    def test_keep_lock_alive_touches_held_lock_when_due(self, drive, monkeypatch):
+        # Arrange
+        drive.lock.heartbeat = Mock()
+        # Act
+        with drive.locked():
+            drive.keep_lock_alive()
+            monkeypatch.setattr(drive, "heartbeat_interval", 0)
+            drive.keep_lock_alive()
+        drive.keep_lock_alive()
+        # Assert
+        assert drive.lock.heartbeat.call_count == 1
+
+    def test_locked_renews_heartbeat_during_long_operation(self, drive, monkeypatch):
+        # Arrange
+        heartbeats = threading.Event()
+        drive.lock.heartbeat = Mock(side_effect=lambda: heartbeats.set())
+        monkeypatch.setattr(drive, "heartbeat_interval", 0.01)
+        # Act
+        with drive.locked():
+            renewed = heartbeats.wait(5)
+        drive.lock.heartbeat.reset_mock()
+        time.sleep(0.05)
+        # Assert
+        assert renewed
+        assert not drive.lock.heartbeat.called
+
+    def test_keep_lock_alive_touches_lock_once_from_several_threads(self, drive):
+        # Arrange
+        drive.lock.heartbeat = Mock(side_effect=lambda: time.sleep(0.05))
+        with drive.locked():
+            drive._last_heartbeat = 0
+            threads = [threading.Thread(target=drive.keep_lock_alive) for _ in range(4)]
+            # Act
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        # Assert
+        assert drive.lock.heartbeat.call_count == 1
+
+    def test_housekeeping_refreshes_free_space_of_remotes(self, drive):
+        # Arrange
+        drive.remotefs.multifs.refresh_free_space = Mock()
+        # Act
+        drive.housekeeping()
+        # Assert
+        assert drive.remotefs.multifs.refresh_free_space.called
+
+    def test_wait_sleeps_between_housekeeping(self, drive, monkeypatch):
+        # Arrange
+        sleep = Mock()
+        monkeypatch.setattr("cuckoodrive.time.sleep", sleep)
+        drive.housekeeping = Mock()
+        # Act
+        drive.wait(stopped=lambda: drive.housekeeping.call_count == 3)
+        # Assert
+        sleep.assert_called_with(drive.housekeeping_interval)
+        assert sleep.call_count == 3
 
     def test_sync_dirs_copies_only_not_existing_dirs(self, drive):
         # Arrange
@@ -112,6 +320,98 @@ class TestSyncedCuckooDrive(object):
         assert drive.remotefs.exists("newfile.txt")
         assert drive.remotefs.getsize("oldfile.txt") == kb(2)
 
+    def test_sync_files_with_jobs_copies_and_patches_files(self):
+        # Arrange
+        userfs = TempFS()
+        # LimitSizeFS can deadlock when files are written at the same time
+        remotefs = CuckooDriveFS(remote_filesystems=[TempFS(), TempFS()])
+        drive = SyncedCuckooDrive(userfs, remotefs, jobs=4)
+        for idx in range(20):
+            userfs.setcontents("file{0}.txt".format(idx), urandom(kb(1)))
+        remotefs.setcontents("file0.txt", urandom(kb(2)))
+        # Act
+        drive.sync_files()
+        # Assert
+        for idx in range(20):
+            path = "file{0}.txt".format(idx)
+            assert remotefs.getcontents(path, "rb") == userfs.getcontents(path, "rb")
+        remotefs.close()
+        userfs.close()
+
+    def test_sync_files_with_jobs_raises_transfer_errors(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        drive = SyncedCuckooDrive(userfs, remotefs, jobs=4)
+        userfs.setcontents("newfile.txt", urandom(kb(1)))
+        drive.transfer_file = Mock(side_effect=ResourceNotFoundError("newfile.txt"))
+        # Act & Assert
+        with raises(ResourceNotFoundError):
+            drive.sync_files()
+
+    def test_diff_file_records_files_that_are_up_to_date(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        state = SyncState()
+        drive = SyncedCuckooDrive(userfs, remotefs, sync_state=state)
+        userfs.setcontents("backup.tar", b"backup")
+        remotefs.setcontents("backup.tar", b"backup")
+        user_info = userfs.getinfo("backup.tar")
+        # Act
+        item = drive.diff_file(("backup.tar", user_info))
+        # Assert
+        assert item is None
+        assert state.unchanged("backup.tar", user_info, drive.part_size)
+
+    def test_diff_file_returns_action_for_changed_files(self, drive):
+        # Arrange
+        drive.userfs.setcontents("newfile.txt", b"new")
+        drive.userfs.setcontents("backup.tar", b"backup")
+        drive.remotefs.setcontents("backup.tar", b"old")
+        # Act
+        new_item = drive.diff_file(("newfile.txt", drive.userfs.getinfo("newfile.txt")))
+        changed_item = drive.diff_file(("backup.tar", drive.userfs.getinfo("backup.tar")))
+        # Assert
+        assert new_item[2] == "copy"
+        assert changed_item[2] == "patch"
+
+    def test_sync_files_records_synced_files_in_sync_state(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        userfs.setcontents("newfile.txt", urandom(kb(1)))
+        sync_state = SyncState()
+        # Act
+        SyncedCuckooDrive(userfs, remotefs, sync_state=sync_state)
+        # Assert
+        assert sync_state.unchanged("newfile.txt", userfs.getinfo("newfile.txt"),
+                                    part_size=remotefs.file_size)
+
+    def test_sync_files_skips_files_unchanged_since_last_sync(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        userfs.makedir("backups")
+        userfs.setcontents("backups/newfile.txt", urandom(kb(1)))
+        sync_state = SyncState()
+        drive = SyncedCuckooDrive(userfs, remotefs, sync_state=sync_state)
+        remotefs.exists = Mock(wraps=remotefs.exists)
+        # Act
+        drive.sync_dirs()
+        drive.sync_files()
+        # Assert
+        assert not remotefs.exists.called
+
+    def test_sync_files_syncs_files_changed_since_last_sync(self, filesystems):
+        # Arrange
+        userfs, remotefs = filesystems
+        userfs.setcontents("newfile.txt", urandom(kb(1)))
+        sync_state = SyncState()
+        drive = SyncedCuckooDrive(userfs, remotefs, sync_state=sync_state)
+        new_data = urandom(kb(2))
+        userfs.setcontents("newfile.txt", new_data)
+        # Act
+        drive.sync_files()
+        # Assert
+        assert remotefs.getcontents("newfile.txt") == new_data
+
     def test_has_conflict_returns_true_if_destination_is_newer(self, drive):
         # Arrange
         drive.userfs.setcontents("source.txt", urandom(kb(1)))
@@ -161,6 +461,23 @@ class TestSyncedCuckooDrive(object):
         assert drive.remotefs.getcontents("source.txt") == new_data
 
 
+    def test_patchfile_uploads_only_changed_parts(self, drive):
+        # Arrange
+        drive.remotefs.partedfs.max_part_size = kb(4)
+        old_data = urandom(kb(10))
+        new_data = old_data + urandom(kb(1))
+        drive.remotefs.setcontents("source.txt", old_data)
+        drive.userfs.setcontents("source.txt", new_data)
+        drive.remotefs.partedfs.wrapped_fs.setcontents = Mock(
+            wraps=drive.remotefs.partedfs.wrapped_fs.setcontents)
+        # Act
+        drive.patchfile("source.txt")
+        # Assert
+        written = [c[0][0] for c in drive.remotefs.partedfs.wrapped_fs.setcontents.call_args_list]
+        assert written == ["source.txt.part2", "source.txt.manifest"]
+        assert drive.remotefs.getcontents("source.txt") == new_data
+
+
 class TestExternalCuckooDriveFS(unittest.TestCase, FSTestCases):
     def setUp(self):
         fs1 = LimitSizeFS(MemoryFS(), mb(300))
@@ -170,10 +487,6 @@ class TestExternalCuckooDriveFS(unittest.TestCase, FSTestCases):
     def tearDown(self):
         self.fs.close()
 
-    @mark.xfail(reason="Appending does not work yet")
-    def test_readwriteappendseek(self):
-        super(TestExternalCuckooDriveFS, self).test_readwriteappendseek()
-
     @mark.xfail(reason="FS is not truncatable")
     def test_truncate_to_larger_size(self):
         super(TestExternalCuckooDriveFS, self).test_truncate_to_larger_size()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import threading
+
+from mock import Mock
+from pytest import fixture
+
+from fs.memoryfs import MemoryFS
+from fs.watch import ACCESSED, CREATED, MODIFIED, REMOVED, MOVED_SRC, MOVED_DST, OVERFLOW
+
+from cuckoodrive.events import EventQueue
+
+
+class TestEventQueue(object):
+    @fixture
+    def fs(self):
+        return MemoryFS()
+
+    @fixture
+    def queue(self, request):
+        queue = EventQueue(Mock(), quiet_period=0.05)
+        request.addfinalizer(queue.close)
+        return queue
+
+    def handled(self, queue):
+        assert queue.join(timeout=5)
+        return [event for call in queue.handler.call_args_list for event in call[0][0]]
+
+    def test_put_ignores_accessed_events(self, queue, fs):
+        # Act
+        queue.put(ACCESSED(fs, "backup.tar"))
+        # Assert
+        assert len(queue) == 0
+
+    def test_put_keeps_only_last_event_of_path(self, queue, fs):
+        # Arrange
+        created = CREATED(fs, "backup.tar")
+        modified = MODIFIED(fs, "backup.tar")
+        # Act
+        queue.put(created)
+        queue.put(MODIFIED(fs, "other.tar"))
+        queue.put(modified)
+        # Assert
+        assert [e.path for e in self.handled(queue)] == ["/other.tar", "/backup.tar"]
+        assert modified in self.handled(queue)
+
+    def test_put_pairs_moves(self, queue, fs):
+        # Arrange
+        moved = MOVED_SRC(fs, "backup.tar", "backup-old.tar")
+        # Act
+        queue.put(MODIFIED(fs, "backup-old.tar"))
+        queue.put(MOVED_SRC(fs, "backup.tar"))
+        queue.put(moved)
+        queue.put(MOVED_DST(fs, "backup-old.tar", "backup.tar"))
+        # Assert
+        assert self.handled(queue) == [moved]
+
+    def test_put_removed_directory_drops_events_below_it(self, queue, fs):
+        # Arrange
+        removed = REMOVED(fs, "backups")
+        # Act
+        queue.put(CREATED(fs, "backups/backup.tar"))
+        queue.put(CREATED(fs, "backups-old.tar"))
+        queue.put(removed)
+        # Assert
+        assert [e.path for e in self.handled(queue)] == ["/backups-old.tar", "/backups"]
+
+    def test_put_moved_directory_moves_events_below_it(self, queue, fs):
+        # Arrange
+        moved = MOVED_SRC(fs, "a", "b")
+        # Act
+        queue.put(CREATED(fs, "a/new"))
+        queue.put(MOVED_SRC(fs, "a/old", "a/renamed"))
+        queue.put(CREATED(fs, "ab"))
+        queue.put(moved)
+        queue.put(MOVED_DST(fs, "b", "a"))
+        # Assert
+        handled = self.handled(queue)
+        assert [(type(e), e.path) for e in handled] == [
+            (CREATED, "/ab"), (MOVED_SRC, "/a"), (CREATED, "/b/new"), (MOVED_SRC, "/b/old")]
+        assert handled[-1].destination == "/b/renamed"
+
+    def test_put_keeps_move_when_source_is_created_again(self, queue, fs):
+        # Arrange
+        moved = MOVED_SRC(fs, "backup.tar", "backup.tar~")
+        created = CREATED(fs, "backup.tar")
+        # Act
+        queue.put(moved)
+        queue.put(MOVED_DST(fs, "backup.tar~", "backup.tar"))
+        queue.put(created)
+        # Assert
+        assert self.handled(queue) == [moved, created]
+
+    def test_put_keeps_move_to_source_of_pending_move(self, queue, fs):
+        # Arrange
+        first = MOVED_SRC(fs, "b", "c")
+        second = MOVED_SRC(fs, "a", "b")
+        # Act
+        queue.put(first)
+        queue.put(second)
+        # Assert
+        assert self.handled(queue) == [first, second]
+
+    def test_put_removed_directory_keeps_moves_out_of_it(self, queue, fs):
+        # Arrange
+        moved = MOVED_SRC(fs, "backups/backup.tar", "backup.tar")
+        removed = REMOVED(fs, "backups")
+        # Act
+        queue.put(MOVED_SRC(fs, "backups/old.tar", "backups/older.tar"))
+        queue.put(moved)
+        queue.put(MOVED_DST(fs, "backup.tar", "backups/backup.tar"))
+        queue.put(removed)
+        # Assert
+        assert self.handled(queue) == [moved, removed]
+
+    def test_put_overflow_drops_pending_events(self, queue, fs):
+        # Arrange
+        overflow = OVERFLOW(fs, None)
+        # Act
+        queue.put(CREATED(fs, "backup.tar"))
+        queue.put(overflow)
+        queue.put(CREATED(fs, "other.tar"))
+        # Assert
+        assert self.handled(queue) == [overflow]
+
+    def test_events_are_handled_in_one_batch(self, queue, fs):
+        # Act
+        for idx in range(100):
+            queue.put(CREATED(fs, "file{0}.txt".format(idx)))
+        # Assert
+        assert len(self.handled(queue)) == 100
+        assert queue.handler.call_count == 1
+
+    def test_events_are_handled_after_quiet_period(self, fs):
+        # Arrange
+        handled = threading.Event()
+        queue = EventQueue(lambda events: handled.set(), quiet_period=60)
+        # Act
+        queue.put(CREATED(fs, "backup.tar"))
+        # Assert
+        assert not handled.wait(0.1)
+        queue.close()
+        assert handled.is_set()
+
+    def test_events_are_handled_after_max_delay_during_burst(self, fs):
+        # Arrange
+        handled = threading.Event()
+        queue = EventQueue(lambda events: handled.set(), quiet_period=60, max_delay=0.05)
+        # Act
+        queue.put(CREATED(fs, "backup.tar"))
+        # Assert
+        assert handled.wait(5)
+        queue.close()
+
+    def test_handler_errors_do_not_stop_queue(self, queue, fs):
+        # Arrange
+        queue.handler.side_effect = [ValueError(), None]
+        queue.put(CREATED(fs, "backup.tar"))
+        queue.join(timeout=5)
+        # Act
+        queue.put(CREATED(fs, "other.tar"))
+        # Assert
+        assert queue.join(timeout=5)
+        assert queue.handler.call_count == 2
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import time
+
+from mock import Mock
 from pytest import fixture, raises
 
+from fs.errors import UnsupportedError
 from fs.memoryfs import MemoryFS
 
 from cuckoodrive.filelock import FileLock, FileLockError
@@ -35,3 +39,55 @@ class TestFileLock:
             with raises(FileLockError):
                 with FileLock(fs, timeout=1):
                     assert False  # We shouldnt get the lock
+
+    def test_acquire_breaks_stale_lock(self, fs):
+        # Arrange
+        fs.setcontents(".lock", b"")
+        fs.setcontents(".lock.heartbeat", "{0!r}".format(time.time() - 600).encode("ascii"))
+        # Act & Assert
+        with FileLock(fs, timeout=1, stale_timeout=60) as lock:
+            assert lock.is_locked
+
+    def test_lock_without_heartbeat_is_never_stale(self, fs):
+        # Arrange
+        fs.setcontents(".lock", b"")
+        # Act & Assert
+        assert not FileLock(fs, stale_timeout=0).is_stale()
+
+    def test_acquire_keeps_lock_with_recent_heartbeat(self, fs):
+        # Arrange
+        with FileLock(fs, stale_timeout=60) as lock:
+            lock.heartbeat()
+            # Act & Assert
+            with raises(FileLockError):
+                with FileLock(fs, timeout=1, stale_timeout=60):
+                    assert False  # We shouldnt get the lock
+
+    def test_heartbeat_renews_lockfile(self, fs):
+        # Arrange
+        with FileLock(fs) as lock:
+            fs.setcontents(".lock.heartbeat", "{0!r}".format(time.time() - 600).encode("ascii"))
+            fs.settimes = Mock(side_effect=UnsupportedError("settimes"))
+            # Act
+            lock.heartbeat()
+            # Assert
+            assert not FileLock(fs, stale_timeout=60).is_stale()
+
+    def test_heartbeat_does_not_touch_lockfile(self, fs):
+        # Arrange
+        with FileLock(fs) as lock:
+            fs.open = Mock(wraps=fs.open)
+            fs.remove = Mock(wraps=fs.remove)
+            # Act
+            lock.heartbeat()
+            # Assert
+            assert [c[0][0] for c in fs.open.call_args_list] == [".lock.heartbeat"]
+            assert not fs.remove.called
+            assert fs.exists(".lock")
+
+    def test_release_removes_lockfile_and_heartbeat(self, fs):
+        # Act
+        with FileLock(fs):
+            pass
+        # Assert
+        assert fs.listdir() == []
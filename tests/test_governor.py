@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import threading
+import time
+import unittest
+
+from mock import Mock
+from pytest import fixture, raises
+
+from fs.errors import NoMetaError
+from fs.memoryfs import MemoryFS
+from fs.tests import FSTestCases
+from fs.wrapfs.limitsizefs import LimitSizeFS
+
+from cuckoodrive import CuckooDriveFS
+from cuckoodrive.governor import GovernedFS, TokenBucket
+from cuckoodrive.multifs import free_space
+from cuckoodrive.utils import kb, mb
+
+
+class TestExternalGovernedFS(unittest.TestCase, FSTestCases):
+    def setUp(self):
+        self.fs = GovernedFS(MemoryFS(), max_operations=2,
+                             upload_limits=[TokenBucket(mb(100))],
+                             download_limits=[TokenBucket(mb(100))])
+
+    def tearDown(self):
+        self.fs.close()
+
+
+class TestTokenBucket(object):
+    def test_consume_does_not_wait_within_capacity(self):
+        # Arrange
+        bucket = TokenBucket(kb(100))
+        # Act
+        wait = bucket.consume(kb(100))
+        # Assert
+        assert wait == 0
+
+    def test_consume_waits_for_missing_tokens(self):
+        # Arrange
+        bucket = TokenBucket(kb(100))
+        bucket.consume(kb(100))
+        # Act
+        start = time.time()
+        wait = bucket.consume(kb(20))
+        # Assert
+        assert 0.15 < wait <= 0.2
+        assert time.time() - start >= 0.15
+
+    def test_consume_allows_more_than_capacity_in_debt(self):
+        # Arrange
+        bucket = TokenBucket(kb(100), capacity=kb(10))
+        # Act
+        wait = bucket.consume(kb(15))
+        # Assert
+        assert 0.04 < wait <= 0.05
+
+    def test_consume_refills_after_idle_time(self):
+        # Arrange
+        bucket = TokenBucket(kb(100))
+        bucket.consume(kb(100))
+        time.sleep(0.2)
+        # Act
+        wait = bucket.consume(kb(10))
+        # Assert
+        assert wait == 0
+
+
+class TestGovernedFS(object):
+    @fixture
+    def fs(self):
+        return MemoryFS()
+
+    def test_operations_are_limited_to_max_operations(self, fs):
+        # Arrange
+        running, max_running = [0], [0]
+        lock = threading.Lock()
+
+        def slow_exists(path):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return True
+
+        fs.exists = slow_exists
+        governedfs = GovernedFS(fs, max_operations=2)
+        threads = [threading.Thread(target=governedfs.exists, args=("file",)) for _ in range(6)]
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Assert
+        assert max_running[0] == 2
+
+    def test_setcontents_takes_bytes_from_upload_limits(self, fs):
+        # Arrange
+        remote_limit, uplink = Mock(), Mock()
+        governedfs = GovernedFS(fs, upload_limits=[remote_limit, uplink])
+        # Act
+        governedfs.setcontents("file", b"x" * 100)
+        # Assert
+        remote_limit.consume.assert_called_once_with(100)
+        uplink.consume.assert_called_once_with(100)
+        assert fs.getcontents("file", "rb") == b"x" * 100
+
+    def test_setcontents_of_file_takes_read_bytes_from_upload_limits(self, fs):
+        # Arrange
+        limit = Mock()
+        governedfs = GovernedFS(fs, upload_limits=[limit])
+        with governedfs.open("src", "wb") as src_file:
+            src_file.write(b"x" * 100)
+        limit.reset_mock()
+        # Act
+        with fs.open("src", "rb") as src_file:
+            governedfs.setcontents("file", src_file)
+        # Assert
+        assert sum(c[0][0] for c in limit.consume.call_args_list) == 100
+        assert fs.getcontents("file", "rb") == b"x" * 100
+
+    def test_written_and_read_files_are_taken_from_limits(self, fs):
+        # Arrange
+        upload_limit, download_limit = Mock(), Mock()
+        governedfs = GovernedFS(fs, upload_limits=[upload_limit],
+                                download_limits=[download_limit])
+        # Act
+        with governedfs.open("file", "wb") as f:
+            f.write(b"x" * 100)
+        with governedfs.open("file", "rb") as f:
+            data = f.read()
+        # Assert
+        assert data == b"x" * 100
+        assert sum(c[0][0] for c in upload_limit.consume.call_args_list) == 100
+        assert sum(c[0][0] for c in download_limit.consume.call_args_list) == 100
+
+    def test_flush_and_close_of_files_take_operation_slots(self, fs):
+        # Arrange
+        governedfs = GovernedFS(fs, max_operations=1)
+        f = governedfs.open("file", "wb")
+        wrapped_file = f.wrapped_file
+        governedfs._call = Mock(wraps=governedfs._call)
+        # Act
+        f.write(b"x" * 100)
+        f.flush()
+        f.close()
+        # Assert
+        called = [c[0][0] for c in governedfs._call.call_args_list]
+        assert wrapped_file.flush in called
+        assert wrapped_file.close in called
+        assert fs.getcontents("file", "rb") == b"x" * 100
+
+    def test_walk_lists_directories_through_operation_slots(self, fs):
+        # Arrange
+        fs.makedir("dir")
+        fs.setcontents("dir/file", b"x")
+        fs.setcontents("file", b"x")
+        governedfs = GovernedFS(fs, max_operations=1)
+        governedfs._call = Mock(wraps=governedfs._call)
+        # Act
+        files = sorted(governedfs.walkfiles())
+        # Assert
+        assert files == ["/dir/file", "/file"]
+        assert fs.listdir in [c[0][0] for c in governedfs._call.call_args_list]
+
+    def test_getcontents_takes_bytes_from_download_limits(self, fs):
+        # Arrange
+        fs.setcontents("file", b"x" * 100)
+        limit = Mock()
+        governedfs = GovernedFS(fs, download_limits=[limit])
+        # Act
+        data = governedfs.getcontents("file", "rb")
+        # Assert
+        assert data == b"x" * 100
+        limit.consume.assert_called_once_with(100)
+
+    def test_shared_limit_slows_down_uploads_of_all_filesystems(self):
+        # Arrange
+        uplink = TokenBucket(kb(100))
+        fs1 = GovernedFS(MemoryFS(), upload_limits=[uplink])
+        fs2 = GovernedFS(MemoryFS(), upload_limits=[uplink])
+        # Act
+        start = time.time()
+        fs1.setcontents("file", b"x" * kb(100))
+        fs2.setcontents("file", b"x" * kb(20))
+        # Assert
+        assert time.time() - start >= 0.15
+
+    def test_free_space_of_wrapped_limitsizefs(self):
+        # Arrange
+        governedfs = GovernedFS(LimitSizeFS(MemoryFS(), kb(10)), max_operations=1)
+        governedfs.setcontents("file", b"x" * kb(4))
+        # Act & Assert
+        assert governedfs.hasmeta("free_space")
+        assert free_space(governedfs) == kb(6)
+
+    def test_free_space_takes_operation_slot(self):
+        # Arrange
+        governedfs = GovernedFS(LimitSizeFS(MemoryFS(), kb(10)), max_operations=1)
+        governedfs._call = Mock(wraps=governedfs._call)
+        # Act
+        space = free_space(governedfs)
+        # Assert
+        assert space == kb(10)
+        assert governedfs._call.call_count == 2
+
+    def test_free_space_raises_error_without_meta(self, fs):
+        # Arrange
+        governedfs = GovernedFS(fs)
+        # Act & Assert
+        assert not governedfs.hasmeta("free_space")
+        assert governedfs.getmeta("free_space", None) is None
+        with raises(NoMetaError):
+            free_space(governedfs)
+
+
+class TestCuckooDriveFSGovernor(object):
+    @fixture
+    def remotes(self):
+        return [LimitSizeFS(MemoryFS(), mb(300)), LimitSizeFS(MemoryFS(), mb(300))]
+
+    def test_remotes_are_limited_by_default(self, remotes):
+        # Act
+        fs = CuckooDriveFS(remotes)
+        # Assert
+        governed = fs.multifs.fs_sequence
+        assert all(isinstance(remote, GovernedFS) for remote in governed)
+        assert all(remote.max_operations == CuckooDriveFS.max_remote_operations
+                   for remote in governed)
+        assert all(not remote.upload_limits and not remote.download_limits
+                   for remote in governed)
+        fs.close()
+
+    def test_remotes_are_not_wrapped_without_limits(self, remotes, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(CuckooDriveFS, "max_remote_operations", None)
+        # Act
+        fs = CuckooDriveFS(remotes)
+        # Assert
+        assert not any(isinstance(remote, GovernedFS) for remote in fs.multifs.fs_sequence)
+        fs.close()
+
+    def test_remotes_are_wrapped_with_limits(self, remotes, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(CuckooDriveFS, "max_remote_operations", 4)
+        monkeypatch.setattr(CuckooDriveFS, "remote_download_rate", mb(1))
+        monkeypatch.setattr(CuckooDriveFS, "upload_rate", mb(10))
+        # Act
+        fs = CuckooDriveFS(remotes)
+        fs.setcontents("file", b"x" * kb(64))
+        # Assert
+        governed = fs.multifs.fs_sequence
+        assert all(isinstance(remote, GovernedFS) for remote in governed)
+        assert all(remote.max_operations == 4 for remote in governed)
+        assert governed[0].upload_limits[0] is governed[1].upload_limits[0]
+        assert governed[0].download_limits[0] is not governed[1].download_limits[0]
+        assert fs.getcontents("file", "rb") == b"x" * kb(64)
+        fs.close()
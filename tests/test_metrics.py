@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import json
+import unittest
+
+from pytest import fixture, raises
+
+from fs.errors import ResourceNotFoundError
+from fs.memoryfs import MemoryFS
+from fs.tests import FSTestCases
+from fs.wrapfs.limitsizefs import LimitSizeFS
+
+from cuckoodrive import CuckooDriveFS
+from cuckoodrive.metrics import LATENCY_BUCKETS, Metrics, MetricsDumper, MetricsFS
+from cuckoodrive.multifs import free_space
+from cuckoodrive.utils import kb, mb
+
+
+class TestExternalMetricsFS(unittest.TestCase, FSTestCases):
+    def setUp(self):
+        self.fs = MetricsFS(MemoryFS(), Metrics(), "Test")
+
+    def tearDown(self):
+        self.fs.close()
+
+
+class TestMetrics(object):
+    @fixture
+    def metrics(self):
+        return Metrics()
+
+    def test_record_sums_up_calls(self, metrics):
+        # Act
+        metrics.record("Remote0", "open", 0.002, size=10)
+        metrics.record("Remote0", "open", 0.2, size=5, failed=True)
+        metrics.record("Remote1", "open", 20)
+        # Assert
+        layers = metrics.snapshot()["layers"]
+        stats = layers["Remote0"]["open"]
+        assert stats["count"] == 2
+        assert stats["errors"] == 1
+        assert stats["bytes"] == 15
+        assert stats["seconds"] == 0.202
+        assert stats["buckets"][LATENCY_BUCKETS.index(0.005)] == 1
+        assert stats["buckets"][LATENCY_BUCKETS.index(0.25)] == 1
+        assert layers["Remote1"]["open"]["buckets"][-1] == 1
+
+    def test_to_json(self, metrics):
+        # Arrange
+        metrics.record("Remote0", "exists", 0.01)
+        # Act
+        data = json.loads(metrics.to_json())
+        # Assert
+        assert data["latency_buckets"] == list(LATENCY_BUCKETS)
+        assert data["layers"]["Remote0"]["exists"]["count"] == 1
+
+    def test_to_prometheus_has_cumulative_buckets(self, metrics):
+        # Arrange
+        metrics.record("Remote0", "exists", 0.002)
+        metrics.record("Remote0", "exists", 0.02)
+        # Act
+        lines = metrics.to_prometheus().splitlines()
+        # Assert
+        labels = 'layer="Remote0",method="exists"'
+        assert "cuckoodrive_operations_total{{{0}}} 2".format(labels) in lines
+        assert "cuckoodrive_operation_errors_total{{{0}}} 0".format(labels) in lines
+        assert 'cuckoodrive_operation_duration_seconds_bucket{{{0},le="0.001"}} 0'.format(
+            labels) in lines
+        assert 'cuckoodrive_operation_duration_seconds_bucket{{{0},le="0.005"}} 1'.format(
+            labels) in lines
+        assert 'cuckoodrive_operation_duration_seconds_bucket{{{0},le="+Inf"}} 2'.format(
+            labels) in lines
+        assert "cuckoodrive_operation_duration_seconds_count{{{0}}} 2".format(labels) in lines
+
+    def test_dump_writes_file(self, metrics, tmpdir):
+        # Arrange
+        metrics.record("Remote0", "exists", 0.01)
+        path = str(tmpdir.join("metrics.prom"))
+        # Act
+        metrics.dump(path, format="prometheus")
+        # Assert
+        with open(path, "rb") as fh:
+            assert fh.read().decode("utf-8") == metrics.to_prometheus()
+        assert tmpdir.listdir() == [tmpdir.join("metrics.prom")]
+
+    def test_dumper_dumps_periodically_and_on_close(self, metrics, tmpdir):
+        # Arrange
+        path = str(tmpdir.join("metrics.json"))
+        dumper = MetricsDumper(metrics, path, interval=0.05).start()
+        # Act
+        metrics.record("Remote0", "exists", 0.01)
+        dumper.close()
+        # Assert
+        with open(path, "rb") as fh:
+            assert json.load(fh)["layers"]["Remote0"]["exists"]["count"] == 1
+
+
+class TestMetricsFS(object):
+    @fixture
+    def metrics(self):
+        return Metrics()
+
+    @fixture
+    def fs(self, metrics):
+        return MetricsFS(MemoryFS(), metrics, "Remote0")
+
+    def test_calls_are_recorded(self, fs, metrics):
+        # Act
+        fs.makedir("dir")
+        fs.exists("dir")
+        fs.exists("file")
+        # Assert
+        layer = metrics.snapshot()["layers"]["Remote0"]
+        assert layer["makedir"]["count"] == 1
+        assert layer["exists"]["count"] == 2
+
+    def test_errors_are_recorded(self, fs, metrics):
+        # Act
+        with raises(ResourceNotFoundError):
+            fs.getinfo("file")
+        # Assert
+        assert metrics.snapshot()["layers"]["Remote0"]["getinfo"]["errors"] == 1
+
+    def test_transferred_bytes_are_recorded(self, fs, metrics):
+        # Act
+        fs.setcontents("file1", b"x" * 100)
+        with fs.open("file2", "wb") as fh:
+            fh.write(b"x" * 50)
+        with fs.open("file2", "rb") as fh:
+            fh.read()
+        fs.getcontents("file1", "rb")
+        # Assert
+        layer = metrics.snapshot()["layers"]["Remote0"]
+        assert layer["setcontents"]["bytes"] == 100
+        assert layer["write"]["bytes"] == 50
+        assert layer["read"]["bytes"] == 50
+        assert layer["getcontents"]["bytes"] == 100
+
+    def test_free_space_of_wrapped_limitsizefs(self, metrics):
+        # Arrange
+        fs = MetricsFS(LimitSizeFS(MemoryFS(), kb(10)), metrics, "Remote0")
+        fs.setcontents("file", b"x" * kb(4))
+        # Act & Assert
+        assert free_space(fs) == kb(6)
+
+
+class TestCuckooDriveFSMetrics(object):
+    def test_all_layers_are_instrumented(self):
+        # Arrange
+        metrics = Metrics()
+        fs = CuckooDriveFS([LimitSizeFS(MemoryFS(), mb(300)), LimitSizeFS(MemoryFS(), mb(300))],
+                           metrics=metrics)
+        # Act
+        fs.setcontents("file", b"x" * kb(64))
+        fs.getcontents("file", "rb")
+        # Assert
+        layers = metrics.snapshot()["layers"]
+        assert set(layers) >= {"PartedFS", "MultiFS", "Remote0"}
+        assert layers["PartedFS"]["write"]["bytes"] == kb(64)
+        assert layers["PartedFS"]["read"]["bytes"] == kb(64)
+        # The governed remotes write the manifest through open as well
+        manifest_size = fs.multifs.getsize("file.manifest")
+        assert sum(layers[remote].get("write", {}).get("bytes", 0)
+                   for remote in ["Remote0", "Remote1"]) == kb(64) + manifest_size
+        fs.close()
+
+    def test_no_layer_is_wrapped_without_metrics(self):
+        # Act
+        fs = CuckooDriveFS([LimitSizeFS(MemoryFS(), mb(300))])
+        # Assert
+        assert not isinstance(fs.wrapped_fs, MetricsFS)
+        assert not any(isinstance(remote, MetricsFS) for remote in fs.multifs.fs_sequence)
+        fs.close()
@@ -2,6 +2,8 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 
 from os import urandom
+import threading
+import time
 
 import unittest
 from mock import Mock
@@ -9,10 +11,10 @@ from pytest import fixture, raises
 
 from fs.tests import FSTestCases
 from fs.wrapfs.limitsizefs import LimitSizeFS
-from fs.errors import NoMetaError
+from fs.errors import NoMetaError, DestinationExistsError, StorageSpaceError
 from fs.memoryfs import MemoryFS
 
-from cuckoodrive.multifs import WritableMultiFS, free_space
+from cuckoodrive.multifs import WritableMultiFS, FreeSpaceCache, LocationIndex, free_space
 from cuckoodrive.utils import mb, kb
 
 
@@ -31,6 +33,12 @@ class TestExternalWritableMultiFS(unittest.TestCase, FSTestCases):
         self.fs.close()
 
 
+class TestExternalConcurrentWritableMultiFS(TestExternalWritableMultiFS):
+    def setUp(self):
+        super(TestExternalConcurrentWritableMultiFS, self).setUp()
+        self.fs.max_workers = 4
+
+
 class TestWritableMultiFS(object):
 
     @fixture
@@ -111,6 +119,17 @@ class TestWritableMultiFS(object):
         assert fs.getsize("backup.tar.part0") == kb(5)
         assert fs.getsize("backup.tar.part1") == kb(3)
 
+    def test_open_appends_on_location_of_existing_file(self, fs):
+        # Arrange
+        data = urandom(kb(3))
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part0", data=data)
+        # Act
+        with fs.open("backup.tar.part0", mode="ab") as fh:
+            fh.write(b"appended")
+        # Assert
+        assert not fs.fs_lookup["fs1"].exists("backup.tar.part0")
+        assert fs.getcontents("backup.tar.part0", "rb") == data + b"appended"
+
     def test_remove_switches_writefs_to_location_of_existing_file(self, fs):
         # Arrange
         fs.fs_lookup["fs1"].setcontents("backup.tar.part0", data=urandom(kb(4)))
@@ -123,3 +142,372 @@ class TestWritableMultiFS(object):
         # Assert
         assert not fs.exists("backup.tar.part0")
         assert not fs.exists("backup.tar.part1")
+
+    def test_writefs_caches_free_space_of_filesystems(self, fs, monkeypatch):
+        # Arrange
+        free_space_mock = Mock(return_value=mb(100))
+        monkeypatch.setattr("cuckoodrive.multifs.free_space", free_space_mock)
+        # Act
+        for _ in range(5):
+            fs.writefs
+        # Assert
+        assert free_space_mock.call_count == 2
+
+    def test_writefs_asks_filesystems_every_time_without_interval(self, monkeypatch):
+        # Arrange
+        multifs = WritableMultiFS(free_space_interval=0)
+        multifs.addfs("fs1", LimitSizeFS(MemoryFS(), mb(300)))
+        free_space_mock = Mock(return_value=mb(100))
+        monkeypatch.setattr("cuckoodrive.multifs.free_space", free_space_mock)
+        # Act
+        multifs.writefs
+        multifs.writefs
+        # Assert
+        assert free_space_mock.call_count == 2
+
+    def test_open_accounts_written_bytes_in_cache(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        # Act
+        with fs.open("backup.tar.part0", mode="wb") as fh:
+            fh.write(urandom(kb(4)))
+        # Assert
+        assert fs.free_space_cache.snapshot()[fs1] == mb(300) - kb(4)
+
+    def test_writefs_switches_when_cached_free_space_is_used(self):
+        # Arrange
+        multifs = WritableMultiFS()
+        multifs.addfs("fs1", LimitSizeFS(MemoryFS(), kb(10)))
+        multifs.addfs("fs2", LimitSizeFS(MemoryFS(), kb(8)))
+        # Act
+        multifs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Assert
+        assert multifs.writefs == multifs.fs_lookup["fs2"]
+
+    def test_remove_releases_bytes_in_cache(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Act
+        fs.remove("backup.tar.part0")
+        # Assert
+        assert fs.free_space_cache.snapshot()[fs1] == mb(300)
+
+    def test_remove_takes_size_of_written_file_from_index(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        with fs.open("backup.tar.part0", mode="wb") as fh:
+            fh.write(urandom(kb(4)))
+        fs1.getsize = Mock(side_effect=fs1.getsize)
+        # Act
+        fs.remove("backup.tar.part0")
+        # Assert
+        assert not fs1.getsize.called
+        assert fs.free_space_cache.snapshot()[fs1] == mb(300)
+
+    def test_remove_of_unknown_size_invalidates_cache(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        fs.writefs
+        fs1.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs1.getsize = Mock(side_effect=fs1.getsize)
+        # Act
+        fs.remove("backup.tar.part0")
+        # Assert
+        assert not fs1.getsize.called
+        assert fs1 not in fs.free_space_cache
+        assert fs.free_space_cache.get(fs1) == mb(300)
+
+    def test_setcontents_releases_reserved_bytes_on_error(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        fs1.setcontents = Mock(side_effect=StorageSpaceError("setcontents"))
+        # Act
+        with raises(StorageSpaceError):
+            fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Assert
+        assert fs.free_space_cache.snapshot()[fs1] == mb(300)
+        assert fs.location_index.get("backup.tar.part0") is None
+
+    def test_refresh_free_space_asks_filesystems_again(self, fs):
+        # Arrange
+        fs1 = fs.fs_lookup["fs1"]
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs1.remove("backup.tar.part0")
+        # Act
+        free_space = fs.refresh_free_space()
+        # Assert
+        assert free_space[fs1] == mb(300)
+
+    def test_lookups_do_not_wait_for_lock_of_other_threads(self, fs):
+        # Arrange
+        fs.makedir("backups")
+        fs.setcontents("backup.tar.part0", data=urandom(kb(1)))
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with fs._lock:
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait(5)
+        # Act & Assert
+        try:
+            assert fs.exists("backup.tar.part0")
+            assert fs.isfile("backup.tar.part0")
+            assert fs.isdir("backups")
+            assert not fs.exists("backup.tar.part1")
+        finally:
+            release.set()
+            thread.join()
+
+    def test_getmeta_returns_sum_of_free_space(self, fs):
+        # Act & Assert
+        assert fs.getmeta("free_space") == mb(540)
+
+    def test_open_uses_location_index_instead_of_asking_filesystems(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        for remote in fs:
+            remote.exists = Mock(side_effect=remote.exists)
+        # Act
+        with fs.open("backup.tar.part0", mode="rb") as fh:
+            data = fh.read()
+        # Assert
+        assert len(data) == kb(4)
+        assert fs.fs_lookup["fs1"].exists.call_count <= 1
+        assert not fs.fs_lookup["fs2"].exists.called
+
+    def test_listdir_records_locations_in_index(self, fs):
+        # Arrange
+        fs.fs_lookup["fs1"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part1", data=urandom(kb(3)))
+        # Act
+        fs.listdir()
+        # Assert
+        assert fs.location_index.get("backup.tar.part0") == set(["fs1"])
+        assert fs.location_index.get("/backup.tar.part1") == set(["fs2"])
+
+    def test_open_falls_back_to_search_if_index_is_outdated(self, fs):
+        # Arrange
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.location_index.set("backup.tar.part0", ["fs1"])
+        # Act
+        with fs.open("backup.tar.part0", mode="rb") as fh:
+            data = fh.read()
+        # Assert
+        assert len(data) == kb(4)
+        assert fs.location_index.get("backup.tar.part0") == set(["fs2"])
+
+    def test_exists_drops_outdated_location(self, fs):
+        # Arrange
+        fs.location_index.set("backup.tar.part0", ["fs1"])
+        # Act & Assert
+        assert not fs.exists("backup.tar.part0")
+        assert fs.location_index.get("backup.tar.part0") is None
+
+    def test_isfile_searches_again_if_index_is_outdated(self, fs):
+        # Arrange
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.location_index.set("backup.tar.part0", ["fs1"])
+        # Act & Assert
+        assert fs.isfile("backup.tar.part0")
+        assert not fs.isdir("backup.tar.part0")
+        assert fs.location_index.get("backup.tar.part0") == set(["fs2"])
+
+    def test_remove_invalidates_location_index(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Act
+        fs.remove("backup.tar.part0")
+        # Assert
+        assert fs.location_index.get("backup.tar.part0") is None
+
+    def test_rename_moves_location_in_index(self, fs):
+        # Arrange
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Act
+        fs.rename("backup.tar.part0", "backup2.tar.part0")
+        # Assert
+        assert fs.location_index.get("backup.tar.part0") is None
+        assert fs.location_index.get("backup2.tar.part0") == set(["fs2"])
+
+    def test_load_location_index_restores_saved_snapshot(self, fs):
+        # Arrange
+        settings_fs = MemoryFS()
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.save_location_index(settings_fs, "index.json")
+        fs.location_index.clear()
+        # Act
+        loaded = fs.load_location_index(settings_fs, "index.json")
+        # Assert
+        assert loaded
+        assert fs.location_index.get("backup.tar.part0") == set(["fs1"])
+
+    def test_loaded_snapshot_is_only_a_hint(self, fs):
+        # Arrange
+        settings_fs = MemoryFS()
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.save_location_index(settings_fs, "index.json")
+        fs.fs_lookup["fs1"].remove("backup.tar.part0")
+        fs.location_index.clear()
+        fs.load_location_index(settings_fs, "index.json")
+        # Act & Assert
+        assert not fs.exists("backup.tar.part0")
+        assert not fs.isfile("backup.tar.part0")
+
+    def test_load_location_index_ignores_snapshot_of_other_filesystems(self, fs):
+        # Arrange
+        settings_fs = MemoryFS()
+        fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.save_location_index(settings_fs, "index.json")
+        other_fs = WritableMultiFS()
+        other_fs.addfs("fs1", MemoryFS())
+        # Act & Assert
+        assert not other_fs.load_location_index(settings_fs, "index.json")
+        assert len(other_fs.location_index) == 0
+
+    def test_makedir_runs_concurrently_on_all_filesystems(self):
+        # Arrange
+        multifs = WritableMultiFS(max_workers=2)
+        both_started = threading.Event()
+        started = []
+
+        def makedir(path, **kwargs):
+            started.append(path)
+            if len(started) == 2:
+                both_started.set()
+            assert both_started.wait(5)
+
+        for name in ("fs1", "fs2"):
+            remote = MemoryFS()
+            remote.makedir = makedir
+            multifs.addfs(name, remote)
+        # Act
+        multifs.makedir("backups")
+        # Assert
+        assert multifs.location_index.get("backups") == set(["fs1", "fs2"])
+
+    def test_concurrent_makedir_raises_error_after_all_filesystems(self):
+        # Arrange
+        multifs = WritableMultiFS(max_workers=2)
+        multifs.addfs("fs1", MemoryFS())
+        multifs.addfs("fs2", MemoryFS())
+        multifs.fs_lookup["fs2"].makedir("backups")
+        # Act & Assert
+        with raises(DestinationExistsError):
+            multifs.makedir("backups")
+        assert multifs.fs_lookup["fs1"].isdir("backups")
+
+    def test_remove_runs_on_thread_pool(self, fs):
+        # Arrange
+        fs.max_workers = 2
+        fs.fs_lookup["fs1"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        fs.fs_lookup["fs2"].setcontents("backup.tar.part0", data=urandom(kb(4)))
+        # Act
+        fs.remove("backup.tar.part0")
+        # Assert
+        assert not fs.exists("backup.tar.part0")
+        assert fs._pool is not None
+
+
+class TestLocationIndex(object):
+    def test_invalidate_forgets_path_and_children(self):
+        # Arrange
+        index = LocationIndex()
+        index.set("backups", ["fs1", "fs2"])
+        index.set("backups/backup.tar.part0", ["fs1"])
+        index.set("backups2", ["fs1"])
+        # Act
+        index.invalidate("backups")
+        # Assert
+        assert index.get("backups") is None
+        assert index.get("backups/backup.tar.part0") is None
+        assert index.get("backups2") == set(["fs1"])
+
+    def test_invalidate_forgets_children_of_unindexed_directory(self):
+        # Arrange
+        index = LocationIndex()
+        index.add("backups/2015/backup.tar.part0", "fs1")
+        index.add("backups/backup.tar.part0", "fs2")
+        # Act
+        index.invalidate("backups")
+        # Assert
+        assert len(index) == 0
+
+    def test_invalidate_after_loads_forgets_children(self):
+        # Arrange
+        index = LocationIndex()
+        index.add("backups/backup.tar.part0", "fs1")
+        index.add("backup.tar.part0", "fs1")
+        loaded = LocationIndex()
+        loaded.loads(index.dumps({}), {})
+        # Act
+        loaded.invalidate("backups")
+        # Assert
+        assert loaded.get("backups/backup.tar.part0") is None
+        assert loaded.get("backup.tar.part0") == set(["fs1"])
+
+    def test_discard_keeps_children_of_path(self):
+        # Arrange
+        index = LocationIndex()
+        index.add("backups", "fs1")
+        index.add("backups/backup.tar.part0", "fs1")
+        # Act
+        index.discard("backups")
+        index.invalidate("backups")
+        # Assert
+        assert len(index) == 0
+
+    def test_set_without_filesystems_forgets_path(self):
+        # Arrange
+        index = LocationIndex()
+        index.add("backup.tar.part0", "fs1")
+        # Act
+        index.set("backup.tar.part0", [])
+        # Assert
+        assert index.get("backup.tar.part0") is None
+
+
+class TestFreeSpaceCache(object):
+    @fixture
+    def cache(self):
+        return FreeSpaceCache(refresh_interval=60)
+
+    def test_get_refreshes_when_interval_elapsed(self, cache, monkeypatch):
+        # Arrange
+        fs = LimitSizeFS(MemoryFS(), mb(230))
+        cache.get(fs)
+        cache.consume(fs, mb(30))
+        now = time.time()
+        monkeypatch.setattr("cuckoodrive.multifs.time.time", lambda: now + 61)
+        # Act & Assert
+        assert cache.get(fs) == mb(230)
+
+    def test_refresh_asks_filesystem_before_interval_elapsed(self, cache):
+        # Arrange
+        fs = LimitSizeFS(MemoryFS(), mb(230))
+        cache.get(fs)
+        cache.consume(fs, mb(30))
+        # Act & Assert
+        assert cache.refresh(fs) == mb(230)
+        assert cache.get(fs) == mb(230)
+
+    def test_consume_ignores_unknown_filesystems(self, cache):
+        # Arrange
+        fs = MemoryFS()
+        # Act
+        cache.consume(fs, mb(1))
+        # Assert
+        assert fs not in cache
+
+    def test_invalidate_forgets_cached_value(self, cache):
+        # Arrange
+        fs = LimitSizeFS(MemoryFS(), mb(230))
+        cache.get(fs)
+        # Act
+        cache.invalidate(fs)
+        # Assert
+        assert cache.snapshot() == {}
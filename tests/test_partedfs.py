@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
+from hashlib import sha1
+from io import BytesIO
 from operator import itemgetter
 from os import urandom
-from datetime import timedelta, date
+from datetime import datetime, timedelta, date
 from fs.tests import FSTestCases
 
 from mock import Mock, call
 from pytest import fixture, raises, mark
 
 from fs.memoryfs import MemoryFS
+from fs.wrapfs.limitsizefs import LimitSizeFS
 from fs.errors import ResourceNotFoundError, ResourceInvalidError
+import threading
 import unittest
 
-from cuckoodrive.partedfs import PartedFS, PartedFile, FilePart, InvalidFilePointerLocation
+from cuckoodrive.partedfs import (
+    PartedFS,
+    PartedFile,
+    FilePart,
+    PartManifest,
+    PartUploader,
+    PartPrefetcher,
+    InvalidFilePointerLocation)
+from cuckoodrive.multifs import WritableMultiFS
 from cuckoodrive.utils import kb
 
 
@@ -23,10 +35,6 @@ class TestExternalPartedFS(unittest.TestCase, FSTestCases):
     def tearDown(self):
         self.fs.close()
 
-    @mark.xfail(reason="Appending does not work yet")
-    def test_readwriteappendseek(self):
-        super(TestExternalPartedFS, self).test_readwriteappendseek()
-
     @mark.xfail(reason="FS is not truncatable")
     def test_truncate_to_larger_size(self):
         super(TestExternalPartedFS, self).test_truncate_to_larger_size()
@@ -36,11 +44,30 @@ class TestExternalPartedFS(unittest.TestCase, FSTestCases):
         super(TestExternalPartedFS, self).test_truncate()
 
 
+class TestExternalManifestPartedFS(TestExternalPartedFS):
+    def setUp(self):
+        self.fs = PartedFS(MemoryFS(), kb(100), use_manifest=True)
+
+
+class TestExternalStripedPartedFS(TestExternalPartedFS):
+    def setUp(self):
+        self.fs = PartedFS(MemoryFS(), kb(100), use_manifest=True, upload_workers=2)
+
+
+class TestExternalPrefetchPartedFS(TestExternalPartedFS):
+    def setUp(self):
+        self.fs = PartedFS(MemoryFS(), kb(100), use_manifest=True, prefetch_parts=2)
+
+
 class TestPartedFS(object):
     @fixture
     def fs(self):
         return PartedFS(MemoryFS(), kb(4))
 
+    @fixture
+    def manifest_fs(self):
+        return PartedFS(MemoryFS(), kb(4), use_manifest=True)
+
     @fixture
     def fs_with_folder_structure(self, fs):
         fs.wrapped_fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
@@ -213,6 +240,38 @@ class TestPartedFS(object):
         created_parts = [part.name for part in f.parts]
         assert created_parts == ["backup.tar.part0", "backup.tar.part1", "backup.tar.part2"]
 
+    def test_open_for_reading_does_not_open_parts(self, fs_with_test_file):
+        # Arrange
+        fs_with_test_file.wrapped_fs.open = Mock(wraps=fs_with_test_file.wrapped_fs.open)
+        # Act
+        f = fs_with_test_file.open("backup.tar", mode="rb")
+        # Assert
+        assert f.parts == [None, None]
+        assert not fs_with_test_file.wrapped_fs.open.called
+
+    def test_read_opens_only_the_parts_it_reaches(self, fs_with_test_file):
+        # Arrange
+        fs_with_test_file.wrapped_fs.open = Mock(wraps=fs_with_test_file.wrapped_fs.open)
+        # Act
+        with fs_with_test_file.open("backup.tar", mode="rb") as f:
+            f.read(kb(1))
+            # Assert
+            assert f.parts[1] is None
+        fs_with_test_file.wrapped_fs.open.assert_called_once_with("backup.tar.part0", mode="rb")
+
+    def test_read_with_close_parts_closes_left_parts(self, fs_with_test_file):
+        # Arrange
+        fs_with_test_file.close_parts = True
+        data = fs_with_test_file.getcontents("backup.tar")
+        # Act
+        with fs_with_test_file.open("backup.tar", mode="rb") as f:
+            first_part = f.read(kb(4))
+            f.read(kb(1))
+            # Assert
+            assert f.parts[0] is None
+            assert f.parts[1] is not None
+        assert first_part == data[:kb(4)]
+
     def test_open_file_in_directory_returns_file(self, fs):
         # Arrange
         fs.wrapped_fs.makedir("foo/bar", recursive=True)
@@ -373,6 +432,511 @@ class TestPartedFS(object):
         # Assert
         assert saved_data == data
 
+    def test_walkfiles_returns_every_file_once(self, fs_with_folder_structure):
+        # Act
+        files = sorted(fs_with_folder_structure.walkfiles())
+        # Assert
+        assert files == ["/README.txt", "/backup.tar"]
+
+    def test_getmanifest_returns_none_if_manifest_disabled(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(6)))
+        # Act & Assert
+        assert fs.getmanifest("backup.tar") is None
+        assert not fs.wrapped_fs.exists("backup.tar.manifest")
+
+    def test_close_writes_manifest_with_part_sizes(self, manifest_fs):
+        # Act
+        manifest_fs.setcontents("backup.tar", urandom(kb(10)))
+        # Assert
+        manifest = manifest_fs.getmanifest("backup.tar")
+        assert manifest.part_sizes == [kb(4), kb(4), kb(2)]
+
+    def test_getsize_uses_manifest_instead_of_listing_parts(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        manifest_fs.wrapped_fs.listdir = Mock()
+        # Act
+        size = manifest_fs.getsize("backup.tar")
+        # Assert
+        assert size == kb(6)
+        assert not manifest_fs.wrapped_fs.listdir.called
+
+    def test_getinfo_uses_manifest_instead_of_listing_parts(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        manifest_fs.wrapped_fs.listdir = Mock()
+        # Act
+        info = manifest_fs.getinfo("backup.tar")
+        # Assert
+        assert info["size"] == kb(6)
+        assert len(info["parts"]) == 2
+        assert not manifest_fs.wrapped_fs.listdir.called
+
+    def test_getinfo_falls_back_to_parts_without_manifest(self, manifest_fs):
+        # Arrange
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part1", data=urandom(kb(1)))
+        # Act
+        info = manifest_fs.getinfo("backup.tar")
+        # Assert
+        assert info["size"] == kb(5)
+
+    def test_remove_deletes_manifest(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        # Act
+        manifest_fs.remove("backup.tar")
+        # Assert
+        assert manifest_fs.wrapped_fs.listdir() == []
+
+    def test_rename_renames_manifest(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        # Act
+        manifest_fs.rename("backup.tar", "backup2.tar")
+        # Assert
+        assert manifest_fs.getmanifest("backup.tar") is None
+        assert manifest_fs.getmanifest("backup2.tar").size == kb(6)
+
+    def test_copy_copies_manifest(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        # Act
+        manifest_fs.copy("backup.tar", "backup2.tar")
+        # Assert
+        assert manifest_fs.getsize("backup2.tar") == kb(6)
+
+    def test_open_for_reading_knows_size_of_file(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(10)))
+        # Act
+        f = fs.open("backup.tar", mode="rb")
+        # Assert
+        assert f.size == kb(10)
+
+    def test_seek_from_end_reads_only_last_part(self, fs):
+        # Arrange
+        data = urandom(kb(10))
+        fs.setcontents("backup.tar", data)
+        fs.wrapped_fs.open = Mock(wraps=fs.wrapped_fs.open)
+        # Act
+        with fs.open("backup.tar", mode="rb") as f:
+            f.seek(-kb(1), 2)
+            tail = f.read()
+        # Assert
+        assert tail == data[-kb(1):]
+        fs.wrapped_fs.open.assert_called_once_with("backup.tar.part2", mode="rb")
+
+    def test_seek_from_end_uses_size_of_manifest(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(10))
+        manifest_fs.setcontents("backup.tar", data)
+        manifest_fs.wrapped_fs.getsize = Mock()
+        # Act
+        with manifest_fs.open("backup.tar", mode="rb") as f:
+            f.seek(-kb(3), 2)
+            tail = f.read()
+        # Assert
+        assert tail == data[-kb(3):]
+        assert not manifest_fs.wrapped_fs.getsize.called
+
+    def test_readrange_reads_range_across_parts(self, fs):
+        # Arrange
+        data = urandom(kb(10))
+        fs.setcontents("backup.tar", data)
+        # Act
+        read_data = fs.readrange("backup.tar", kb(3), kb(2))
+        # Assert
+        assert read_data == data[kb(3):kb(5)]
+
+    def test_readrange_opens_only_parts_of_range(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(10)))
+        fs.wrapped_fs.open = Mock(wraps=fs.wrapped_fs.open)
+        # Act
+        fs.readrange("backup.tar", kb(9), kb(1))
+        # Assert
+        fs.wrapped_fs.open.assert_called_once_with("backup.tar.part2", "rb")
+
+    def test_readrange_returns_less_data_at_end_of_file(self, fs):
+        # Arrange
+        data = urandom(kb(10))
+        fs.setcontents("backup.tar", data)
+        # Act
+        read_data = fs.readrange("backup.tar", kb(7), kb(8))
+        # Assert
+        assert read_data == data[kb(7):]
+
+    def test_readrange_raises_error_if_file_does_not_exist(self, fs):
+        # Act & Assert
+        with raises(ResourceNotFoundError):
+            fs.readrange("backup.tar", 0, kb(1))
+
+    def test_readranges_returns_data_of_every_range(self, fs):
+        # Arrange
+        data = urandom(kb(10))
+        fs.setcontents("backup.tar", data)
+        ranges = [(0, kb(1)), (kb(2), kb(5)), (kb(9), kb(1))]
+        # Act
+        read_data = fs.readranges("backup.tar", ranges)
+        # Assert
+        assert read_data == [data[0:kb(1)], data[kb(2):kb(7)], data[kb(9):kb(10)]]
+
+    def test_write_records_part_checksums_in_manifest(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(10))
+        # Act
+        manifest_fs.setcontents("backup.tar", data)
+        # Assert
+        assert manifest_fs.getmanifest("backup.tar").part_checksums == [
+            sha1(data[:kb(4)]).hexdigest(),
+            sha1(data[kb(4):kb(8)]).hexdigest(),
+            sha1(data[kb(8):]).hexdigest()]
+
+    def test_write_after_seek_drops_part_checksums(self, manifest_fs):
+        # Arrange
+        manifest_fs.setcontents("backup.tar", urandom(kb(10)))
+        # Act
+        with manifest_fs.open("backup.tar", mode="wb+") as fh:
+            fh.write(urandom(kb(6)))
+            fh.seek(kb(1))
+            fh.write(urandom(kb(1)))
+        # Assert
+        assert manifest_fs.getmanifest("backup.tar").part_checksums is None
+
+    def test_updatefile_writes_only_changed_parts(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(10))
+        manifest_fs.setcontents("backup.tar", data)
+        new_data = data[:kb(5)] + urandom(kb(1)) + data[kb(6):]
+        # Act
+        written = manifest_fs.updatefile("backup.tar", BytesIO(new_data))
+        # Assert
+        assert written == [1]
+        assert manifest_fs.getcontents("backup.tar") == new_data
+
+    def test_updatefile_writes_last_and_new_parts_when_appending(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(10))
+        manifest_fs.setcontents("backup.tar", data)
+        new_data = data + urandom(kb(4))
+        # Act
+        written = manifest_fs.updatefile("backup.tar", BytesIO(new_data))
+        # Assert
+        assert written == [2, 3]
+        assert manifest_fs.getcontents("backup.tar") == new_data
+        assert manifest_fs.getmanifest("backup.tar").part_sizes == [kb(4), kb(4), kb(4), kb(2)]
+
+    def test_updatefile_removes_parts_that_are_no_longer_needed(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(10))
+        manifest_fs.setcontents("backup.tar", data)
+        # Act
+        written = manifest_fs.updatefile("backup.tar", BytesIO(data[:kb(3)]))
+        # Assert
+        assert written == [0]
+        assert sorted(manifest_fs.listparts("backup.tar")) == ["backup.tar.part0"]
+        assert manifest_fs.getcontents("backup.tar") == data[:kb(3)]
+
+    def test_updatefile_rewrites_file_without_checksums(self, fs):
+        # Arrange
+        fs.setcontents("backup.tar", urandom(kb(10)))
+        new_data = urandom(kb(6))
+        # Act
+        written = fs.updatefile("backup.tar", BytesIO(new_data))
+        # Assert
+        assert written == [0, 1]
+        assert fs.getcontents("backup.tar") == new_data
+
+    def test_settimes_updates_manifest(self, manifest_fs):
+        # Arrange
+        modified = datetime.today() - timedelta(days=10)
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        # Act
+        manifest_fs.settimes("backup.tar", modified_time=modified)
+        # Assert
+        assert manifest_fs.getinfo("backup.tar")["modified_time"] == modified
+
+    def test_append_keeps_existing_parts(self, manifest_fs):
+        # Arrange
+        data = urandom(kb(7))
+        manifest_fs.setcontents("backup.tar", data)
+        appended = urandom(kb(3))
+        # Act
+        with manifest_fs.open("backup.tar", mode="ab") as fh:
+            fh.write(appended)
+        # Assert
+        assert manifest_fs.getsize("backup.tar") == kb(10)
+        assert manifest_fs.getmanifest("backup.tar").part_sizes == [kb(4), kb(4), kb(2)]
+        assert manifest_fs.getcontents("backup.tar") == data + appended
+
+    def test_append_without_manifest_keeps_existing_parts(self, fs):
+        # Arrange
+        data = urandom(kb(8))
+        fs.setcontents("backup.tar", data)
+        # Act
+        with fs.open("backup.tar", mode="ab") as fh:
+            fh.write(b"appended")
+        # Assert
+        assert fs.getcontents("backup.tar") == data + b"appended"
+
+    def test_close_without_write_keeps_manifest(self, manifest_fs):
+        # Arrange
+        modified = datetime.today() - timedelta(days=10)
+        manifest_fs.setcontents("backup.tar", urandom(kb(6)))
+        manifest_fs.settimes("backup.tar", modified_time=modified)
+        # Act
+        with manifest_fs.open("backup.tar", mode="rb+") as fh:
+            fh.read(kb(1))
+        # Assert
+        assert manifest_fs.getinfo("backup.tar")["modified_time"] == modified
+
+    def test_read_without_manifest_does_not_write_manifest(self, manifest_fs):
+        # Arrange
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part1", data=urandom(kb(1)))
+        modified = manifest_fs.getinfo("backup.tar")["modified_time"]
+        # Act
+        with manifest_fs.open("backup.tar", mode="rb") as fh:
+            fh.read()
+        # Assert
+        assert not manifest_fs.wrapped_fs.exists("backup.tar.manifest")
+        assert manifest_fs.getinfo("backup.tar")["modified_time"] == modified
+
+    def test_append_without_manifest_keeps_created_time_of_parts(self, manifest_fs):
+        # Arrange
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part0", data=urandom(kb(4)))
+        manifest_fs.wrapped_fs.setcontents("backup.tar.part1", data=urandom(kb(1)))
+        created = manifest_fs.getinfo("backup.tar")["created_time"]
+        # Act
+        with manifest_fs.open("backup.tar", mode="ab") as fh:
+            fh.write(b"appended")
+        # Assert
+        manifest = manifest_fs.getmanifest("backup.tar")
+        assert manifest.part_sizes == [kb(4), kb(1) + len(b"appended")]
+        assert manifest.created_time == created
+
+    def test_striped_write_uploads_parts_in_background(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), upload_workers=2)
+        data = urandom(kb(10))
+        # Act
+        with fs.open("backup.tar", mode="wb") as fh:
+            fh.write(data)
+        # Assert
+        assert sorted(fs.listparts("backup.tar")) == [
+            "backup.tar.part0", "backup.tar.part1", "backup.tar.part2"]
+        assert fs.getcontents("backup.tar") == data
+
+    def test_striped_write_creates_first_part_directly(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), upload_workers=2)
+        # Act
+        with fs.open("backup.tar", mode="wb"):
+            # Assert
+            assert fs.exists("backup.tar")
+
+    def test_striped_write_places_parts_on_different_filesystems(self):
+        # Arrange
+        multifs = WritableMultiFS()
+        multifs.addfs("fs1", LimitSizeFS(MemoryFS(), kb(100)))
+        multifs.addfs("fs2", LimitSizeFS(MemoryFS(), kb(100)))
+        fs = PartedFS(multifs, kb(4), upload_workers=2)
+        # Act
+        fs.setcontents("backup.tar", urandom(kb(16)))
+        # Assert
+        assert len(multifs.fs_lookup["fs1"].listdir()) == 2
+        assert len(multifs.fs_lookup["fs2"].listdir()) == 2
+
+    def test_striped_write_raises_upload_error_on_close(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), upload_workers=2)
+        fs.wrapped_fs.setcontents = Mock(side_effect=ResourceInvalidError("backup.tar.part0"))
+        fh = fs.open("backup.tar", mode="wb")
+        fh.write(urandom(kb(6)))
+        # Act & Assert
+        with raises(ResourceInvalidError):
+            fh.close()
+
+
+    def test_prefetched_read_returns_all_parts(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        data = urandom(kb(18))
+        fs.setcontents("backup.tar", data)
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            read_data = fh.read(kb(1)) + fh.read()
+        # Assert
+        assert read_data == data
+
+    def test_prefetched_read_fetches_next_parts_ahead(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        fs.setcontents("backup.tar", urandom(kb(18)))
+        fs.wrapped_fs.getcontents = Mock(wraps=fs.wrapped_fs.getcontents)
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            fh.read(kb(1))
+            for fetch in fh._prefetched.values():
+                fetch.wait(5)
+            fetched = [c[0][0] for c in fs.wrapped_fs.getcontents.call_args_list]
+        # Assert
+        assert sorted(fetched) == ["backup.tar.part0", "backup.tar.part1", "backup.tar.part2"]
+
+    def test_prefetched_read_releases_parts_behind_file_pointer(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=1)
+        fs.setcontents("backup.tar", urandom(kb(18)))
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            fh.seek(kb(7))
+            fh.read(kb(2))
+            # Assert
+            assert sorted(fh._prefetched) == [2, 3]
+
+    def test_prefetched_read_does_not_read_ahead_after_seek(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        fs.setcontents("backup.tar", urandom(kb(18)))
+        fs.wrapped_fs.getcontents = Mock(wraps=fs.wrapped_fs.getcontents)
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            fh.seek(kb(5))
+            fh.read(kb(1))
+            fh.seek(kb(13))
+            fh.read(kb(1))
+            fetched = [c[0][0] for c in fs.wrapped_fs.getcontents.call_args_list]
+        # Assert
+        assert fetched == ["backup.tar.part1", "backup.tar.part3"]
+
+    def test_seek_cancels_pending_prefetches(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        fs.setcontents("backup.tar", urandom(kb(18)))
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            fh.read(kb(1))
+            fetches = dict(fh._prefetched)
+            fh.seek(kb(13))
+            # Assert
+            assert all(fetch.cancelled for idx, fetch in fetches.items() if idx != 3)
+            assert list(fh._prefetched) == []
+
+    def test_prefetched_readinto(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        data = urandom(kb(18))
+        fs.setcontents("backup.tar", data)
+        buf = bytearray(kb(18))
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            count = fh.readinto(buf)
+        # Assert
+        assert count == kb(18)
+        assert bytes(buf) == data
+
+    def test_prefetched_read_after_seek(self):
+        # Arrange
+        fs = PartedFS(MemoryFS(), kb(4), prefetch_parts=2)
+        data = urandom(kb(18))
+        fs.setcontents("backup.tar", data)
+        # Act
+        with fs.open("backup.tar", mode="rb") as fh:
+            fh.seek(kb(13))
+            read_data = fh.read(kb(2))
+        # Assert
+        assert read_data == data[kb(13):kb(15)]
+
+
+class TestPartPrefetcher(object):
+    def test_fetch_returns_contents(self):
+        # Arrange
+        prefetcher = PartPrefetcher(parts_ahead=1)
+        fs = MemoryFS()
+        fs.setcontents("backup.tar.part0", b"cuckoo")
+        # Act
+        result = prefetcher.fetch(fs, "backup.tar.part0")
+        # Assert
+        assert result.get(5) == b"cuckoo"
+        prefetcher.close()
+
+    def test_fetch_raises_error_on_get(self):
+        # Arrange
+        prefetcher = PartPrefetcher(parts_ahead=1)
+        # Act
+        result = prefetcher.fetch(MemoryFS(), "backup.tar.part0")
+        # Assert
+        with raises(ResourceNotFoundError):
+            result.get(5)
+        prefetcher.close()
+
+
+class TestPartUploader(object):
+    def test_submit_blocks_while_buffer_is_full(self):
+        # Arrange
+        uploader = PartUploader(workers=2, max_buffer=kb(4))
+        upload_started = threading.Event()
+        finish_upload = threading.Event()
+        fs = MemoryFS()
+
+        def slow_setcontents(path, data):
+            upload_started.set()
+            finish_upload.wait(5)
+
+        fs.setcontents = slow_setcontents
+        uploads = [uploader.submit(fs, "backup.tar.part0", urandom(kb(4)))]
+        upload_started.wait(5)
+        second = threading.Thread(target=lambda: uploads.append(
+            uploader.submit(fs, "backup.tar.part1", urandom(kb(4)))))
+        # Act
+        second.start()
+        second.join(0.2)
+        blocked = second.is_alive()
+        finish_upload.set()
+        second.join(5)
+        for upload in uploads:
+            upload.get(5)
+        # Assert
+        assert blocked
+        assert len(uploads) == 2
+        assert uploader.buffered == 0
+        uploader.close()
+
+
+class TestPartManifest(object):
+    def test_update_fills_all_parts_except_the_last(self):
+        # Arrange
+        manifest = PartManifest()
+        # Act
+        manifest.update(size=kb(9), part_count=3, max_part_size=kb(4))
+        # Assert
+        assert manifest.part_sizes == [kb(4), kb(4), kb(1)]
+        assert manifest.size == kb(9)
+
+    def test_loads_restores_dumped_manifest(self):
+        # Arrange
+        created = datetime.today() - timedelta(days=3)
+        manifest = PartManifest(part_sizes=[kb(4), kb(2)], created_time=created)
+        # Act
+        restored = PartManifest.loads(manifest.dumps())
+        # Assert
+        assert restored.part_sizes == [kb(4), kb(2)]
+        assert restored.created_time == created
+
+    def test_loads_restores_part_checksums(self):
+        # Arrange
+        manifest = PartManifest(part_sizes=[kb(4)], part_checksums=["cafe"])
+        # Act
+        restored = PartManifest.loads(manifest.dumps())
+        # Assert
+        assert restored.part_checksums == ["cafe"]
+
+    def test_load_returns_none_if_no_manifest(self):
+        # Act & Assert
+        assert PartManifest.load(MemoryFS(), "backup.tar") is None
+
 
 class TestPartedFile(object):
     @fixture
@@ -409,11 +973,33 @@ class TestPartedFile(object):
         # Assert
         assert unwritten_data is None
 
-    def test_write_returns_data_that_is_bigger_than_max_part_size(self, parted_file):
+    def test_write_writes_data_that_is_bigger_than_max_part_size_to_next_part(self, parted_file):
         # Act
         unwritten_data = parted_file._write(urandom(kb(5)))
         # Assert
-        assert len(unwritten_data) == kb(1)
+        assert unwritten_data is None
+        assert parted_file._file_pointer == kb(5)
+
+    def test_write_hands_memoryview_slices_to_parts(self, parted_file):
+        # Arrange
+        parted_file.parts[0].write = Mock()
+        parted_file.parts[1].write = Mock()
+        # Act
+        parted_file._write(urandom(kb(5)))
+        # Assert
+        written = parted_file.parts[0].write.call_args[0][0]
+        assert isinstance(written, memoryview)
+        assert len(written) == kb(4)
+        assert len(parted_file.parts[1].write.call_args[0][0]) == kb(1)
+
+    def test_write_accepts_bytearray(self, parted_file):
+        # Arrange
+        data = bytearray(urandom(kb(5)))
+        # Act
+        parted_file._write(data)
+        parted_file._seek(offset=0, whence=0)
+        # Assert
+        assert parted_file.read() == bytes(data)
 
     def test_write_with_flushing_mode_calls_itself_until_all_data_is_written(self, parted_file):
         # Act
@@ -441,16 +1027,36 @@ class TestPartedFile(object):
         # Assert
         assert parted_file._file_pointer == kb(0)
 
-    def test_seek_goes_to_current_part_and_sets_other_parts_to_start(self, parted_file):
+    def test_seek_only_repositions_current_part(self, parted_file):
         # Arrange
         parted_file.parts[0].seek = Mock()
         parted_file.parts[1].seek = Mock()
         # Act
         parted_file._seek(offset=kb(5), whence=0)
         # Assert
-        parted_file.parts[0].seek.assert_called_once_with(kb(0), 0)
+        assert not parted_file.parts[0].seek.called
         parted_file.parts[1].seek.assert_called_once_with(kb(1), 0)
 
+    def test_seek_relative_repositions_current_part(self, parted_file):
+        # Arrange
+        parted_file._file_pointer = kb(3)
+        parted_file.parts[1].seek = Mock()
+        # Act
+        parted_file._seek(offset=kb(2), whence=1)
+        # Assert
+        parted_file.parts[1].seek.assert_called_once_with(kb(1), 0)
+
+    def test_read_after_seek_starts_next_part_at_beginning(self, parted_file):
+        # Arrange
+        data = urandom(kb(6))
+        parted_file._write(data, flushing=True)
+        parted_file._seek(offset=kb(3), whence=0)
+        # Act
+        chunk1 = parted_file._read(kb(1))
+        chunk2 = parted_file._read(kb(2))
+        # Assert
+        assert chunk1 + chunk2 == data[kb(3):kb(6)]
+
     def test_seek_relative_should_add_ofset_to_filepointer(self, parted_file):
         # Arrange
         parted_file._file_pointer = kb(1)
@@ -459,13 +1065,22 @@ class TestPartedFile(object):
         # Assert
         assert parted_file._file_pointer == kb(2)
 
-    @mark.xfail
     def test_seek_relative_to_end_should_set_filepointer_to_last_part(self, parted_file):
+        # Arrange
+        parted_file._size = kb(8)
         # Act
         parted_file._seek(offset=-kb(4), whence=2)
         # Assert
         assert parted_file._file_pointer == kb(4)
 
+    def test_seek_relative_to_end_after_write(self, parted_file):
+        # Arrange
+        parted_file._write(urandom(kb(6)))
+        # Act
+        parted_file._seek(offset=-kb(1), whence=2)
+        # Assert
+        assert parted_file._file_pointer == kb(5)
+
     def test_tell_returns_file_pointer(self, parted_file):
         # Arrange
         parted_file._file_pointer = kb(2)
@@ -474,14 +1089,35 @@ class TestPartedFile(object):
         # Assert
         assert pos == kb(2)
 
-    def test_read_returns_data_from_current_part_and_calls_itself_for_next_part(self, parted_file):
+    def test_read_returns_only_rest_of_current_part_without_sizehint(self, parted_file):
         # Arrange
         parted_file._write(urandom(kb(5)), flushing=True)
         parted_file._seek(offset=kb(3), whence=0)
         # Act
         read_data = parted_file._read()
         # Assert
-        assert len(read_data) == kb(2)
+        assert len(read_data) == kb(1)
+
+    def test_read_returns_at_most_read_buffer_size(self, parted_file):
+        # Arrange
+        parted_file._read_buffer_size = kb(1)
+        parted_file._write(urandom(kb(5)), flushing=True)
+        parted_file._seek(offset=0, whence=0)
+        # Act
+        read_data = parted_file._read()
+        # Assert
+        assert len(read_data) == kb(1)
+
+    def test_read_without_size_reads_all_parts(self, parted_file):
+        # Arrange
+        data = urandom(kb(9))
+        parted_file._read_buffer_size = kb(1)
+        parted_file._write(data, flushing=True)
+        parted_file._seek(offset=kb(3), whence=0)
+        # Act
+        read_data = parted_file.read()
+        # Assert
+        assert read_data == data[kb(3):]
 
     def test_read_returns_data_from_current_part_in_chunks(self, parted_file):
         # Arrange
@@ -508,6 +1144,7 @@ class TestPartedFile(object):
         parted_file._write(urandom(kb(5)), flushing=True)
         parted_file._seek(offset=0, whence=0)
         parted_file._read()
+        parted_file._read()
         # Act
         eof = parted_file._read()
         # Assert
@@ -523,6 +1160,39 @@ class TestPartedFile(object):
         # Assert
         assert eof is None
 
+    def test_readinto_fills_buffer_across_parts(self, parted_file):
+        # Arrange
+        data = urandom(kb(6))
+        parted_file._write(data)
+        parted_file._seek(offset=kb(3), whence=0)
+        buf = bytearray(kb(2))
+        # Act
+        count = parted_file.readinto(buf)
+        # Assert
+        assert count == kb(2)
+        assert bytes(buf) == data[kb(3):kb(5)]
+
+    def test_readinto_returns_zero_at_end_of_file(self, parted_file):
+        # Arrange
+        parted_file._write(urandom(kb(6)))
+        parted_file._seek(offset=kb(6), whence=0)
+        # Act
+        count = parted_file.readinto(bytearray(kb(1)))
+        # Assert
+        assert count == 0
+
+    def test_readinto_returns_buffered_data_first(self, parted_file):
+        # Arrange
+        data = urandom(kb(6))
+        parted_file._write(data)
+        parted_file.seek(0)
+        first_line = parted_file.readline()
+        buf = bytearray(kb(1))
+        # Act
+        parted_file.readinto(buf)
+        # Assert
+        assert bytes(buf) == data[len(first_line):len(first_line) + kb(1)]
+
     def test_close_calls_super_for_flush_and_closes_all_parts(self, parted_file):
         # Arrange
         parted_file._write(urandom(kb(4)))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import threading
+import time
+
+from pytest import raises
+
+from cuckoodrive.pipeline import Pipeline
+
+
+class TestPipeline(object):
+    def test_run_passes_items_through_all_stages(self):
+        # Arrange
+        results = []
+        stages = [(lambda x: x * 2, 3), (results.append, 2)]
+        # Act
+        Pipeline(range(100), stages, queue_size=4).run()
+        # Assert
+        assert sorted(results) == [x * 2 for x in range(100)]
+
+    def test_run_drops_items_a_stage_returns_none_for(self):
+        # Arrange
+        results = []
+        stages = [(lambda x: x if x % 2 else None, 2), (results.append, 1)]
+        # Act
+        Pipeline(range(10), stages).run()
+        # Assert
+        assert sorted(results) == [1, 3, 5, 7, 9]
+
+    def test_run_runs_workers_of_a_stage_at_the_same_time(self):
+        # Arrange
+        running = []
+        barrier = threading.Event()
+
+        def wait_for_others(item):
+            running.append(item)
+            if len(running) == 4:
+                barrier.set()
+            assert barrier.wait(5)
+
+        # Act
+        Pipeline(range(4), [(wait_for_others, 4)]).run()
+        # Assert
+        assert barrier.is_set()
+
+    def test_run_does_not_read_source_ahead_of_bounded_queues(self):
+        # Arrange
+        scanned = []
+
+        def source():
+            for item in range(100):
+                scanned.append(item)
+                yield item
+
+        def slow(item):
+            if item == 0:
+                time.sleep(0.1)
+                assert len(scanned) < 10
+
+        # Act
+        Pipeline(source(), [(slow, 1)], queue_size=2).run()
+        # Assert
+        assert len(scanned) == 100
+
+    def test_run_raises_first_error_and_stops_starting_items(self):
+        # Arrange
+        processed = []
+
+        def fail(item):
+            processed.append(item)
+            if item == 0:
+                raise ValueError("failed")
+
+        # Act & Assert
+        with raises(ValueError):
+            Pipeline(range(1000), [(fail, 1), (lambda x: x, 1)], queue_size=2).run()
+        assert len(processed) < 1000
+
+    def test_run_raises_error_of_source(self):
+        # Arrange
+        def source():
+            yield 1
+            raise IOError("walk failed")
+
+        # Act & Assert
+        with raises(IOError):
+            Pipeline(source(), [(lambda x: x, 2)]).run()
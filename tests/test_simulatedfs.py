@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+import time
+import unittest
+
+from pytest import fixture, raises
+
+from fs.errors import RemoteConnectionError, StorageSpaceError
+from fs.opener import opener
+from fs.tests import FSTestCases
+
+from cuckoodrive import CuckooDriveFS
+from cuckoodrive.multifs import free_space
+from cuckoodrive.simulatedfs import SimulatedFS, SimulatedOpener, constant, lognormal, uniform
+from cuckoodrive.utils import kb, mb
+
+
+class TestExternalSimulatedFS(unittest.TestCase, FSTestCases):
+    def setUp(self):
+        self.fs = SimulatedFS(quota=mb(100))
+
+    def tearDown(self):
+        # The quota has to be accounted correctly by all operations
+        used = sum(self.fs.getsize(path) for path in self.fs.walkfiles())
+        assert self.fs.used == used
+        self.fs.close()
+
+
+class TestLatencyDistributions(object):
+    def test_constant(self):
+        assert constant(0.1)(None) == 0.1
+
+    def test_uniform_stays_within_bounds(self):
+        # Arrange
+        import random
+        rand = random.Random(1)
+        # Act
+        latencies = [uniform(0.1, 0.2)(rand) for _ in range(100)]
+        # Assert
+        assert all(0.1 <= latency <= 0.2 for latency in latencies)
+
+    def test_lognormal_is_around_median(self):
+        # Arrange
+        import random
+        rand = random.Random(1)
+        # Act
+        latencies = sorted(lognormal(0.1, 0.5)(rand) for _ in range(1001))
+        # Assert
+        assert 0.08 < latencies[500] < 0.12
+
+
+class TestSimulatedFS(object):
+    @fixture
+    def fs(self):
+        return SimulatedFS(quota=kb(10), seed=1)
+
+    def test_operations_are_counted(self, fs):
+        # Act
+        fs.makedir("dir")
+        fs.setcontents("dir/file", b"x" * 100)
+        fs.exists("dir/file")
+        fs.getcontents("dir/file")
+        # Assert
+        assert fs.counts["makedir"] == 1
+        assert fs.counts["open"] == 2
+        assert fs.counts["exists"] == 1
+        assert fs.uploaded == 100
+        assert fs.downloaded == 100
+
+    def test_operations_wait_for_latency(self):
+        # Arrange
+        fs = SimulatedFS(latency=constant(0), latencies={"exists": constant(0.1)})
+        # Act
+        start = time.time()
+        fs.isdir("/")
+        fs.exists("file")
+        # Assert
+        assert 0.1 <= time.time() - start < 0.2
+
+    def test_writes_wait_for_upload_rate(self):
+        # Arrange
+        fs = SimulatedFS(upload_rate=kb(100))
+        # Act
+        start = time.time()
+        fs.setcontents("file", b"x" * kb(20))
+        # Assert
+        assert time.time() - start >= 0.15
+
+    def test_reads_wait_for_download_rate(self):
+        # Arrange
+        fs = SimulatedFS(download_rate=kb(100))
+        fs.setcontents("file", b"x" * kb(20))
+        # Act
+        start = time.time()
+        fs.getcontents("file")
+        # Assert
+        assert time.time() - start >= 0.15
+
+    def test_free_space_is_quota_minus_files(self, fs):
+        # Arrange
+        fs.setcontents("file1", b"x" * kb(4))
+        fs.setcontents("file2", b"x" * kb(2))
+        # Act
+        fs.remove("file2")
+        # Assert
+        assert free_space(fs) == kb(6)
+
+    def test_overwritten_file_gives_quota_back(self, fs):
+        # Arrange
+        fs.setcontents("file", b"x" * kb(8))
+        # Act
+        fs.setcontents("file", b"x" * kb(4))
+        # Assert
+        assert free_space(fs) == kb(6)
+
+    def test_write_beyond_quota_raises_error(self, fs):
+        # Act & Assert
+        with raises(StorageSpaceError):
+            fs.setcontents("file", b"x" * kb(11))
+
+    def test_without_quota_has_no_free_space(self):
+        # Act & Assert
+        assert not SimulatedFS().hasmeta("free_space")
+
+    def test_fail_next_fails_operations(self, fs):
+        # Arrange
+        fs.fail_next("exists", count=2)
+        # Act & Assert
+        for _ in range(2):
+            with raises(RemoteConnectionError):
+                fs.exists("file")
+        assert not fs.exists("file")
+
+    def test_failure_rate_fails_some_operations(self):
+        # Arrange
+        fs = SimulatedFS(failure_rate=0.5, seed=1)
+        failures = 0
+        # Act
+        for _ in range(100):
+            try:
+                fs.exists("file")
+            except RemoteConnectionError:
+                failures += 1
+        # Assert
+        assert 30 < failures < 70
+
+
+class TestSimulatedOpener(object):
+    @fixture(autouse=True)
+    def register(self):
+        opener.add(SimulatedOpener)
+        SimulatedOpener.instances.clear()
+
+    def test_query_parameters_configure_fs(self):
+        # Act
+        fs, _ = opener.parse("sim://remote1?latency=0.1&jitter=0.05&upload_rate=1024"
+                             "&quota=2048&failure_rate=0.1&seed=3")
+        # Assert
+        assert isinstance(fs, SimulatedFS)
+        assert fs.upload_limit.rate == 1024
+        assert fs.download_limit is None
+        assert fs.quota == 2048
+        assert fs.failure_rate == 0.1
+
+    def test_same_name_returns_same_fs(self):
+        # Act
+        fs1, _ = opener.parse("sim://remote1?quota=2048")
+        fs2, _ = opener.parse("sim://remote1")
+        fs3, _ = opener.parse("sim://remote2")
+        # Assert
+        assert fs1 is fs2
+        assert fs1 is not fs3
+
+    def test_cuckoodrivefs_from_uris(self):
+        # Arrange
+        fs = CuckooDriveFS.from_uris(["sim://remote1?quota={0}".format(mb(10)),
+                                      "sim://remote2?quota={0}".format(mb(10))])
+        data = b"x" * kb(100)
+        # Act
+        fs.setcontents("file", data)
+        # Assert
+        assert fs.getcontents("file", "rb") == data
+        remotes = [SimulatedOpener.instances["remote1"], SimulatedOpener.instances["remote2"]]
+        assert sum(remote.uploaded for remote in remotes) >= len(data)
+        fs.close()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+from datetime import datetime, timedelta
+
+from pytest import fixture
+
+from fs.tempfs import TempFS
+
+from cuckoodrive.syncstate import SyncState, sync_state_file
+from cuckoodrive.utils import kb, mb
+
+
+class TestSyncState(object):
+    @fixture
+    def state(self, request):
+        state = SyncState()
+        request.addfinalizer(state.close)
+        return state
+
+    @fixture
+    def info(self):
+        return {"size": kb(4), "modified_time": datetime(2014, 5, 1, 12, 30, 15, 250)}
+
+    def test_get_returns_none_for_unknown_path(self, state):
+        # Act & Assert
+        assert state.get("backup.tar") is None
+
+    def test_record_stores_size_modified_time_and_part_size(self, state, info):
+        # Act
+        state.record("backup.tar", info, part_size=mb(10))
+        # Assert
+        recorded = state.get("/backup.tar")
+        assert recorded["size"] == kb(4)
+        assert recorded["part_size"] == mb(10)
+
+    def test_unchanged_returns_true_for_recorded_info(self, state, info):
+        # Arrange
+        state.record("backup.tar", info, part_size=mb(10))
+        # Act & Assert
+        assert state.unchanged("backup.tar", dict(info), part_size=mb(10))
+
+    def test_unchanged_returns_false_if_modified_time_changed(self, state, info):
+        # Arrange
+        state.record("backup.tar", info)
+        info["modified_time"] += timedelta(seconds=1)
+        # Act & Assert
+        assert not state.unchanged("backup.tar", info)
+
+    def test_unchanged_returns_false_if_part_size_changed(self, state, info):
+        # Arrange
+        state.record("backup.tar", info, part_size=mb(10))
+        # Act & Assert
+        assert not state.unchanged("backup.tar", info, part_size=mb(20))
+
+    def test_remove_forgets_path_and_children(self, state, info):
+        # Arrange
+        state.record("backups")
+        state.record("backups/backup.tar", info)
+        state.record("backups2/backup.tar", info)
+        # Act
+        state.remove("backups")
+        # Assert
+        assert state.paths() == ["/backups2/backup.tar"]
+
+    def test_state_is_persisted_in_database(self, info):
+        # Arrange
+        tempfs = TempFS()
+        database = tempfs.getsyspath("sync_state.db")
+        state = SyncState(database)
+        state.record("backup.tar", info)
+        state.close()
+        # Act
+        reopened = SyncState(database)
+        # Assert
+        assert reopened.unchanged("backup.tar", info)
+        reopened.close()
+        tempfs.close()
+
+    def test_sync_state_file_differs_per_remotes(self):
+        # Act & Assert
+        assert sync_state_file("/home/cuckoo", ["/tmp/fs1"]) != \
+            sync_state_file("/home/cuckoo", ["/tmp/fs2"])